@@ -0,0 +1,173 @@
+"""
+This module contains the on-the-fly augmentation of the training images with
+random rigid transforms.
+
+Each transform is resampled with a single map_coordinates pass over a
+precomputed, centered voxel grid of the image shape. The transforms are drawn
+from a given random generator, so a seeded input reproduces its augmented
+batches.
+"""
+
+import math
+import numpy as np
+import scipy.ndimage as snd
+
+# Axes of the rotation planes, as in scipy.ndimage.rotate
+PLANES = {'x': (0, 1), 'y': (0, 2), 'z': (1, 2)}
+AXES = {'x': 0, 'y': 1, 'z': 2}
+
+
+class Augmentation:
+    """
+    Initialize this class with the augmentation spec, e.g. the 'augmentation'
+    section of the cnn parameters:
+        rotation: maximum rotation angle in degrees (default 3)
+        translation: maximum translation in voxels (default 4)
+        probability: fraction of the images which are transformed (default
+                     6/7, the former files had 6 variants per original)
+        mode: 'single' rotates in one plane or translates along one axis per
+              image like the former 'rot<x|y|z>' and 'trans<x|y|z>' files,
+              'combined' applies a rotation in every plane and a translation
+              along every axis at once (default 'single')
+        order: spline order of the interpolation (default 1)
+        boundary: how values outside the image are filled, as the mode of
+                  scipy.ndimage.map_coordinates (default 'nearest')
+    """
+
+    def __init__(self, rotation=3, translation=4, probability=6 / 7,
+                 mode='single', order=1, boundary='nearest'):
+        if mode not in ['single', 'combined']:
+            raise ValueError("Unknown augmentation mode " + str(mode))
+        self.rotation = rotation
+        self.translation = translation
+        self.probability = probability
+        self.mode = mode
+        self.order = order
+        self.boundary = boundary
+        self.grids = {}
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Returns: the augmentation configured with the 'augmentation' section
+        of the cnn parameters, None if it is not set.
+        """
+        spec = params.get('augmentation')
+        if not spec:
+            return None
+        if not isinstance(spec, dict):
+            spec = {}
+        return cls(**spec)
+
+    def grid(self, shape):
+        """
+        Returns: the voxel coordinates of the given shape relative to its
+        center as a (3, num_voxels) array, computed once per shape
+        """
+        shape = tuple(shape)
+        if shape not in self.grids:
+            center = (np.array(shape, dtype=np.float32) - 1) / 2
+            grid = np.indices(shape, dtype=np.float32).reshape(3, -1)
+            self.grids[shape] = grid - center[:, None]
+        return self.grids[shape]
+
+    @staticmethod
+    def rotation_matrix(plane, angle):
+        """
+        Returns: the 3x3 matrix mapping output to input coordinates of a
+        rotation by 'angle' degrees in the plane spanned by the two given
+        axes, in the direction of scipy.ndimage.rotate
+        """
+        matrix = np.eye(3)
+        cos, sin = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+        first, second = plane
+        matrix[first, first] = cos
+        matrix[first, second] = sin
+        matrix[second, first] = -sin
+        matrix[second, second] = cos
+        return matrix
+
+    def sample(self, rng):
+        """
+        Draws a random rigid transform.
+        Args:
+            rng: random.Random generator
+
+        Returns: (matrix, shift) mapping output to input coordinates around
+        the image center, or None if the image stays unchanged
+        """
+        if rng.random() >= self.probability:
+            return None
+        matrix = np.eye(3)
+        shift = np.zeros(3)
+        if self.mode == 'single':
+            kind = rng.choice(['rot', 'trans'])
+            direction = rng.choice(['x', 'y', 'z'])
+            if kind == 'rot':
+                matrix = self.rotation_matrix(PLANES[direction], rng.uniform(
+                    -self.rotation, self.rotation))
+            else:
+                shift[AXES[direction]] = rng.uniform(-self.translation,
+                                                     self.translation)
+        else:
+            for direction in ['x', 'y', 'z']:
+                matrix = matrix.dot(self.rotation_matrix(
+                    PLANES[direction],
+                    rng.uniform(-self.rotation, self.rotation)))
+            shift = np.array([rng.uniform(-self.translation, self.translation)
+                              for _ in range(3)])
+        return matrix, shift
+
+    def transform(self, image, transform, output=None):
+        """
+        Resamples an image with a transform drawn by sample().
+        Args:
+            image: 3D image array
+            transform: (matrix, shift) or None
+            output: optional float32 array of the image shape to write to
+
+        Returns: the transformed image
+        """
+        if output is None:
+            output = np.empty(image.shape, dtype=np.float32)
+        if transform is None:
+            output[...] = image
+            return output
+        matrix, shift = transform
+        center = (np.array(image.shape, dtype=np.float32) - 1) / 2
+        # The input voxel of each output voxel, shifted back by 'shift'
+        coordinates = matrix.astype(np.float32).dot(self.grid(image.shape))
+        coordinates += (center - shift.astype(np.float32))[:, None]
+        output[...] = snd.map_coordinates(
+            image, coordinates, order=self.order,
+            mode=self.boundary).reshape(image.shape)
+        return output
+
+    def augment(self, batches, rng):
+        """
+        Transforms the images of already loaded batches in place, with one
+        random transform per image shared by all channels and modalities.
+        Args:
+            batches: batch array of shape [batch, depth, height, width,
+                     channels] or a list of such arrays, one per modality
+            rng: random.Random generator
+
+        Returns: the transformed batches
+        """
+        arrays = batches if isinstance(batches, list) else [batches]
+        for iterate in range(0, len(arrays[0])):
+            transform = self.sample(rng)
+            if transform is None:
+                continue
+            for batch in arrays:
+                for channel in range(0, batch.shape[-1]):
+                    image = np.array(batch[iterate, :, :, :, channel])
+                    self.transform(image, transform,
+                                   batch[iterate, :, :, :, channel])
+        return batches
+
+    def __getstate__(self):
+        # The grids are recomputed in worker processes
+        state = dict(self.__dict__)
+        state['grids'] = {}
+        return state
@@ -0,0 +1,185 @@
+"""
+This module contains the augmentation manifest, which replaces the rotated
+and translated copies of the images written by DataPipeline.rot_trans,
+rotate and translate.
+
+The manifest maps the name of each augmented image, e.g.
+CON001-T1_brain_sub_rot3_x.nii.gz, to its source image in the same folder and
+the rigid transform which produced it. The training inputs add these names to
+their file lists and resample the source image when a batch is read, so the
+augmented images are drawn as before without being stored. Optionally the most
+recently read augmented images are kept in memory.
+"""
+
+import os
+import json
+import threading
+import collections
+import numpy as np
+
+from dementia_prediction.augmentation import Augmentation
+from dementia_prediction.volume_cache import load_volume
+
+# The plane perpendicular to each rotation axis of makerot, with its axes
+# ordered so that a positive angle turns as the makerot matrix applied by
+# SimulatedExecutor.flirt
+AXIS_PLANES = {'x': (1, 2), 'y': (2, 0), 'z': (0, 1)}
+
+
+def rotation(direction, angle):
+    """
+    Returns: (matrix, shift) of a rotation by 'angle' degrees around the
+    image center and the axis 'direction'. The rotation is in voxel indices
+    around the center (shape - 1) / 2, as SimulatedExecutor applies the
+    matrix of 'makerot -a <axis> -t <angle>'. FSL's flirt transforms scaled
+    millimetre coordinates and flips the x axis of images with a positive
+    determinant, so its output may differ.
+    """
+    return Augmentation.rotation_matrix(AXIS_PLANES[direction], angle), \
+        np.zeros(3)
+
+
+def translation(shift):
+    """
+    Returns: (matrix, shift) of a translation by 'shift' voxels, as
+    scipy.ndimage.shift
+    """
+    return np.eye(3), np.asarray(shift, dtype=np.float64)
+
+
+def compose(first, second):
+    """
+    Returns: (matrix, shift) of the transform 'first' followed by 'second'
+    """
+    matrix = first[0].dot(second[0])
+    return matrix, first[1] + first[0].dot(second[1])
+
+
+class AugmentationManifest:
+    """
+    Initialize this class with the path of the JSON manifest, which is
+    created on the first save().
+        cache_size: number of augmented images kept in memory, 0 for none
+                    (default 0)
+        order: spline order of the resampling, None for the interpolation
+               of the images the manifest replaces: cubic for translations
+               as scipy.ndimage.shift, trilinear for rotations as flirt
+               (default None)
+        boundary: how values outside the image are filled, as the mode of
+                  scipy.ndimage.map_coordinates (default 'nearest')
+    """
+
+    def __init__(self, path, cache_size=0, order=None, boundary='nearest'):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as filep:
+                self.entries = json.load(filep)
+        self.cache_size = cache_size
+        self.order = order
+        self.boundary = boundary
+        self.resamplers = {}
+        self.lock = threading.Lock()
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Returns: the manifest of the 'augmentation_manifest' path of the
+        parameters with an optional 'augmentation_cache' size, None if no
+        manifest is set.
+        """
+        if not (params or {}).get('augmentation_manifest'):
+            return None
+        return cls(params['augmentation_manifest'],
+                   int(params.get('augmentation_cache', 0)))
+
+    def resampler(self, matrix):
+        """
+        Returns: the Augmentation resampling a transform with the matrix
+        """
+        order = self.order
+        if order is None:
+            # A rotated and translated image was rotated by flirt first
+            order = 3 if np.array_equal(matrix, np.eye(3)) else 1
+        if order not in self.resamplers:
+            self.resamplers[order] = Augmentation(order=order,
+                                                  boundary=self.boundary)
+        return self.resamplers[order]
+
+    def add(self, name, source, transform):
+        """
+        Records an augmented image.
+        Args:
+            name: file name of the augmented image
+            source: path or file name of its source image, which is in the
+                    same folder
+            transform: (matrix, shift) mapping output to input coordinates
+                       around the image center, see Augmentation.transform()
+        """
+        matrix, shift = transform
+        self.entries[os.path.basename(name)] = {
+            'source': os.path.basename(source),
+            'matrix': np.asarray(matrix).tolist(),
+            'shift': np.asarray(shift).tolist()}
+
+    def save(self):
+        tmp_path = self.path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'w') as filep:
+            json.dump(self.entries, filep, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def expand(self, files):
+        """
+        Returns: the files followed by the augmented images of each of them
+        """
+        names = collections.defaultdict(list)
+        for name, entry in sorted(self.entries.items()):
+            names[entry['source']].append(name)
+        augmented = [os.path.join(os.path.dirname(filename), name)
+                     for filename in files
+                     for name in names[os.path.basename(filename)]]
+        return list(files) + augmented
+
+    def load(self, filename, cache=None):
+        """
+        Returns: the image, resampled from its source image if it is an
+        augmented image of the manifest
+        Args:
+            filename: path of the image
+            cache: VolumeCache of the source images or None
+        """
+        entry = self.entries.get(os.path.basename(filename))
+        if entry is None:
+            return load_volume(filename, cache)
+        with self.lock:
+            if filename in self.cache:
+                self.cache.move_to_end(filename)
+                self.hits += 1
+                return self.cache[filename]
+            self.misses += 1
+        source = os.path.join(os.path.dirname(filename), entry['source'])
+        image = np.asarray(load_volume(source, cache), dtype=np.float32)
+        transform = (np.array(entry['matrix']), np.array(entry['shift']))
+        image = self.resampler(transform[0]).transform(image, transform)
+        if self.cache_size > 0:
+            # Cached images are shared by the batches
+            image.flags.writeable = False
+            with self.lock:
+                self.cache[filename] = image
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return image
+
+    def __getstate__(self):
+        # Worker processes start with an empty cache and their own lock
+        state = dict(self.__dict__)
+        del state['lock']
+        state['cache'] = collections.OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
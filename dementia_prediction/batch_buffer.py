@@ -0,0 +1,59 @@
+"""
+This module contains the preallocated batch arrays of the input classes.
+"""
+
+import threading
+import numpy as np
+
+
+class BatchBuffer:
+    """
+    Provides the arrays into which the input classes assemble their batches.
+    With 'num_buffers' 0 a new array is allocated for every batch. Otherwise
+    the arrays are reused across steps, cycling through 'num_buffers' arrays
+    per key, so a batch stays valid until 'num_buffers' further batches have
+    been assembled (2 gives double buffering).
+    """
+
+    def __init__(self, num_buffers=0, dtype=np.float32):
+        self.num_buffers = num_buffers
+        self.dtype = dtype
+        self.buffers = {}
+        self.position = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Returns: the buffer configured with the optional 'batch_buffers'
+        count of the cnn parameters.
+        """
+        return cls(params.get('batch_buffers', 0))
+
+    def get(self, shape, key=0):
+        """
+        Returns: an uninitialized array of the given shape for the next batch
+        of 'key', e.g. the index of the image modality.
+        """
+        shape = tuple(shape)
+        if self.num_buffers == 0:
+            return np.empty(shape, dtype=self.dtype)
+        with self.lock:
+            buffers = self.buffers.setdefault(key, [None] * self.num_buffers)
+            if len(buffers) < self.num_buffers:
+                buffers += [None] * (self.num_buffers - len(buffers))
+            position = self.position.get(key, 0)
+            self.position[key] = (position + 1) % self.num_buffers
+            if buffers[position] is None or buffers[position].shape != shape:
+                buffers[position] = np.empty(shape, dtype=self.dtype)
+            return buffers[position]
+
+    def __getstate__(self):
+        # The lock and the reused arrays are not sent to worker processes
+        state = dict(self.__dict__)
+        state.update({'buffers': {}, 'position': {}, 'lock': None})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
@@ -0,0 +1,207 @@
+"""
+This module contains a persistent catalog of the image files in a data
+folder.
+
+The folder tree is listed once and stored in an index. Later queries only
+list the directories whose modification time changed since, i.e. in which
+files were added, removed or renamed, and those which were listed within
+the timestamp resolution of their last change, as files added in the same
+tick leave the modification time unchanged. The size and modification time
+of the files matching a query are read when it is answered, so files
+rewritten in place are reported with their current values. This avoids
+walking large network mounted data folders for every experiment and
+preprocessing stage.
+"""
+
+import os
+import re
+import time
+import pickle
+import hashlib
+import collections
+
+# Default folder of the catalog indices
+CATALOG_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                           'dementia_prediction', 'catalog')
+
+# Seconds, the modification times of FAT and of some network file systems
+# are only accurate to 2 seconds
+MTIME_RESOLUTION = 2.0
+
+CatalogEntry = collections.namedtuple(
+    'CatalogEntry', ['patient_code', 'modality', 'stage', 'path', 'size',
+                     'mtime'])
+
+
+def patient_code(filename, split_on):
+    """
+    Returns: the patient code of an image, the filename up to 'split_on'
+    """
+    return filename.rsplit(split_on)[0].rsplit('/', 1)[1]
+
+
+class Catalog:
+    """
+    Initialize this class with the data folder, optionally the folder of the
+    catalog indices and the modality of the images in the data folder.
+    """
+
+    def __init__(self, root, catalog_dir=None, modality=None):
+        self.root = root
+        self.modality = modality
+        if catalog_dir is None:
+            catalog_dir = CATALOG_DIR
+        if not os.path.exists(catalog_dir):
+            os.makedirs(catalog_dir, exist_ok=True)
+        key = hashlib.md5(os.path.abspath(root).encode()).hexdigest()
+        self.index_path = os.path.join(catalog_dir, key[:12] + '.pkl')
+        self.dirs = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as filep:
+                index = pickle.load(filep)
+            if index['root'] == root:
+                self.dirs = index['dirs']
+
+    @classmethod
+    def from_params(cls, params, root, modality=None):
+        """
+        Returns: the catalog of 'root' with the indices in the optional
+        'catalog_dir' folder of the parameters
+        """
+        return cls(root, params.get('catalog_dir'), modality)
+
+    def scan(self, dirpath, mtime):
+        scanned = time.time()
+        files = []
+        subdirs = []
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        # Symbolic links to folders are not followed, as in
+                        # os.walk
+                        if not entry.is_symlink():
+                            subdirs.append(entry.name)
+                        continue
+                    # Broken links are skipped
+                    entry.stat()
+                except OSError:
+                    continue
+                files.append(entry.name)
+        return {'mtime': mtime, 'scanned': scanned, 'files': sorted(files),
+                'subdirs': sorted(subdirs)}
+
+    @staticmethod
+    def changed(entry, mtime):
+        """
+        Returns: True if the directory of the index entry has to be listed
+        again, as its modification time changed or it was listed less than
+        the timestamp resolution after it
+        """
+        return entry is None or entry['mtime'] != mtime or \
+            entry.get('scanned', 0) < mtime + MTIME_RESOLUTION
+
+    def refresh(self):
+        """
+        Updates the index, listing only new and changed directories.
+
+        Returns: the number of listed directories
+        """
+        dirs = {}
+        scanned = 0
+        stack = [self.root]
+        while stack:
+            dirpath = stack.pop()
+            try:
+                mtime = os.stat(dirpath).st_mtime
+            except OSError:
+                continue
+            entry = self.dirs.get(dirpath)
+            if self.changed(entry, mtime):
+                entry = self.scan(dirpath, mtime)
+                scanned += 1
+            dirs[dirpath] = entry
+            stack.extend(os.path.join(dirpath, subdir)
+                         for subdir in reversed(entry['subdirs']))
+        if scanned or len(dirs) != len(self.dirs):
+            self.dirs = dirs
+            self.save()
+        return scanned
+
+    def save(self):
+        tmp_path = self.index_path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'wb') as filep:
+            pickle.dump({'root': self.root, 'dirs': self.dirs}, filep)
+        os.replace(tmp_path, self.index_path)
+
+    def walk(self):
+        """
+        Returns: the refreshed folder tree as (dirpath, dirnames, filenames)
+        tuples in the format of os.walk, top-down and sorted by name
+        """
+        self.refresh()
+        tree = []
+        stack = [self.root]
+        while stack:
+            dirpath = stack.pop()
+            entry = self.dirs[dirpath]
+            tree.append((dirpath, list(entry['subdirs']),
+                         sorted(entry['files'])))
+            stack.extend(os.path.join(dirpath, subdir)
+                         for subdir in reversed(entry['subdirs']))
+        return tree
+
+    def entries(self, regex=None, split_on=None):
+        """
+        Finds the images matching a regular expression.
+        Args:
+            regex: regular expression searched in the file paths, all files
+                   if None
+            split_on: filename part following the patient code, the patient
+                      code and stage are None if not given
+
+        Returns: list of CatalogEntry with the patient code, the modality of
+        the catalog, the stage (the filename from 'split_on' on), the path,
+        current size and modification time of each matching file
+        """
+        matches = []
+        for dirpath, _, filenames in self.walk():
+            for filename in filenames:
+                input_file = os.path.join(dirpath, filename)
+                if regex is not None and not re.search(regex, input_file):
+                    continue
+                try:
+                    stat = os.stat(input_file)
+                except OSError:
+                    continue
+                code = stage = None
+                if split_on is not None:
+                    code = patient_code(input_file, split_on)
+                    stage = split_on + input_file.rsplit(split_on, 1)[-1] \
+                        if split_on in filename else None
+                matches.append(CatalogEntry(code, self.modality, stage,
+                                            input_file, stat.st_size,
+                                            stat.st_mtime))
+        return matches
+
+    def files(self, regex, split_on, patients):
+        """
+        Returns: the paths of the images matching 'regex' of the patients in
+        'patients'
+        """
+        return [entry.path for entry in self.entries(regex, split_on)
+                if entry.patient_code in patients]
+
+    def files_per_class(self, regex, split_on, class_labels, patients,
+                        num_classes):
+        """
+        Returns: a list per class with the paths of the images matching
+        'regex' of the patients in 'patients', using the class labels of the
+        'class_labels' dictionary
+        """
+        class_files = [[] for i in range(0, num_classes)]
+        for entry in self.entries(regex, split_on):
+            if entry.patient_code in patients:
+                class_files[class_labels[entry.patient_code]].append(
+                    entry.path)
+        return class_files
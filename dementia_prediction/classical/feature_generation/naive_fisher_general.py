@@ -1,10 +1,8 @@
 
 import nibabel as nb
 import numpy as np
-import os
 import math
 from os import path
-import re
 import sys
 import pickle
 import sklearn.preprocessing as pre
@@ -12,6 +10,8 @@ import argparse
 
 from pathos.multiprocessing import ProcessPool
 from dementia_prediction.config_wrapper import Config
+from dementia_prediction.catalog import Catalog
+from dementia_prediction.manifest import load_patients
 
 config = Config()
 parser = argparse.ArgumentParser(description="Generate General Fisher Score "
@@ -23,8 +23,8 @@ params = config.config.get('parameters')
 data_path = params['datadir']
 
 # Patient code and his class label.
-patients_dict = pickle.load(open(params['patient_dict'], 'rb'))
-train_patients = pickle.load(open(params['train_dict'], 'rb'))
+patients_dict = load_patients(params, 'patient_dict')
+train_patients = load_patients(params, 'train_dict', 'train')
 output_features = params['features_path']
 print("Patients:", len(patients_dict), "Train: ", len(train_patients))
 
@@ -50,32 +50,30 @@ for i in range(0, IMG_SIZE):
 prog_class_ctr = 0
 stab_class_ctr = 0
 
+# The training images are listed from the catalog index of the data folder
+regex = r""+params['regex']+"$"
+catalog = Catalog(data_path, params.get('catalog_dir'))
+
 # Inner loop takes an image and updates the mean values for all voxels
-for directory in os.walk(data_path):
-    # Walk inside the directory
-    for file in directory[2]:
-        # Match all files ending with 'regex'
-        input_file = os.path.join(directory[0], file)
-        regex = r""+params['regex']+"$"
-        if re.search(regex, input_file):
-            pat_code = input_file.rsplit(params['split_on'])
-            patient_code = pat_code[0].rsplit('/', 1)[1]
-            if patient_code in train_patients:
-                mri_image = nb.load(input_file)
-                mri_image = mri_image.get_data()
-                mri_image = mri_image.flatten()
-                #mri_image = pre.scale(mri_image, copy=False)
-
-                if patients_dict[patient_code] == 1:
-                    prog_class_ctr += 1
-                if patients_dict[patient_code] == 0:
-                    stab_class_ctr += 1
-                for i in range(0,len(mri_image)):
-                    if patients_dict[patient_code] == 1:
-                        mean_progressive[i] += mri_image[i]
-                    else:
-                        mean_stable[i] += mri_image[i]
-                    mean_total[i] += mri_image[i]
+for entry in catalog.entries(regex, params['split_on']):
+    input_file = entry.path
+    patient_code = entry.patient_code
+    if patient_code in train_patients:
+        mri_image = nb.load(input_file)
+        mri_image = mri_image.get_data()
+        mri_image = mri_image.flatten()
+        #mri_image = pre.scale(mri_image, copy=False)
+
+        if patients_dict[patient_code] == 1:
+            prog_class_ctr += 1
+        if patients_dict[patient_code] == 0:
+            stab_class_ctr += 1
+        for i in range(0,len(mri_image)):
+            if patients_dict[patient_code] == 1:
+                mean_progressive[i] += mri_image[i]
+            else:
+                mean_stable[i] += mri_image[i]
+            mean_total[i] += mri_image[i]
 
 mean_progressive = [x/prog_class_ctr for x in mean_progressive]
 mean_stable = [x/stab_class_ctr for x in mean_stable]
@@ -84,32 +82,26 @@ mean_total = [x/(prog_class_ctr+stab_class_ctr) for x in mean_total]
 print("Prog class ctr:", prog_class_ctr, "Stable: ", stab_class_ctr)
 
 # Inner loop takes an image and updates the standard dev. of each voxel
-for directory in os.walk(data_path):
-    # Walk inside the directory
-    for file in directory[2]:
-        # Match all files ending with 'regex'
-        input_file = os.path.join(directory[0], file)
-        regex = r""+params['regex']+"$"
-        if re.search(regex, input_file):
-            pat_code = input_file.rsplit(params['split_on'])
-            patient_code = pat_code[0].rsplit('/', 1)[1]
-            if patient_code in train_patients:
-                mri_image = nb.load(input_file)
-                mri_image = mri_image.get_data()
-                mri_image = mri_image.flatten()
-                #mri_image = pre.scale(mri_image, copy=False)
-
-                for i in range(0,len(mri_image)):
-                    if patients_dict[patient_code] == 1:
-                        var_progressive[i] += math.pow((mri_image[i]
-                                                        - mean_progressive[i]),
-                                                       2)
-
-                    else:
-                        var_stable[i] += math.pow((mri_image[
-                                                            i] -
-                                                        mean_stable[i]),
-                                                       2)
+for entry in catalog.entries(regex, params['split_on']):
+    input_file = entry.path
+    patient_code = entry.patient_code
+    if patient_code in train_patients:
+        mri_image = nb.load(input_file)
+        mri_image = mri_image.get_data()
+        mri_image = mri_image.flatten()
+        #mri_image = pre.scale(mri_image, copy=False)
+
+        for i in range(0,len(mri_image)):
+            if patients_dict[patient_code] == 1:
+                var_progressive[i] += math.pow((mri_image[i]
+                                                - mean_progressive[i]),
+                                               2)
+
+            else:
+                var_stable[i] += math.pow((mri_image[
+                                                    i] -
+                                                mean_stable[i]),
+                                               2)
 var_progressive = [x/prog_class_ctr for x in var_progressive]
 var_stable = [x/stab_class_ctr for x in var_stable]
 
@@ -8,218 +8,202 @@ import math
 from os import path
 import re
 import sys
-import pickle
 from skimage import util
 import sklearn.preprocessing as pre
-import scipy.stats as sc
+import scipy.ndimage as snd
+import scipy.special as sp
 from time import gmtime, strftime
 
-class RobustFisher:
+from dementia_prediction.manifest import load_patients
 
+class RobustFisher:
+    """
+    Computes the voxel-wise statistics of the robust Fisher score. Each voxel
+    is described by the histogram of the patch_size x patch_size window
+    around it in its axial slice.
+
+    The statistics of all voxels of an image are computed at once: window
+    minima and maxima with scipy.ndimage filters, histograms by comparing
+    the window values with the bin edges of every voxel and counting with
+    np.bincount, and the KL divergences in array form. The results are the
+    same as with np.histogram and scipy.stats.entropy per voxel.
+
+    Per-voxel distributions are dense (voxels, num_bins) arrays. Voxels
+    without bins, i.e. with a minimum of 0 or a constant window, are marked
+    by the 'valid' mask and have rows of zeros.
+    """
 
     def __init__(self, params):
         self.params = params
         self.split_on = params['split_on']
-        self.min_patient = []
-        self.max_patient = []
-        self.mean_progressive = []
-        self.mean_stable = []
-        self.std_progressive = []
-        self.std_stable = []
-
-        self.prob_progressive = []
-        self.prob_stable = []
+        self.mean_progressive = None
+        self.mean_stable = None
+
         self.patch_size = params['patch_size']
+        self.num_bins = params['num_bins']
         self.image_size = params['depth'] * params['height'] * params['width']
-        self.bins_patient = []
-        self.patients_dict = pickle.load(open(params['patient_dict'], 'rb'))
-        print("Hello")
-        for i in range(0, self.image_size):
-            self.min_patient.append(sys.maxsize)
-            self.max_patient.append(-sys.maxsize)
-
-            self.std_progressive.append(0)
-            self.std_stable.append(0)
-
-
-            self.prob_progressive.append([])
-            self.prob_stable.append([])
+        self.valid = None
+        self.edges = None
+        self.patients_dict = load_patients(params, 'patient_dict')
+        self.min_patient = np.full(self.image_size, float(sys.maxsize))
+        self.max_patient = np.full(self.image_size, -float(sys.maxsize))
+
+        self.std_progressive = np.zeros(self.image_size)
+        self.std_stable = np.zeros(self.image_size)
+
+    def progressive(self, input_file):
+        """
+        Returns: True if the patient of the image is in class 1
+        """
+        pat_code = input_file.rsplit(self.split_on)
+        patient_code = pat_code[0].rsplit('/', 1)[1]
+        return self.patients_dict[patient_code] == 1
+
+    def padded_image(self, input_file):
+        print(input_file)
+        print(strftime("%Y-%m-%d %H:%M:%S", gmtime()))
+        sys.stdout.flush()
+        mri_image = nb.load(input_file)
+        mri_image = mri_image.get_data()
+        return util.pad(mri_image, self.params['pad'], 'constant')
+
+    def window_values(self, input_file, valid):
+        """
+        Returns: the window values of the valid voxels as an array of shape
+        (valid voxels, window size), in the order of the flattened image
+        """
+        mri_image_padded = self.padded_image(input_file)
+        winshape = (self.patch_size, self.patch_size, 1)
+        windows = util.view_as_windows(mri_image_padded,
+                                       window_shape=winshape)
+        windows = windows[:self.params['depth'], :self.params['height'],
+                          1:self.params['width']+1]
+        windows = windows.reshape(self.image_size, -1)
+        return windows[valid].astype(np.float64)
+
+    def bins(self, min_patient, max_patient):
+        """
+        Decides the bin boundaries of each voxel between the minimum and
+        maximum of its windows.
+
+        Returns: (valid, edges) where 'valid' marks the voxels with bins and
+        'edges' is a (voxels, num_bins + 1) array with rows of zeros for the
+        voxels without bins
+        """
+        min_patient = np.asarray(min_patient, dtype=np.float64)
+        max_patient = np.asarray(max_patient, dtype=np.float64)
+        valid = (min_patient != 0) & (min_patient != max_patient)
+        edges = np.linspace(min_patient, max_patient, self.num_bins + 1,
+                            axis=1)
+        edges[~valid] = 0
+        return valid, edges
+
+    @staticmethod
+    def histograms(values, edges):
+        """
+        Counts the values of each voxel in its bins as np.histogram does, the
+        last bin includes its right edge and values outside are not counted.
+        Args:
+            values: (voxels, window size) array
+            edges: (voxels, bins + 1) array of increasing edges
+
+        Returns: (voxels, bins) array of counts
+        """
+        num_bins = edges.shape[1] - 1
+        # Index of the bin of each value, -1 below the first edge
+        indices = np.sum(values[:, :, None] >= edges[:, None, :num_bins],
+                         axis=2) - 1
+        inside = (indices >= 0) & (values <= edges[:, -1:])
+        voxels = np.broadcast_to(np.arange(len(values))[:, None],
+                                 values.shape)
+        counts = np.bincount(voxels[inside] * num_bins + indices[inside],
+                             minlength=len(values) * num_bins)
+        return counts.reshape(len(values), num_bins)
+
+    @staticmethod
+    def kl_divergence(pk, qk):
+        """
+        Returns: scipy.stats.entropy(pk[i], qk[i]) for each row i
+        """
+        pk = 1.0 * pk / np.sum(pk, axis=1, keepdims=True)
+        qk = 1.0 * qk / np.sum(qk, axis=1, keepdims=True)
+        return np.sum(sp.rel_entr(pk, qk), axis=1)
 
     def min_max(self, filenames):
+        size = (self.patch_size, self.patch_size, 1)
+        # The window starting at index i is centered at i + patch_size // 2
+        offset = self.patch_size // 2
+        region = (slice(offset, offset + self.params['depth']),
+                  slice(offset, offset + self.params['height']),
+                  slice(1, self.params['width'] + 1))
         for input_file in filenames:
-            print(input_file)
-            print(strftime("%Y-%m-%d %H:%M:%S", gmtime()))
-            sys.stdout.flush()
-            # print(input_file, patients_dict[patient_code])
-            mri_image = nb.load(input_file)
-            mri_image = mri_image.get_data()
-            # mri_image_flat = pre.scale(mri_image_flat, copy=False)
-            # with open('image.pkl', 'wb') as filep:
-            #    pickle.dump(mri_image_flat, filep)
-
-            # mri_image_re = mri_image.reshape(88, 102, 100)
-            mri_image_padded = util.pad(mri_image, self.params['pad'],
-                                        'constant')
-            winshape = (self.patch_size, self.patch_size, 1)
-            windows = util.view_as_windows(mri_image_padded,
-                                           window_shape=winshape)
-            # max_ = 0
-            # min_ = sys.maxsize()
-            ctr = 0
-
-            for i in range(0, self.params['depth']):
-                for j in range(0, self.params['height']):
-                    for k in range(1, self.params['width']+1):
-                        arr = np.reshape(windows[i, j, k],
-                                         -1).tolist()
-                        if np.max(arr) > self.max_patient[ctr]:
-                            self.max_patient[ctr] = np.max(arr)
-                        if np.min(arr) < self.min_patient[ctr]:
-                            self.min_patient[ctr] = np.min(arr)
-                        ctr += 1
-            print(ctr, flush=True)
+            mri_image_padded = self.padded_image(input_file)
+            window_max = snd.maximum_filter(mri_image_padded, size=size)
+            window_min = snd.minimum_filter(mri_image_padded, size=size)
+            self.max_patient = np.maximum(self.max_patient,
+                                          window_max[region].ravel())
+            self.min_patient = np.minimum(self.min_patient,
+                                          window_min[region].ravel())
+            print(self.image_size, flush=True)
         return self.min_patient, self.max_patient
 
     def histogram_dist(self, filenames):
+        """
+        Returns: (prob_progressive, prob_stable), (voxels, num_bins) float32
+        arrays with the sum of the window histograms over the images of each
+        class, normalized by the window size
+        """
+        edges = self.edges[self.valid]
+        prob = {True: np.zeros((len(edges), self.num_bins)),
+                False: np.zeros((len(edges), self.num_bins))}
         for input_file in filenames:
-            pat_code = input_file.rsplit(self.split_on)
-            patient_code = pat_code[0].rsplit('/', 1)[1]
-            print(input_file)
-            print(strftime("%Y-%m-%d %H:%M:%S", gmtime()))
-            sys.stdout.flush()
-            # print(input_file, patients_dict[patient_code])
-            mri_image = nb.load(input_file)
-            mri_image = mri_image.get_data()
-            # TODO: normalization
-            mri_image_padded = util.pad(mri_image, self.params['pad'],
-                                        'constant')
-            winshape = (self.patch_size, self.patch_size, 1)
-            windows = util.view_as_windows(mri_image_padded,
-                                           window_shape=winshape)
-            # print(len(mri_image))
-            ctr = 0
-            for i in range(0, self.params['depth']):
-                for j in range(0, self.params['height']):
-                    for k in range(1, self.params['width']+1):
-                        if self.patients_dict[patient_code] == 1:
-                            if len(self.bins_patient[ctr]) != 1:
-                                #print("Bins:", self.bins_patient[ctr])
-                                sys.stdout.flush()
-                                arr = np.reshape(windows[i, j, k],
-                                                 -1).tolist()
-                                values, base = np.histogram(arr,
-                                                        self.bins_patient[ctr],
-                                                        normed=False)
-                                values_prob = values / len(arr)
-                                if len(self.prob_progressive[ctr]) == 0:
-                                    self.prob_progressive[ctr] = values_prob
-                                else:
-                                    self.prob_progressive[ctr] = [x + y for x, y in zip(
-                                        self.prob_progressive[ctr], values_prob)]
-                                #if len(self.prob_progressive[ctr]) == 0:
-                                #    print(arr, self.bins_patient[ctr])
-                                #    sys.stdout.flush()
-                                #    sys.exit()
-                            else:
-                                self.prob_progressive[ctr] = [0]
-                                #print("Ctr:", ctr, "Prob: 0")
-                                sys.stdout.flush()
-
-                        else:
-                            if len(self.bins_patient[ctr]) != 1:
-                                #print("Bins:", self.bins_patient[ctr])
-                                sys.stdout.flush()
-                                arr = np.reshape(windows[i, j, k],
-                                                 -1).tolist()
-                                values, base = np.histogram(arr,
-                                                            self.bins_patient[
-                                                                ctr],
-                                                            normed=False)
-                                values_prob = values / len(arr)
-                                if len(self.prob_stable[ctr]) == 0:
-                                    self.prob_stable[ctr] = values_prob
-                                else:
-                                    self.prob_stable[ctr] = [x + y for x, y in zip(
-                                        self.prob_stable[ctr], values_prob)]
-                            else:
-                                self.prob_stable[ctr] = [0]
-                                #print("Ctr:", ctr, "Prob: 0")
-                                sys.stdout.flush()
-                        ctr += 1
-        return self.prob_progressive, self.prob_stable
+            progressive = self.progressive(input_file)
+            values = self.window_values(input_file, self.valid)
+            prob[progressive] += self.histograms(values, edges) / \
+                values.shape[1]
+        result = []
+        for progressive in [True, False]:
+            class_prob = np.zeros((self.image_size, self.num_bins),
+                                  dtype=np.float32)
+            class_prob[self.valid] = prob[progressive]
+            result.append(class_prob)
+        return result[0], result[1]
 
     def std_dev(self, filenames):
+        """
+        Returns: (std_progressive, std_stable) with the sum of the KL
+        divergences of the window histograms from the class mean histogram
+        over the images of each class, 0 for voxels without bins
+        """
+        edges = self.edges[self.valid]
+        mean = {True: self.mean_progressive[self.valid],
+                False: self.mean_stable[self.valid]}
+        std = {True: np.asarray(self.std_progressive, dtype=np.float64),
+               False: np.asarray(self.std_stable, dtype=np.float64)}
         for input_file in filenames:
-            pat_code = input_file.rsplit(self.split_on)
-            patient_code = pat_code[0].rsplit('/', 1)[1]
-
-            print(input_file)
-            print(strftime("%Y-%m-%d %H:%M:%S", gmtime()))
-            sys.stdout.flush()
-            mri_image = nb.load(input_file)
-            mri_image = mri_image.get_data()
-
-            mri_image_padded = util.pad(mri_image, self.params['pad'],
-                                        'constant')
-            winshape = (self.patch_size, self.patch_size, 1)
-            windows = util.view_as_windows(mri_image_padded,
-                                           window_shape=winshape)
-            ctr = 0
-            for i in range(0, self.params['depth']):
-                for j in range(0, self.params['height']):
-                    for k in range(1, self.params['width']+1):
-                        if self.patients_dict[patient_code] == 1:
-                            if len(self.bins_patient[ctr]) != 1:
-                                arr = np.reshape(windows[i, j, k],
-                                             -1).tolist()
-                                values, base = np.histogram(arr,
-                                                            self.bins_patient[ctr],
-                                                            normed=False)
-                                if len(arr) == 0 or len(self.mean_progressive[
-                                                            ctr]) == 0 or \
-                                                len(values) == 0:
-                                    print("Yes")
-                                values_prob = values / len(arr)
-                                self.std_progressive[ctr] += sc.entropy(
-                                                                   values_prob,
-                                                                   self.mean_progressive[
-                                                                       ctr])
-                                # print("std prog", std_progressive[i])
-                                '''
-                                print("Ctr: ", ctr, "arr:", arr, "Values Prob: ",
-                                  values_prob,
-                                  "Bins: ", self.bins_patient[ctr],
-                                  "Mean Prog: ", self.mean_progressive[ctr],
-                                  "Std: ",
-                                  self.std_progressive[ctr])
-                                '''
-                            else:
-                                self.std_progressive[ctr] = 0
-                                #print("Ctr:", ctr, "Std: 0")
-                        else:
-                            if len(self.bins_patient[ctr]) != 1:
-
-                                arr = np.reshape(windows[i, j, k],
-                                                 -1).tolist()
-                                values, base = np.histogram(arr,
-                                                            self.bins_patient[ctr],
-                                                            normed=False)
-                                values_prob = values / len(arr)
-
-                                self.std_stable[ctr] += sc.entropy(values_prob,
-                                                              self.mean_stable[
-                                                                  ctr])
-                                '''
-                                print("Ctr: ", ctr, "arr:", arr, "Values Prob: ",
-                                  values_prob,
-                                  "Bins: ", self.bins_patient[ctr],
-                                  "Mean Stab: ", self.mean_stable[ctr],
-                                  "Std: ",
-                                  self.std_stable[ctr])
-                                '''
-                            else:
-                                self.std_stable[ctr] = 0
-                                #print("Ctr:", ctr, "Std: 0")
-                        ctr += 1
-                        # print("std stable", std_stable[i])
+            progressive = self.progressive(input_file)
+            values = self.window_values(input_file, self.valid)
+            values_prob = self.histograms(values, edges) / values.shape[1]
+            std[progressive][self.valid] += self.kl_divergence(
+                values_prob, mean[progressive])
+        self.std_progressive = std[True]
+        self.std_stable = std[False]
         return self.std_progressive, self.std_stable
+
+    def fisher_score(self, std_progressive, std_stable):
+        """
+        Returns: the robust Fisher score of each voxel, the symmetric KL
+        divergence of the class mean histograms divided by the sum of the
+        class deviations, 0 for voxels without bins or deviation
+        """
+        numerator = np.zeros(self.image_size)
+        mean_progressive = self.mean_progressive[self.valid]
+        mean_stable = self.mean_stable[self.valid]
+        numerator[self.valid] = \
+            self.kl_divergence(mean_progressive, mean_stable) + \
+            self.kl_divergence(mean_stable, mean_progressive)
+        denominator = np.asarray(std_progressive) + np.asarray(std_stable)
+        fisher_score = np.zeros(self.image_size)
+        nonzero = denominator != 0
+        fisher_score[nonzero] = numerator[nonzero] / denominator[nonzero]
+        return fisher_score
@@ -1,12 +1,9 @@
-import os
 from os import path
-import re
 import sys
 import random
 import numpy as np
 from sklearn import svm
 import nibabel as nb
-import pickle
 
 import sklearn.preprocessing as pre
 from sklearn.model_selection import GridSearchCV
@@ -15,13 +12,16 @@ from sklearn.externals import joblib
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import confusion_matrix
 
+from dementia_prediction.catalog import Catalog
+from dementia_prediction.manifest import load_patients
+
 class SVM:
 
     def __init__(self, params):
         self.data_path = params['data_path']
-        self.patients_dict = pickle.load(open(params['patient_dict'], 'rb'))
-        self.valid_patients = pickle.load(open(params['valid_dict'], 'rb'))
-        self.train_patients = pickle.load(open(params['train_dict'], 'rb'))
+        self.patients_dict = load_patients(params, 'patient_dict')
+        self.valid_patients = load_patients(params, 'valid_dict', 'valid')
+        self.train_patients = load_patients(params, 'train_dict', 'train')
         self.params = params
         np.random.seed(1)
 
@@ -41,40 +41,34 @@ class SVM:
         valid_pat_code = []
 
         # Add training data to train_X and validation to valid_X
-        for directory in os.walk(self.data_path):
-            # Walk inside the directory
-            for file in directory[2]:
-                # Match all files ending with 'regex'
-                input_file = os.path.join(directory[0], file)
-                regex = r"" + self.params['regex'] + "$"
-                #print(file)
-                if re.search(regex, input_file):
-                    pat_code = input_file.rsplit(self.params['split_on'])
-                    patient_code = pat_code[0].rsplit('/', 1)[1]
-                    #print(patient_code)
-                    feature_selected_image = []
-                    if patient_code in self.train_patients or patient_code in \
-                            self.valid_patients:
-                        mri_image = nb.load(input_file)
-                        mri_image = mri_image.get_data()
-                        mri_image = mri_image.flatten()
-
-                        if scaling == True:
-                            mri_image = pre.scale(mri_image, copy=False)
-
-                        feature_selected_image = np.take(mri_image, features)
-                        #print("Feature selected: ",
-                        # len(feature_selected_image))
-                        if len(feature_selected_image) == 0:
-                            raise ValueError('Zero selected features')
-
-                    if patient_code in self.train_patients:
-                        train_X.append(feature_selected_image)
-                        train_Y.append(self.patients_dict[patient_code])
-                    elif patient_code in self.valid_patients:
-                        valid_pat_code.append(patient_code)
-                        valid_X.append(feature_selected_image)
-                        valid_Y.append(self.patients_dict[patient_code])
+        regex = r"" + self.params['regex'] + "$"
+        catalog = Catalog(self.data_path, self.params.get('catalog_dir'))
+        for entry in catalog.entries(regex, self.params['split_on']):
+            input_file = entry.path
+            patient_code = entry.patient_code
+            feature_selected_image = []
+            if patient_code in self.train_patients or patient_code in \
+                    self.valid_patients:
+                mri_image = nb.load(input_file)
+                mri_image = mri_image.get_data()
+                mri_image = mri_image.flatten()
+
+                if scaling == True:
+                    mri_image = pre.scale(mri_image, copy=False)
+
+                feature_selected_image = np.take(mri_image, features)
+                #print("Feature selected: ",
+                # len(feature_selected_image))
+                if len(feature_selected_image) == 0:
+                    raise ValueError('Zero selected features')
+
+            if patient_code in self.train_patients:
+                train_X.append(feature_selected_image)
+                train_Y.append(self.patients_dict[patient_code])
+            elif patient_code in self.valid_patients:
+                valid_pat_code.append(patient_code)
+                valid_X.append(feature_selected_image)
+                valid_Y.append(self.patients_dict[patient_code])
 
         print("Train:", len(train_X))
         print("Valid:", len(valid_X))
@@ -1,6 +1,4 @@
-import os
 from os import path
-import re
 import sys
 import random
 import numpy as np
@@ -15,6 +13,8 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import confusion_matrix
 
 from dementia_prediction.config_wrapper import Config
+from dementia_prediction.catalog import Catalog
+from dementia_prediction.manifest import load_patients
 if __name__ == '__main__':
         config = Config()
         parser = argparse.ArgumentParser(description="Run SVM multitask")
@@ -24,9 +24,9 @@ if __name__ == '__main__':
         config.parse(path.abspath(args.paramfile))
         params = config.config.get('parameters')
 
-        patients_dict = pickle.load(open(params['patient_dict'], 'rb'))
-        valid_patients = pickle.load(open(params['valid_dict'], 'rb'))
-        train_patients = pickle.load(open(params['train_dict'], 'rb'))
+        patients_dict = load_patients(params, 'patient_dict')
+        valid_patients = load_patients(params, 'valid_dict', 'valid')
+        train_patients = load_patients(params, 'train_dict', 'train')
 
         for percentage in [0.1, 0.3, 0.5, 0.8, 1]:
             print(percentage, flush=True)
@@ -47,32 +47,28 @@ if __name__ == '__main__':
                 features.append(pickle.load(open(features_path, 'rb')))
                 scores.append(pickle.load(open(scores_path, 'rb')))
 
-            for directory in os.walk(params['data_path']):
-                # Walk inside the directory
-                for file in directory[2]:
-                    # Match all files ending with 'regex'
-                    input_file = os.path.join(directory[0], file)
-                    regex = r""+params['regex']+"$"
-                    if re.search(regex, input_file):
-                        file_name = input_file.rsplit('/', 1)[1]
-                        patient_code = file_name.split(params['split_on'])[0]
-                        feature_selected_image = []
-                        if patient_code in patients_dict:
-                            for i in range(0, 3):
-                                file_path = params['mode'+str(i)+'_folder']+file_name
-                                mri_image = nb.load(file_path)
-                                mri_image = mri_image.get_data()
-                                mri_image = mri_image.flatten()
-                                feature_selected_image = np.take(mri_image,
-                                                                 features[i])
-                                #print("Features selected: ", len(feature_selected_image))
-                                if patient_code in train_patients and len(feature_selected_image) > 0:
-                                    train_X[i].append(feature_selected_image)
-                                    train_Y[i].append(patients_dict[patient_code])
-                                if patient_code in valid_patients and len(feature_selected_image) > 0:
-                                    valid_X[i].append(feature_selected_image)
-                                    valid_Y[i].append(patients_dict[patient_code])
-                                    valid_pat_code[i].append(patient_code)
+            regex = r""+params['regex']+"$"
+            catalog = Catalog(params['data_path'], params.get('catalog_dir'))
+            for entry in catalog.entries(regex, params['split_on']):
+                file_name = entry.path.rsplit('/', 1)[1]
+                patient_code = entry.patient_code
+                feature_selected_image = []
+                if patient_code in patients_dict:
+                    for i in range(0, 3):
+                        file_path = params['mode'+str(i)+'_folder']+file_name
+                        mri_image = nb.load(file_path)
+                        mri_image = mri_image.get_data()
+                        mri_image = mri_image.flatten()
+                        feature_selected_image = np.take(mri_image,
+                                                         features[i])
+                        #print("Features selected: ", len(feature_selected_image))
+                        if patient_code in train_patients and len(feature_selected_image) > 0:
+                            train_X[i].append(feature_selected_image)
+                            train_Y[i].append(patients_dict[patient_code])
+                        if patient_code in valid_patients and len(feature_selected_image) > 0:
+                            valid_X[i].append(feature_selected_image)
+                            valid_Y[i].append(patients_dict[patient_code])
+                            valid_pat_code[i].append(patient_code)
 
 
 
@@ -14,6 +14,7 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import confusion_matrix
 
 from dementia_prediction.config_wrapper import Config
+from dementia_prediction.manifest import load_patients
 
 if __name__ == '__main__':
         config = Config()
@@ -24,9 +25,9 @@ if __name__ == '__main__':
         config.parse(path.abspath(args.paramfile))
         params = config.config.get('parameters')
 
-        patients_dict = pickle.load(open(params['patient_dict'], 'rb'))
-        valid_patients = pickle.load(open(params['valid_dict'], 'rb'))
-        train_patients = pickle.load(open(params['train_dict'], 'rb'))
+        patients_dict = load_patients(params, 'patient_dict')
+        valid_patients = load_patients(params, 'valid_dict', 'valid')
+        train_patients = load_patients(params, 'train_dict', 'train')
 
         IMG_SIZE = params['depth']*params['height']*params['width']
 
@@ -12,6 +12,7 @@ import tensorflow as tf
 import numpy as np
 import sys
 from dementia_prediction.cnn_utils import CNNUtils
+from dementia_prediction.dataset_input import DatasetInput, placeholder
 
 class CNN:
     """
@@ -110,23 +111,23 @@ class CNN:
             test: Data object of DataInput class to test the model accuracy
         """
         mode = self.param['mode'] 
+        # With a 'dataset' section, the training batches are read by a
+        # tf.data pipeline and the placeholders are only fed for evaluation
+        dataset = DatasetInput.from_params(self.param, train_data)
         with tf.Graph().as_default():
-
-            images = tf.placeholder(dtype=tf.float32,
-                                    shape=[None,
-                                           self.param['depth'],
-                                           self.param['height'],
-                                           self.param['width'],
-                                           self.param['channels']],
-                                    name=mode+'images')
+            image_shape = [self.param['depth'], self.param['height'],
+                           self.param['width'], self.param['channels']]
             if self.mlp == 'True':
-                images = tf.placeholder(dtype=tf.float32,
-                                        shape=[None,
-                                               self.param['num_features']],
-                                        name=mode + 'images')
-            labels = tf.placeholder(dtype=tf.int8,
-                                    shape=[None, self.param['classes']],
-                                    name=mode+'labels')
+                image_shape = [self.param['num_features']]
+            batch_images = [None]
+            batch_labels = None
+            if dataset is not None:
+                batch_images, batch_labels = dataset.next_batch(
+                    [image_shape])
+            images = placeholder(tf.float32, [None] + image_shape,
+                                 mode + 'images', batch_images[0])
+            labels = placeholder(tf.int8, [None, self.param['classes']],
+                                 mode + 'labels', batch_labels)
             keep_prob = tf.placeholder(tf.float32, name=mode+'keep_prob')
             global_step = tf.get_variable(name=mode+'global_step',
                                           shape=[],
@@ -216,26 +217,28 @@ class CNN:
                 summary_op = tf.summary.merge_all()
                 tf.get_default_graph().finalize()
 
-                for i in range(0, len(validation_data.files)):
-                    validation_data.batch_index[i] = 0
-                    validation_data.shuffle()
-                    train_data.batch_index[i] = 0
-                    train_data.shuffle()
+                validation_data.reset()
+                train_data.reset()
 
                 for step in range(1, num_steps):
                     print("Step:", step, "Total:", num_steps)
                     start_time = time.time()
 
-                    _, image_data, label_data = train_data.next_batch()
+                    feed_dict = {keep_prob: self.param['keep_prob']}
+                    fetches = [summary_op, train_op, total_loss, xloss,
+                               l2loss]
+                    if dataset is None:
+                        _, image_data, label_data = train_data.next_batch()
+                        feed_dict.update({images: image_data,
+                                          labels: label_data})
+                    elif step % 50 == 0:
+                        # The batch of the pipeline for the batch accuracy
+                        fetches += [images, labels]
+                    outputs = sess.run(fetches, feed_dict=feed_dict)
                     summary_values, _, loss_value, cross_loss, l2_loss = \
-                        sess.run(
-                        [summary_op, train_op, total_loss, xloss, l2loss],
-                        feed_dict={
-                            images: image_data,
-                            labels: label_data,
-                            keep_prob: self.param['keep_prob']
-                        }
-                    )
+                        outputs[:5]
+                    if len(outputs) > 5:
+                        image_data, label_data = outputs[5:]
                     if step % num_batches_epoch == 0 or (step + 1) == num_steps / 2:
                         checkpoint_path = self.param['checkpoint_path'] + \
                                           'model.ckpt'
@@ -271,11 +274,8 @@ class CNN:
                     # Saving Model Checkpoints for evaluation
                     if step % num_batches_epoch == 0 or (
                         step + 1) == num_steps:
-                        for i in range(0, len(validation_data.files)):
-                            validation_data.batch_index[i] = 0
-                            validation_data.shuffle()
-                            train_data.batch_index[i] = 0
-                            train_data.shuffle()
+                        validation_data.reset()
+                        train_data.reset()
 
                         # Evaluate against the training data.
                         print("Step: %d Training accuracy: %g " %
@@ -302,11 +302,8 @@ class CNN:
                                                      loss=total_loss,
                                                      xloss=xloss,
                                                      l2loss=l2loss)))
-                        for i in range(0, len(validation_data.files)):
-                            validation_data.batch_index[i] = 0
-                            validation_data.shuffle()
-                            train_data.batch_index[i] = 0
-                            train_data.shuffle()
+                        validation_data.reset()
+                        train_data.reset()
                     sys.stdout.flush()
                 if test == True:
                     ckpt = tf.train.get_checkpoint_state(
@@ -10,7 +10,12 @@ import numpy as np
 import sys
 import pickle
 import csv
+from functools import partial
 from dementia_prediction.cnn_utils import CNNUtils
+from dementia_prediction.feature_store import FeatureStore, subject_key
+from dementia_prediction.evaluation_batches import evaluation_files
+from dementia_prediction.ensemble_combiners import COMBINERS, accuracies, \
+    subset_weights, greedy_selection, weighted_mean, member_images
 
 class CNNEnsembleModels:
     """
@@ -24,6 +29,114 @@ class CNNEnsembleModels:
         self.mode = params['cnn']['mode']
         self.meta_paths = params['cnn']['meta']
         self.cnnutils = CNNUtils(params)
+        # With a 'logit_cache' folder, the logits of each member are
+        # computed once per image and combined offline
+        self.store = None
+        if self.param.get('logit_cache'):
+            self.store = FeatureStore(self.param['logit_cache'],
+                                      self.param.get('feature_chunk', 256))
+        self.combiner = self.param.get('ensemble_combiner', 'mean')
+        self.weights = self.param.get('ensemble_weights')
+        if isinstance(self.weights, dict):
+            self.weights = [self.weights[m] for m in
+                            range(0, self.param['ensemble_count'])]
+
+    def member_logits(self, dataset):
+        """
+        This function reads the logits of every member for every image of
+        the dataset from the logit cache, computing the missing ones.
+        Args:
+            dataset: input dataset either train or validation
+
+        Returns: (filenames, class labels, logits of shape [members, images,
+        classes])
+
+        """
+        data_input = getattr(dataset, 'data_input', dataset)
+        layers = []
+        count = self.param['ensemble_count']
+        for m in range(0, count):
+            layer_path = 'Train' + self.mode[m] + '/' + self.mode[m] + \
+                         'logits/' + self.mode[m] + 'logits:0'
+            # Each batch is split over the members as in evaluation()
+            layers.append((self.mode[m], self.meta_paths[m], layer_path,
+                           partial(member_images, member=m, members=count)))
+        feature_sets = self.store.extract(data_input, layers, self.cnnutils)
+        filenames, labels = evaluation_files(data_input)
+        keys = [subject_key(filename) for filename in filenames]
+        logits = np.stack([feature_set.get(keys)
+                           for feature_set in feature_sets])
+        return filenames, np.array(labels), logits
+
+    def cached_evaluation(self, dataset):
+        """
+        This function evaluates the accuracy of the combiner
+        'ensemble_combiner' ('mean', 'vote' or 'greedy') on the cached
+        logits. The greedy selection picks the members on the first
+        evaluated dataset, the training data.
+        Args:
+            dataset: input dataset either train or validation
+
+        Returns: the accuracy of the ensemble on the input data
+
+        """
+        start_time = time.time()
+        filenames, labels, logits = self.member_logits(dataset)
+        if self.combiner == 'greedy':
+            if self.weights is None:
+                self.weights, history = greedy_selection(
+                    logits, labels, self.param.get('ensemble_size'))
+                print("Selected members:", self.weights, "Accuracy:",
+                      history)
+            combined = weighted_mean(logits, self.weights)
+        else:
+            combined = COMBINERS[self.combiner](logits, self.weights)
+        answer = np.argmax(combined, 1)
+        accuracy_ = np.mean(answer == labels)
+        time_taken = time.time() - start_time
+        print("Accuracy of ", len(filenames), " images is ", accuracy_,
+              "Time", time_taken, flush=True)
+        self.save_predictions(dict(zip(filenames, answer)))
+        return accuracy_
+
+    def search(self, train_data, validation_data, top=10):
+        """
+        This function prints the accuracy of the mean logits of every subset
+        of up to 'ensemble_size' members and of the greedy selection, ranked
+        by the training accuracy.
+        Args:
+            train_data: the data on which the ensembles are ranked
+            validation_data: the data on which the ensembles are tested
+            top: number of ensembles printed
+        """
+        _, train_labels, train_logits = self.member_logits(train_data)
+        _, valid_labels, valid_logits = self.member_logits(validation_data)
+        weights = subset_weights(len(train_logits),
+                                 self.param.get('ensemble_size'))
+        counts, _ = greedy_selection(train_logits, train_labels,
+                                     self.param.get('ensemble_size'))
+        weights = np.vstack([weights, counts / np.sum(counts)])
+        start_time = time.time()
+        train_accuracy = accuracies(train_logits, train_labels, weights)
+        valid_accuracy = accuracies(valid_logits, valid_labels, weights)
+        print("Scored", len(weights), "ensembles in",
+              time.time() - start_time, "s")
+        print('%-40s %10s %10s' % ('members', 'train', 'validation'))
+        for row in np.argsort(-train_accuracy, kind='stable')[:top]:
+            members = ' '.join('%s:%.2f' % (self.mode[m], weights[row][m])
+                               for m in np.flatnonzero(weights[row]))
+            if row == len(weights) - 1:
+                members = 'greedy ' + members
+            print('%-40s %10.4f %10.4f' % (members, train_accuracy[row],
+                                           valid_accuracy[row]))
+        sys.stdout.flush()
+
+    def save_predictions(self, prediction_data):
+        with open('./prediction_output.pkl', 'wb') as filep:
+            pickle.dump(prediction_data, filep)
+        csvwriter = csv.writer(open('./prediction_output.csv', 'w'))
+        for key, value in prediction_data.items():
+            csvwriter.writerow([key, value])
 
     def evaluation(self, dataset):
         """
@@ -34,23 +147,15 @@ class CNNEnsembleModels:
         Returns: the accuracy of the model on the input data
 
         """
+        if self.store is not None:
+            return self.cached_evaluation(dataset)
         correct_predictions = 0
         prediction_data = {}
         total_seen = 0
         pred_out = {}
-        class_max_size = 0
-        data_size = 0
-        for i in range(0, len(dataset.files)):
-            data_size += len(dataset.files[i])
-            if len(dataset.files[i]) > class_max_size:
-                class_max_size = len(dataset.files[i])
-        num_steps = int(class_max_size / (self.param['batch_size']/len(dataset.files)))
-        if class_max_size%(self.param['batch_size']/len(dataset.files)) != 0:
-            num_steps += 1
-        print("Num steps:", num_steps, "Data size:", data_size)
         start_time = time.time()
-        for step in range(num_steps):
-            patients, image_data, label_data = dataset.next_batch()
+        for patients, image_data, label_data, count in \
+                self.cnnutils.eval_batches(dataset):
             if len(image_data) != self.param['ensemble_count']:
                 # Ensembling over epochs. Use same data
                 image_data = [image_data for i in range(0, self.param[
@@ -64,14 +169,16 @@ class CNNEnsembleModels:
                                                           self.meta_paths[m],
                                                           image_data[m],
                                                           layer_path))
-            logits = np.average(logits_, axis=0)
-            correct_ = np.equal(np.argmax(label_data, 1),
+            # The padding of the last batch is not counted
+            logits = np.average(logits_, axis=0)[:count]
+            patients = patients[:count]
+            correct_ = np.equal(np.argmax(label_data[:count], 1),
                                   np.argmax(logits, 1))
             answer = np.argmax(logits, 1)
             prediction_data.update(dict(zip(patients, answer)))
             pred_out.update(dict(zip(patients, correct_)))
             correct_predictions += np.sum(correct_.astype(float))
-            total_seen += self.param['batch_size']
+            total_seen += count
             print("Accuracy until " + str(total_seen) + " data points is: " +
                   str(correct_predictions / total_seen))
             #print("logits:", logits_)
@@ -83,11 +190,7 @@ class CNNEnsembleModels:
         accuracy_ /= len(pred_out)
         print("Accuracy of ", len(pred_out)," images is ", accuracy_, "Time", time_taken)
         sys.stdout.flush()
-        with open('./prediction_output.pkl', 'wb') as filep:
-            pickle.dump(prediction_data, filep)
-        csvwriter = csv.writer(open('./prediction_output.csv', 'w'))
-        for key, value in prediction_data.items():
-            csvwriter.writerow([key, value])
+        self.save_predictions(prediction_data)
         #print(prediction_data, flush=True)
         return accuracy_
 
@@ -111,4 +214,7 @@ class CNNEnsembleModels:
                 dataset=train_data))
             print("Validation Accuracy:", self.evaluation(
                 dataset=validation_data))
+            if self.store is not None and \
+                    self.param.get('ensemble_search') == 'True':
+                self.search(train_data, validation_data)
 
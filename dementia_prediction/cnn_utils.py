@@ -9,6 +9,8 @@ import math
 import tensorflow as tf
 import numpy as np
 import sys
+from dementia_prediction.feature_extractor import FeatureExtractorCache
+from dementia_prediction.evaluation_batches import evaluation_batches
 
 
 class CNNUtils:
@@ -18,6 +20,8 @@ class CNNUtils:
 
     def __init__(self, params):
         self.param = params['cnn']
+        self.extractors = FeatureExtractorCache(
+            self.param.get('feature_sessions', 4))
 
     @classmethod
     def variable_on_gpu(cls, name, shape, initializer):
@@ -161,8 +165,9 @@ class CNNUtils:
         print("Conv7", conv7.get_shape())
 
         with tf.variable_scope(self.param['mode']+'fullcn2') as scope:
-            vector_per_batch = tf.reshape(conv7, [self.param['batch_size'],
-                                          -1])
+            # The batch dimension is left open, so the graph scores any
+            # number of images
+            vector_per_batch = tf.reshape(conv7, [-1, 512])
             weights = self.weight_decay_variable(name="weights",
                                                  shape=[512, 512])
             biases = self.variable_on_gpu(name="biases",
@@ -209,44 +214,34 @@ class CNNUtils:
         print("Num steps:", num_steps, "Data size:", data_size, flush=True)
         return num_steps
 
+    def eval_batches(self, dataset):
+        """
+        Returns: an iterator over every image of the dataset exactly once, in
+        batches of 'eval_batch_size' (default 'batch_size') images, see
+        evaluation_batches()
+        """
+        return evaluation_batches(dataset, self.param.get(
+            'eval_batch_size', self.param['batch_size']))
+
     def get_features(self, mode, meta_path, image_data, layer_path):
-        with tf.Graph().as_default() as model_graph:
-            sess = tf.Session(graph=model_graph)
-            saver = tf.train.import_meta_graph(meta_path)
-            saver.restore(sess, meta_path.split('.meta')[0])
-            images = model_graph.get_tensor_by_name(mode + 'images:0')
-            keep_prob = model_graph.get_tensor_by_name(mode + 'keep_prob:0')
-            if layer_path == 'conv1':
-                fusion_layer = 'conv1_a'
-                layer_path_a = 'Train' + mode + '/' + mode + fusion_layer +\
-                               '/' + mode + fusion_layer + ':0'
-                fusion_layer = 'conv1_b'
-                layer_path_b = 'Train' + mode + '/' + mode + fusion_layer +\
-                               '/' + mode + fusion_layer + ':0'
-                fusion_layer = 'conv1_c'
-                layer_path_c = 'Train' + mode + '/' + mode + fusion_layer + \
-                               '/' + mode + fusion_layer + ':0'
-                layer_a = model_graph.get_tensor_by_name(layer_path_a)
-                layer_b = model_graph.get_tensor_by_name(layer_path_b)
-                layer_c = model_graph.get_tensor_by_name(layer_path_c)
-                layer_a_, layer_b_, layer_c_ = sess.run(
-                    [layer_a, layer_b, layer_c],
-                    feed_dict={
-                        images: image_data,
-                        keep_prob: 1.0
-                    })
-                layer_ = np.concatenate([layer_a_, layer_b_, layer_c_], 4)
-                print("Output layer shape:", layer_.shape)
-                return layer_
-            else:
-                layer = model_graph.get_tensor_by_name(layer_path)
-                layer_ = sess.run(layer,
-                                  feed_dict={
-                                      images: image_data,
-                                      keep_prob: 1.0
-                                  })
-                print("Output layer shape:", layer_.shape)
-                return layer_
+        """
+        This function computes the output of a layer of a trained model. The
+        model is restored once and kept open for the next batches, up to
+        'feature_sessions' models at a time (default 4).
+        Args:
+            mode: modality prefix of the tensor names of the model
+            meta_path: path of the .meta file of the checkpoint
+            image_data: input images of the model
+            layer_path: tensor name of the layer, or 'conv1' for the
+                        concatenated first convolutions of the fusion models
+
+        Returns: the layer output for the images
+
+        """
+        layer_ = self.extractors.features(mode, meta_path, image_data,
+                                          layer_path)
+        print("Output layer shape:", layer_.shape)
+        return layer_
 
     def fusion_conv1(self, fusion_input, keep_prob):
         prefix = 'Fusion'
@@ -281,8 +276,7 @@ class CNNUtils:
                                             biases_shape=[512], scope=scope)
         print("Conv7", conv7.get_shape())
         with tf.variable_scope(prefix + 'fullcn') as scope:
-            vector_per_batch = tf.reshape(conv7, [self.param['batch_size'],
-                                                  -1])
+            vector_per_batch = tf.reshape(conv7, [-1, 512])
             weights = self.weight_decay_variable(name="weights",
                                                           shape=[512, 512])
             biases = self.variable_on_gpu(name="biases",
@@ -312,8 +306,7 @@ class CNNUtils:
 
     def fusion_conv7(self, fusion_input, keep_prob):
         with tf.variable_scope('Fusionfullcn') as scope:
-            vector_per_batch = tf.reshape(fusion_input, [self.param['batch_size'],
-                                                  -1])
+            vector_per_batch = tf.reshape(fusion_input, [-1, 1536])
             weights = self.weight_decay_variable(name="weights",
                                                  shape=[1536, 512])
             biases = self.variable_on_gpu(name="biases",
@@ -362,19 +355,20 @@ class CNNUtils:
         correct_predictions = 0
         total_seen = 0
         pred_out = {}
-        num_steps = self.num_steps(dataset)
-        for step in range(num_steps):
-            patients, image_data, label_data = dataset.next_batch()
-            predictions, correct_, loss_, xloss_, l2loss_ = sess.run(
-                [eval_op, corr, loss, xloss, l2loss],
+        for patients, image_data, label_data, count in \
+                self.eval_batches(dataset):
+            correct_, loss_, xloss_, l2loss_ = sess.run(
+                [corr, loss, xloss, l2loss],
                 feed_dict={
                     images: image_data,
                     labels: label_data,
                     keep_prob: 1.0
                 })
-            correct_predictions += predictions
-            pred_out.update(dict(zip(patients, correct_)))
-            total_seen += self.param['batch_size']
+            # The padding of the last batch is not counted
+            correct_ = correct_[:count]
+            correct_predictions += np.sum(correct_)
+            pred_out.update(dict(zip(patients[:count], correct_)))
+            total_seen += count
             print("Accuracy until " + str(total_seen) + " data points is: " +
                   str(correct_predictions / total_seen))
             print("loss", loss_, xloss_, l2loss_)
@@ -0,0 +1,132 @@
+"""
+This module contains the tf.data input pipeline of the trainers, an
+alternative to feeding every batch through the placeholders.
+
+The class-balanced file order of the input object is replayed by a generator,
+each image is decoded and augmented by the loader of the input object in
+parallel calls inside the TensorFlow runtime, and the images are batched and
+prefetched while the model trains on the current batch. The placeholders of
+the trainers default to the batches of the pipeline, so they are only fed
+for the evaluation.
+"""
+
+import copy
+import random
+import numpy as np
+import tensorflow as tf
+
+from dementia_prediction.batch_buffer import BatchBuffer
+
+
+def placeholder(dtype, shape, name, default=None):
+    """
+    Returns: a placeholder of the given type and shape, which evaluates to
+    the tensor 'default' when it is not fed, if 'default' is given
+    """
+    if default is None:
+        return tf.placeholder(dtype=dtype, shape=shape, name=name)
+    return tf.placeholder_with_default(tf.cast(default, dtype), shape=shape,
+                                       name=name)
+
+
+class DatasetInput:
+    """
+    Initialize this class with an input object (DataInput,
+    MultichannelDataInput, FusionDataInput, DataInputPerceptron or
+    FeatureDataInput), the number of images loaded in parallel and the number
+    of batches prefetched.
+    """
+
+    def __init__(self, data_input, parallel_calls=4, prefetch=2):
+        # The prefetching wrapper is not used, a FeatureDataInput loads the
+        # features of the input object it wraps
+        if not hasattr(data_input, 'feature_sets'):
+            if hasattr(data_input, 'close'):
+                # The pipeline replaces the pool of the wrapper
+                data_input.close()
+            data_input = getattr(data_input, 'data_input', data_input)
+        self.parallel_calls = parallel_calls
+        self.prefetch = prefetch
+        # The batches are selected on a copy of the input, with its own
+        # position and generator derived from the input's generator
+        order = getattr(data_input, 'data_input', data_input)
+        self.order = copy.copy(order)
+        self.order.files = [list(files) for files in order.files]
+        self.order.batch_index = list(order.batch_index)
+        self.order.random = random.Random(order.random.getrandbits(32))
+        self.order.shuffle()
+        # The images are loaded concurrently, so each one gets a new array
+        self.loader = copy.copy(data_input)
+        if hasattr(self.loader, 'buffer'):
+            self.loader.buffer = BatchBuffer(0)
+        # select_batch() takes two images per entry of class 0 for batch
+        # sizes which are not a multiple of the number of classes
+        batch_size = order.params['batch_size']
+        per_class = int(batch_size / order.num_classes)
+        self.batch_length = per_class * order.num_classes
+        if batch_size % order.num_classes != 0:
+            self.batch_length += per_class
+
+    @classmethod
+    def from_params(cls, params, data_input):
+        """
+        Returns: the pipeline of the input object if the cnn parameters
+        contain a 'dataset' section, e.g. {'parallel_calls': 8, 'prefetch':
+        4}, else None
+        """
+        spec = params.get('dataset')
+        if not spec or spec == 'False':
+            return None
+        if not isinstance(spec, dict):
+            spec = {}
+        return cls(data_input, parallel_calls=spec.get('parallel_calls', 4),
+                   prefetch=spec.get('prefetch', 2))
+
+    def elements(self):
+        """
+        Yields (filename, class label, augmentation seed) of the images of
+        the class-balanced batches, one batch after another
+        """
+        while True:
+            batch_files, batch_classes = self.order.select_batch()
+            for filename, class_label in zip(batch_files, batch_classes):
+                yield filename, class_label, self.order.random.getrandbits(31)
+
+    def load(self, filename, class_label, seed):
+        """
+        Returns: the arrays of the image, one per modality, and its label
+        vector
+        """
+        _, images, labels = self.loader.load_batch(
+            [filename.decode()], [int(class_label)], random.Random(seed))
+        if not isinstance(images, list):
+            images = [images]
+        return [np.asarray(image[0], dtype=np.float32) for image in images] \
+            + [np.asarray(labels[0], dtype=np.float32)]
+
+    def next_batch(self, shapes):
+        """
+        Builds the pipeline in the current graph.
+        Args:
+            shapes: the shape of the image placeholder of each modality,
+                    without the batch dimension
+
+        Returns: (list of the image batch tensors, one per modality, label
+        batch tensor), the next batch each time they are evaluated
+        """
+        dataset = tf.data.Dataset.from_generator(
+            self.elements, (tf.string, tf.int64, tf.int64))
+
+        def load(filename, class_label, seed):
+            outputs = tf.py_func(self.load, [filename, class_label, seed],
+                                 [tf.float32] * (len(shapes) + 1),
+                                 stateful=False)
+            for output, shape in zip(outputs, shapes):
+                output.set_shape(shape)
+            outputs[-1].set_shape([self.order.num_classes])
+            return tuple(outputs)
+
+        dataset = dataset.map(load, num_parallel_calls=self.parallel_calls)
+        dataset = dataset.batch(self.batch_length).prefetch(self.prefetch)
+        outputs = dataset.make_one_shot_iterator().get_next()
+        return list(outputs[:-1]), outputs[-1]
@@ -0,0 +1,120 @@
+"""
+This module contains the combiners of the ensemble, which run on the cached
+logits of its members.
+
+The logits of all members are one array of shape [members, subjects,
+classes], so a combination of members is a vector of member weights and many
+combinations are scored at once as a matrix product.
+"""
+
+import itertools
+import numpy as np
+
+
+def softmax(logits):
+    """
+    Returns: the class probabilities along the last axis of the logits
+    """
+    exp = np.exp(logits - np.max(logits, axis=-1, keepdims=True))
+    return exp / np.sum(exp, axis=-1, keepdims=True)
+
+
+def member_weights(weights, members):
+    """
+    Returns: the weights as an array normalized to sum 1, equal weights if
+    'weights' is None
+    """
+    if weights is None:
+        weights = np.ones(members)
+    weights = np.asarray(weights, dtype=np.float64)
+    return weights / np.sum(weights)
+
+
+def member_images(image_data, member, members):
+    """
+    Returns: the images of the member of an ensemble of 'members' models in
+    a loaded batch, the image of its modality if the batch has one image per
+    member, else the whole batch, as for an ensemble over epochs
+    """
+    if len(image_data) != members:
+        return image_data
+    return image_data[member]
+
+
+def weighted_mean(logits, weights=None):
+    """
+    Returns: the weighted mean of the member logits, [subjects, classes]
+    """
+    return np.tensordot(member_weights(weights, len(logits)), logits, 1)
+
+
+def majority_vote(logits, weights=None):
+    """
+    Returns: the weighted votes of the members for each class, [subjects,
+    classes]. Ties of the votes go to the class with the larger mean
+    probability.
+    """
+    weights = member_weights(weights, len(logits))
+    votes = np.eye(logits.shape[2])[np.argmax(logits, 2)]
+    # Scaled below the vote of one member, so it only decides ties
+    tie_break = np.tensordot(weights, softmax(logits), 1) * \
+        np.min(weights[weights > 0]) * 1e-3
+    return np.tensordot(weights, votes, 1) + tie_break
+
+
+COMBINERS = {'mean': weighted_mean, 'vote': majority_vote}
+
+
+def accuracies(logits, labels, weights, chunk_size=1024):
+    """
+    Returns: the accuracy of the weighted mean of each row of the weight
+    matrix [configurations, members], computed for 'chunk_size'
+    configurations at a time
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    scores = []
+    for start in range(0, len(weights), chunk_size):
+        combined = np.einsum('cm,msk->csk',
+                             weights[start:start + chunk_size], logits)
+        scores.append(np.mean(np.argmax(combined, 2) == labels, axis=1))
+    return np.concatenate(scores)
+
+
+def subset_weights(members, max_size=None):
+    """
+    Returns: the weight matrix of all subsets of up to 'max_size' members
+    with equal weights, [configurations, members]
+    """
+    rows = []
+    for size in range(1, (max_size or members) + 1):
+        for subset in itertools.combinations(range(0, members), size):
+            row = np.zeros(members)
+            row[list(subset)] = 1.0 / size
+            rows.append(row)
+    return np.array(rows)
+
+
+def greedy_selection(logits, labels, max_size=None):
+    """
+    Forward selection with replacement: starting from no member, the member
+    whose addition gives the best accuracy of the mean logits is added until
+    the accuracy no longer improves or 'max_size' members are selected.
+
+    Returns: (number of times each member was selected, accuracy after each
+    addition)
+    """
+    members = len(logits)
+    counts = np.zeros(members)
+    total = np.zeros(logits.shape[1:])
+    history = []
+    for step in range(0, max_size or 2 * members):
+        # The sums with each member are scored at once
+        candidates = np.argmax(total[np.newaxis] + logits, 2)
+        scores = np.mean(candidates == labels, axis=1)
+        best = int(np.argmax(scores))
+        if history and scores[best] <= history[-1]:
+            break
+        counts[best] += 1
+        total += logits[best]
+        history.append(scores[best])
+    return counts, history
@@ -0,0 +1,66 @@
+"""
+This module contains the evaluation iterator of the input objects.
+
+The class-balanced next_batch() of the input objects repeats the images of the
+smaller classes until the largest class has been read once, so evaluating with
+it scores some images several times. The evaluation batches visit every image
+of the input exactly once, in a fixed order, and pad the last batch with
+copies of its last image to the full batch size. The number of real images of
+each batch masks the padding out of the results. The images are read without
+augmentation and without drawing from the generator of the input, so the
+evaluation is repeatable and leaves the batch order of a training input
+unchanged.
+"""
+
+import random
+
+
+def evaluation_files(data_input):
+    """
+    Returns: (files, classes) of all images of the input, sorted within each
+    class
+    """
+    files = []
+    classes = []
+    for class_label, class_files in enumerate(data_input.files):
+        files += sorted(class_files)
+        classes += [class_label] * len(class_files)
+    return files, classes
+
+
+def evaluation_batches(data_input, batch_size):
+    """
+    Yields (batch_filenames, batch_images, batch_labels, count) of the images
+    of the input, each exactly once, where only the first 'count' entries of
+    the last batch are images of the input and the others are padding.
+    Args:
+        data_input: input object (DataInput, MultichannelDataInput,
+                    FusionDataInput, DataInputPerceptron, PrefetchDataInput
+                    or FeatureDataInput)
+        batch_size: number of images per batch
+    """
+    augmentation = None
+    if not hasattr(data_input, 'feature_sets'):
+        # The images are read directly, the prefetched batches of the
+        # wrapped input keep their class-balanced order. Batches still
+        # loading are awaited, as the augmentation is switched off below.
+        for pending in getattr(data_input, 'pending', []):
+            pending.wait()
+        data_input = getattr(data_input, 'data_input', data_input)
+        augmentation = getattr(data_input, 'augmentation', None)
+    files, classes = evaluation_files(data_input)
+    if augmentation is not None:
+        data_input.augmentation = None
+    try:
+        for start in range(0, len(files), batch_size):
+            batch_files = files[start:start + batch_size]
+            batch_classes = classes[start:start + batch_size]
+            count = len(batch_files)
+            batch_files += [batch_files[-1]] * (batch_size - count)
+            batch_classes += [batch_classes[-1]] * (batch_size - count)
+            batch_files, batch_images, batch_labels = data_input.load_batch(
+                batch_files, batch_classes, random.Random(0))
+            yield batch_files, batch_images, batch_labels, count
+    finally:
+        if augmentation is not None:
+            data_input.augmentation = augmentation
@@ -0,0 +1,104 @@
+"""
+This module keeps trained models restored in their own TensorFlow sessions,
+so that their layer outputs can be computed for every batch without reading
+the checkpoint again.
+"""
+
+import collections
+import tensorflow as tf
+import numpy as np
+
+
+class FeatureExtractor:
+    """
+    Restores the model of a checkpoint once in a separate graph and session.
+    Initialize this class with the modality prefix of the tensor names and
+    the path of the .meta file.
+    """
+
+    def __init__(self, mode, meta_path):
+        self.mode = mode
+        self.meta_path = meta_path
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.sess = tf.Session(graph=self.graph)
+            saver = tf.train.import_meta_graph(meta_path)
+            saver.restore(self.sess, meta_path.split('.meta')[0])
+        self.images = self.graph.get_tensor_by_name(mode + 'images:0')
+        self.keep_prob = self.graph.get_tensor_by_name(mode + 'keep_prob:0')
+        self.layers = {}
+
+    def layer_tensors(self, layer_path):
+        """
+        Returns: the tensors of the layer, the three first convolutions for
+        'conv1' and else the tensor with the name 'layer_path'
+        """
+        if layer_path not in self.layers:
+            if layer_path == 'conv1':
+                names = ['Train' + self.mode + '/' + self.mode + layer + '/' +
+                         self.mode + layer + ':0'
+                         for layer in ['conv1_a', 'conv1_b', 'conv1_c']]
+            else:
+                names = [layer_path]
+            self.layers[layer_path] = [self.graph.get_tensor_by_name(name)
+                                       for name in names]
+        return self.layers[layer_path]
+
+    def run(self, image_data, layer_path):
+        """
+        Returns: the output of the layer for the given images, the outputs of
+        the 'conv1' layers are concatenated along the channels
+        """
+        outputs = self.sess.run(self.layer_tensors(layer_path),
+                                feed_dict={
+                                    self.images: image_data,
+                                    self.keep_prob: 1.0
+                                })
+        if len(outputs) == 1:
+            return outputs[0]
+        return np.concatenate(outputs, 4)
+
+    def close(self):
+        self.sess.close()
+
+
+class FeatureExtractorCache:
+    """
+    Keeps up to 'max_models' restored models open, closing the least
+    recently used one when another model is needed. With 'max_models' 0
+    every model is restored for a single call and closed again.
+    """
+
+    def __init__(self, max_models=4):
+        self.max_models = max_models
+        self.extractors = collections.OrderedDict()
+
+    def get(self, mode, meta_path):
+        """
+        Returns: the FeatureExtractor of the checkpoint, restored if it is not
+        open yet
+        """
+        key = (meta_path, mode)
+        if key in self.extractors:
+            self.extractors.move_to_end(key)
+            return self.extractors[key]
+        extractor = FeatureExtractor(mode, meta_path)
+        if self.max_models > 0:
+            while len(self.extractors) >= self.max_models:
+                self.extractors.popitem(last=False)[1].close()
+            self.extractors[key] = extractor
+        return extractor
+
+    def features(self, mode, meta_path, image_data, layer_path):
+        extractor = self.get(mode, meta_path)
+        features = extractor.run(image_data, layer_path)
+        if self.max_models == 0:
+            extractor.close()
+        return features
+
+    def clear(self):
+        """
+        Closes all open sessions.
+        """
+        while self.extractors:
+            self.extractors.popitem()[1].close()
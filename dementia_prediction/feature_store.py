@@ -0,0 +1,264 @@
+"""
+This module contains a store of the activations of frozen models for the
+toptuning models.
+
+The frozen layers are run once over all images of the train and validation
+data. Their outputs are saved in chunks of float32 .npy files per modality
+and layer and memory-mapped when training the top layers, so an epoch of
+toptuning no longer runs the 3D convolutions of the frozen model.
+"""
+
+import os
+import pickle
+import random
+import hashlib
+import numpy as np
+
+
+def subject_key(filename):
+    """
+    Returns: the key of an image in the store, the filename without folder,
+    which starts with the patient code and is shared by the modality files
+    """
+    return filename.rsplit('/', 1)[-1]
+
+
+class FeatureSet:
+    """
+    The stored outputs of one layer of one frozen model. Initialize this
+    class with the store folder, the modality prefix of the model, the path
+    of its .meta file and the tensor name of the layer.
+    """
+
+    def __init__(self, store_dir, mode, meta_path, layer_path):
+        key = hashlib.md5((mode + meta_path + layer_path).encode()).hexdigest()
+        self.path = os.path.join(store_dir, mode + '_' + key[:12])
+        self.index_path = os.path.join(self.path, 'index.pkl')
+        self.mode = mode
+        self.meta_path = meta_path
+        self.layer_path = layer_path
+        self.chunks = {}
+        checkpoint = os.stat(meta_path).st_mtime
+        self.index = {'checkpoint': checkpoint, 'chunks': 0, 'rows': {}}
+        if not os.path.exists(self.path):
+            os.makedirs(self.path, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as filep:
+                index = pickle.load(filep)
+            # Features of an older checkpoint are extracted again
+            if index['checkpoint'] == checkpoint:
+                self.index = index
+            else:
+                print("Checkpoint", meta_path, "changed, extracting again",
+                      flush=True)
+
+    def missing(self, keys):
+        """
+        Returns: the keys which are not in the store yet
+        """
+        return [key for key in keys if key not in self.index['rows']]
+
+    def new_chunk(self, rows, shape):
+        """
+        Returns: a float32 array of 'rows' features of the given shape for
+        the next chunk, memory-mapped to a temporary .npy file, which add()
+        stores
+        """
+        path = os.path.join(self.path,
+                            'chunk_' + str(self.index['chunks']) + '.npy')
+        return np.lib.format.open_memmap(
+            path + '.' + str(os.getpid()) + '.tmp', mode='w+',
+            dtype=np.float32, shape=(rows,) + tuple(shape))
+
+    def add(self, keys, features):
+        """
+        Stores the features of the given keys, an array of new_chunk(), as a
+        new chunk.
+        """
+        chunk = self.index['chunks']
+        path = os.path.join(self.path, 'chunk_' + str(chunk) + '.npy')
+        features.flush()
+        os.replace(features.filename, path)
+        for row, key in enumerate(keys):
+            self.index['rows'][key] = (chunk, row)
+        self.index['chunks'] = chunk + 1
+        tmp_path = self.index_path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'wb') as filep:
+            pickle.dump(self.index, filep)
+        os.replace(tmp_path, self.index_path)
+
+    def chunk(self, chunk):
+        if chunk not in self.chunks:
+            self.chunks[chunk] = np.load(
+                os.path.join(self.path, 'chunk_' + str(chunk) + '.npy'),
+                mmap_mode='r')
+        return self.chunks[chunk]
+
+    def get(self, keys):
+        """
+        Returns: the stored features of the given keys as one array
+        """
+        rows = [self.index['rows'][key] for key in keys]
+        return np.stack([self.chunk(chunk)[row] for chunk, row in rows])
+
+
+class FeatureStore:
+    """
+    Initialize this class with the store folder and the number of images per
+    chunk.
+    """
+
+    def __init__(self, store_dir, chunk_size=256):
+        self.store_dir = store_dir
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Returns: the store configured with the 'feature_store' folder and the
+        optional 'feature_chunk' size of the cnn parameters, None if no
+        store folder is set.
+        """
+        if not params.get('feature_store'):
+            return None
+        return cls(params['feature_store'], params.get('feature_chunk', 256))
+
+    def extract(self, data_input, layers, cnnutils):
+        """
+        Runs the frozen layers over all images of the dataset which are not
+        in the store yet.
+        Args:
+            data_input: input object of the images
+            layers: list of (mode, meta_path, layer_path, index) of the
+                    frozen layers, 'index' selects the modality of a fusion
+                    input and is None for single modality inputs, or is a
+                    function returning the images of the layer from a
+                    loaded batch
+            cnnutils: CNNUtils object computing the layer outputs
+
+        Returns: the FeatureSet of each layer
+        """
+        # The frozen layers see the images without augmentation and without
+        # the prefetching wrapper
+        data_input = getattr(data_input, 'data_input', data_input)
+        augmentation = data_input.augmentation
+        data_input.augmentation = None
+        filenames = {subject_key(filename): filename
+                     for class_files in data_input.files
+                     for filename in class_files}
+        try:
+            return [self.extract_layer(data_input, filenames, layer, cnnutils)
+                    for layer in layers]
+        finally:
+            data_input.augmentation = augmentation
+
+    def extract_layer(self, data_input, filenames, layer, cnnutils):
+        """
+        Returns: the FeatureSet of the layer (mode, meta_path, layer_path,
+        index), after storing the outputs of the images of 'filenames', a
+        dictionary of subject key and path, which are not in it yet
+        """
+        mode, meta_path, layer_path, _ = layer
+        feature_set = FeatureSet(self.store_dir, mode, meta_path, layer_path)
+        missing = feature_set.missing(sorted(filenames))
+        if missing:
+            print("Extracting", layer_path, "of", len(missing), "images",
+                  "into", feature_set.path, flush=True)
+        for start in range(0, len(missing), self.chunk_size):
+            keys = missing[start:start + self.chunk_size]
+            features = self.extract_chunk(
+                data_input, [filenames[key] for key in keys], layer,
+                cnnutils, feature_set)
+            feature_set.add(keys, features)
+        return feature_set
+
+    def extract_chunk(self, data_input, batch_files, layer, cnnutils,
+                      feature_set):
+        """
+        Returns: the new chunk of the feature set with the outputs of the
+        layer for the files, see FeatureSet.new_chunk(). The features of
+        each batch are written to the chunk file as they arrive, so only one
+        batch is kept in memory.
+        """
+        mode, meta_path, layer_path, index = layer
+        batch_size = data_input.params['batch_size']
+        features = None
+        try:
+            for start in range(0, len(batch_files), batch_size):
+                files = batch_files[start:start + batch_size]
+                count = len(files)
+                # The frozen graph expects full batches
+                files += [files[-1]] * (batch_size - count)
+                _, image_data, _ = data_input.load_batch(
+                    files, [0] * batch_size, random.Random(0))
+                if callable(index):
+                    image_data = index(image_data)
+                elif index is not None:
+                    image_data = image_data[index]
+                batch_features = cnnutils.get_features(
+                    mode, meta_path, image_data, layer_path)[:count]
+                if features is None:
+                    features = feature_set.new_chunk(
+                        len(batch_files), np.shape(batch_features)[1:])
+                features[start:start + count] = batch_features
+        except BaseException:
+            # A failed chunk leaves no temporary file
+            if features is not None:
+                os.remove(features.filename)
+            raise
+        return features
+
+    def data_input(self, data_input, layers, cnnutils):
+        """
+        Returns: a FeatureDataInput of the dataset, after extracting the
+        missing features
+        """
+        try:
+            feature_sets = self.extract(data_input, layers, cnnutils)
+        finally:
+            # The features replace the batches of a prefetching wrapper
+            if hasattr(data_input, 'close'):
+                data_input.close()
+        return FeatureDataInput(getattr(data_input, 'data_input', data_input),
+                                feature_sets)
+
+
+class FeatureDataInput:
+    """
+    Provides the batches of an input object with the stored features in
+    place of the images. The class-balanced batches are selected by the
+    wrapped input, the features of several layers are concatenated along the
+    channels.
+    """
+
+    def __init__(self, data_input, feature_sets):
+        self.data_input = data_input
+        self.feature_sets = feature_sets
+
+    def __getattr__(self, name):
+        # files, batch_index, reset() etc. are those of the wrapped input
+        if name == 'data_input':
+            raise AttributeError(name)
+        return getattr(self.data_input, name)
+
+    def load_batch(self, batch_files, batch_classes, rng=None):
+        """
+        Returns: (batch_filenames, batch_features, batch_labels), 'rng' is
+        not used since the features are not augmented
+        """
+        keys = [subject_key(filename) for filename in batch_files]
+        features = [feature_set.get(keys) for feature_set in self.feature_sets]
+        if len(features) == 1:
+            batch_features = features[0]
+        else:
+            batch_features = np.concatenate(features, -1)
+        batch_labels = np.zeros((len(batch_files), self.num_classes))
+        for iterate, class_label in enumerate(batch_classes):
+            batch_labels[iterate][class_label] = 1
+        return batch_files, batch_features, batch_labels
+
+    def next_batch(self):
+        """
+        Returns: (batch_filenames, batch_features, batch_labels)
+        """
+        return self.load_batch(*self.data_input.select_batch())
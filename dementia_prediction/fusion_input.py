@@ -5,8 +5,10 @@ This module contains functions to handle the fusion input data to the CNN model.
 import math
 import random
 import numpy as np
-import nibabel as nb
-import scipy.ndimage.interpolation as sni
+from dementia_prediction.volume_cache import VolumeCache, load_volume
+from dementia_prediction.batch_buffer import BatchBuffer
+from dementia_prediction.augmentation import Augmentation
+from dementia_prediction.augmentation_manifest import AugmentationManifest
 
 class FusionDataInput:
     """
@@ -20,6 +22,21 @@ class FusionDataInput:
         self.files = [data[i] for i in range(0, self.num_classes)]
         self.batch_index = [0 for i in range(0, self.num_classes)]
         self.name = name
+        self.cache = VolumeCache.from_params(self.params)
+        self.buffer = BatchBuffer.from_params(self.params)
+        # Seeding 'seed' makes the batch order reproducible
+        self.random = random.Random(self.params.get('seed'))
+        # Only the training images are augmented
+        self.augmentation = None
+        self.augmented = None
+        if name == 'train':
+            self.augmentation = Augmentation.from_params(self.params)
+            # The augmented images of an 'augmentation_manifest' are
+            # resampled from their source images when they are read
+            self.augmented = AugmentationManifest.from_params(self.params)
+            if self.augmented is not None:
+                self.files = [self.augmented.expand(class_files)
+                              for class_files in self.files]
         self.mean = mean
         self.var = var
         self.mode_folders = [params['mode_folder'+str(i)] for i in range(1, 4)]
@@ -45,48 +62,34 @@ class FusionDataInput:
     def shuffle(self):
         for class_label in range(0, self.num_classes):
             shuffle_indices = list(range(len(self.files[class_label])))
-            random.shuffle(shuffle_indices)
+            self.random.shuffle(shuffle_indices)
             self.files[class_label] = [self.files[class_label][i] for i in shuffle_indices]
-    def rotate(self, filename, direction):
-        angle_rot = random.uniform(-3, 3)
-        mri_image = nb.load(filename).get_data()
-        if direction == 'x':
-            return sni.rotate(mri_image, angle_rot, (0,1), reshape=False)
-        if direction == 'y':
-            return sni.rotate(mri_image, angle_rot, (0,2), reshape=False)
-        if direction == 'z':
-            return sni.rotate(mri_image, angle_rot, (1,2), reshape=False)
+    def reset(self):
+        """
+        Starts a new pass over the data with shuffled files in each class.
+        """
+        for class_label in range(0, self.num_classes):
+            self.batch_index[class_label] = 0
+        self.shuffle()
 
-    def translate(self, filename, direction):
-        pixels = random.uniform(-4, 4)
-        mri_image = nb.load(filename).get_data()
-        if direction == 'x':
-            return sni.shift(mri_image, [pixels, 0, 0], mode='nearest')
-        if direction == 'y':
-            return sni.shift(mri_image, [0, pixels, 0], mode='nearest')
-        if direction == 'z':
-            return sni.shift(mri_image, [0, 0, pixels], mode='nearest')
-    
-    def next_batch(self):
+    def select_batch(self):
         """
-        This functions retrieves the next batch of the data.
+        This function selects the files of the next class-balanced batch and
+        advances the position in each class.
 
-        Returns: (batch_filenames, batch_images, batch_labels)
+        Returns: (batch_files, batch_classes)
 
         """
-        batch_images = [np.array([], np.float) for i in range(0,
-                                                              len(self.modalities))]
-        batch_labels = np.zeros((self.params['batch_size'], self.num_classes))
-
-        iterate = 0
         batch_files = []
+        batch_classes = []
+        # Increment batch_size/num_class for each class
         inc = 1
         # If unbalanced, then increment the images of a specific class, say 0
         unbalanced = self.params['batch_size']%self.num_classes
         batch_order = []
         for i in range(0, self.num_classes):
             batch_order += [i for j in range(0,int(self.params['batch_size']/self.num_classes))]
-        random.shuffle(batch_order)
+        self.random.shuffle(batch_order)
         for class_label in batch_order:
             start = self.batch_index[class_label]
             class_files = []
@@ -102,39 +105,59 @@ class FusionDataInput:
                 class_files = [self.files[class_label][i] for i in range(start, len(self.files[class_label]))]
                 left_files = end - len(self.files[class_label])
                 shuffle_indices = list(range(len(self.files[class_label])))
-                random.shuffle(shuffle_indices)
+                self.random.shuffle(shuffle_indices)
                 self.files[class_label] = [self.files[class_label][i] for i in shuffle_indices]
                 start = 0
                 end = left_files
                 self.batch_index[class_label] = left_files
             for i in range(start, end):
                 class_files.append(self.files[class_label][i])
-            for filename in class_files:
-                for index in range(0, len(self.modalities)):
-                    mode_file = self.mode_folders[index]+\
-                                filename.rsplit('/',1)[1]
-                    mri_image = []
-                    if 'rot' in filename:
-                        split_filename = mode_file.split('rot')
-                        mri_image = self.rotate(split_filename[0], split_filename[1])
-                    elif 'trans' in filename:
-                        split_filename = mode_file.split('trans')
-                        mri_image = self.translate(split_filename[0], split_filename[1])
-                    else:
-                        mri_image = nb.load(mode_file)
-                        mri_image = mri_image.get_data()
-                    #print(self.name+" "+mode_file+" "+str(class_label), flush=True)
-                    mri_image = np.reshape(mri_image, [1, self.params['depth'],
-                                                       self.params['height'],
-                                                       self.params['width'], 1])
-
-                    if len(batch_images[index]) == 0:
-                        batch_images[index] = mri_image
-                    else:
-                        batch_images[index] = np.append(batch_images[index],
-                                                       mri_image,
-                                                  axis=0)
-                batch_labels[iterate][class_label] = 1 #class_label: 0 - NC, 1 - MCI, 2 - AD
-                iterate += 1
             batch_files += class_files
+            batch_classes += [class_label for i in range(0, len(class_files))]
+        return batch_files, batch_classes
+
+    def load_batch(self, batch_files, batch_classes, rng=None):
+        """
+        This function reads every modality of the given files into a
+        preallocated batch array per modality.
+        Args:
+            batch_files: filenames of the batch
+            batch_classes: class label of each file
+            rng: random generator for the augmentation, by default the
+                 generator of this input
+
+        Returns: (batch_filenames, batch_images, batch_labels)
+
+        """
+        if rng is None:
+            rng = self.random
+        batch_images = [self.buffer.get([len(batch_files),
+                                         self.params['depth'],
+                                         self.params['height'],
+                                         self.params['width'], 1], key=index)
+                        for index in range(0, len(self.modalities))]
+        batch_labels = np.zeros((len(batch_files), self.num_classes))
+        for iterate, filename in enumerate(batch_files):
+            for index in range(0, len(self.modalities)):
+                mode_file = self.mode_folders[index]+\
+                            filename.rsplit('/',1)[1]
+                mri_image = load_volume(mode_file, self.cache, self.augmented)
+                batch_images[index][iterate, :, :, :, 0] = np.reshape(
+                    mri_image, [self.params['depth'], self.params['height'],
+                                self.params['width']])
+            batch_labels[iterate][batch_classes[iterate]] = 1 #class_label: 0 - NC, 1 - MCI, 2 - AD
+        if self.augmentation is not None:
+            self.augmentation.augment(batch_images, rng)
         return batch_files, batch_images, batch_labels
+
+    def next_batch(self):
+        """
+        This functions retrieves the next batch of the data.
+
+        Returns: (batch_filenames, batch_images, batch_labels)
+
+        """
+        batch_files, batch_classes = self.select_batch()
+        # Each batch is augmented with its own seed, as in PrefetchDataInput
+        rng = random.Random(self.random.getrandbits(32))
+        return self.load_batch(batch_files, batch_classes, rng)
@@ -0,0 +1,188 @@
+"""
+This module contains the subject manifest, a single SQLite file with the
+class labels, scanners and the train/validation splits of every cross
+validation fold of the data sets.
+
+It replaces the pickled dictionaries of the Dictionaries folder. A script
+reads only the rows of its data set and fold instead of unpickling whole
+files, and any number of folds is stored in the same file.
+
+Convert existing pickle dictionaries with e.g.
+    python -m dementia_prediction.manifest manifest.db UHG_T1 \
+        --labels patients.pkl --train train_1.pkl --valid valid_1.pkl --fold 1
+"""
+
+import pickle
+import sqlite3
+import argparse
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subjects (
+    dataset TEXT NOT NULL,
+    patient_code TEXT NOT NULL,
+    label INTEGER,
+    scanner TEXT,
+    PRIMARY KEY (dataset, patient_code)
+);
+CREATE TABLE IF NOT EXISTS splits (
+    dataset TEXT NOT NULL,
+    fold INTEGER NOT NULL,
+    patient_code TEXT NOT NULL,
+    split TEXT NOT NULL,
+    PRIMARY KEY (dataset, fold, patient_code)
+);
+CREATE INDEX IF NOT EXISTS splits_fold ON splits (dataset, fold, split);
+"""
+
+
+class Manifest:
+    """
+    Initialize this class with the path of the manifest file, which is
+    created if it does not exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Returns: the manifest of the 'manifest' path of the parameters, None
+        if it is not set.
+        """
+        if not params.get('manifest'):
+            return None
+        return cls(params['manifest'])
+
+    def add_subjects(self, dataset, labels, scanners=None):
+        """
+        Adds or updates the subjects of a data set.
+        Args:
+            dataset: name of the data set, e.g. 'UHG_T1'
+            labels: dictionary of patient code and class label
+            scanners: optional dictionary of patient code and scanner
+        """
+        scanners = scanners or {}
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO subjects VALUES (?, ?, ?, ?)",
+                [(dataset, str(code), int(label), scanners.get(code))
+                 for code, label in labels.items()])
+
+    def add_split(self, dataset, fold, split, patients):
+        """
+        Assigns the patients to the split ('train' or 'valid') of a fold.
+        Patients given as a dictionary of class labels are also added to the
+        subjects, if they are not in the manifest yet.
+        """
+        with self.connection:
+            if isinstance(patients, dict):
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO subjects VALUES (?, ?, ?, NULL)",
+                    [(dataset, str(code), int(label))
+                     for code, label in patients.items()])
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO splits VALUES (?, ?, ?, ?)",
+                [(dataset, int(fold), str(code), split)
+                 for code in patients])
+
+    def labels(self, dataset):
+        """
+        Returns: dictionary of patient code and class label of the data set
+        """
+        return dict(self.connection.execute(
+            "SELECT patient_code, label FROM subjects WHERE dataset = ? "
+            "ORDER BY rowid", (dataset,)))
+
+    def scanners(self, dataset):
+        """
+        Returns: dictionary of patient code and scanner of the data set
+        """
+        return dict(self.connection.execute(
+            "SELECT patient_code, scanner FROM subjects WHERE dataset = ? "
+            "AND scanner IS NOT NULL ORDER BY rowid", (dataset,)))
+
+    def split(self, dataset, fold, split):
+        """
+        Returns: dictionary of patient code and class label of the patients
+        in the split of the fold, in the order they were added
+        """
+        return dict(self.connection.execute(
+            "SELECT splits.patient_code, subjects.label FROM splits "
+            "LEFT JOIN subjects ON subjects.dataset = splits.dataset AND "
+            "subjects.patient_code = splits.patient_code "
+            "WHERE splits.dataset = ? AND splits.fold = ? AND "
+            "splits.split = ? ORDER BY splits.rowid",
+            (dataset, int(fold), split)))
+
+    def folds(self, dataset):
+        """
+        Returns: sorted list of the folds of the data set
+        """
+        return [row[0] for row in self.connection.execute(
+            "SELECT DISTINCT fold FROM splits WHERE dataset = ? "
+            "ORDER BY fold", (dataset,))]
+
+    def close(self):
+        self.connection.close()
+
+
+def load_patients(params, key, split=None):
+    """
+    Loads class labels or the patients of a split, from the pickle file
+    params[key] or, if the parameters set a 'manifest', from its 'dataset'.
+    Args:
+        params: parameters with the pickle paths or the 'manifest',
+                'dataset' and optional 'fold' (default 1) keys
+        key: parameter of the pickle file path
+        split: None for the class labels, else 'train' or 'valid'
+
+    Returns: the unpickled dictionary or list, or a dictionary of patient
+    code and class label from the manifest
+    """
+    manifest = Manifest.from_params(params)
+    if manifest is None:
+        with open(params[key], 'rb') as filep:
+            return pickle.load(filep)
+    if split is None:
+        patients = manifest.labels(params['dataset'])
+    else:
+        patients = manifest.split(params['dataset'],
+                                  int(params.get('fold', 1)), split)
+    manifest.close()
+    return patients
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Add pickle dictionaries to a subject manifest")
+    parser.add_argument("manifest", type=str, help='Path to the manifest')
+    parser.add_argument("dataset", type=str, help='Name of the data set')
+    parser.add_argument("--labels", type=str,
+                        help='Pickle dictionary of the class labels')
+    parser.add_argument("--scanners", type=str,
+                        help='Pickle dictionary of the scanners')
+    parser.add_argument("--train", type=str,
+                        help='Pickle of the training patients')
+    parser.add_argument("--valid", type=str,
+                        help='Pickle of the validation patients')
+    parser.add_argument("--fold", type=int, default=1,
+                        help='Fold of the train and valid pickles')
+    args = parser.parse_args()
+
+    manifest = Manifest(args.manifest)
+    if args.labels:
+        scanners = None
+        if args.scanners:
+            scanners = pickle.load(open(args.scanners, 'rb'))
+        manifest.add_subjects(args.dataset,
+                              pickle.load(open(args.labels, 'rb')), scanners)
+    for split, split_path in [('train', args.train), ('valid', args.valid)]:
+        if split_path:
+            manifest.add_split(args.dataset, args.fold, split,
+                               pickle.load(open(split_path, 'rb')))
+    print(args.dataset, "subjects:", len(manifest.labels(args.dataset)),
+          "folds:", manifest.folds(args.dataset))
+    manifest.close()
@@ -6,6 +6,7 @@ import numpy as np
 import sys
 import pprint
 from dementia_prediction.cnn_utils import CNNUtils
+from dementia_prediction.dataset_input import DatasetInput, placeholder
 
 
 class CNNMultimodal:
@@ -169,11 +170,10 @@ class CNNMultimodal:
         images3 = images[2]
         total_seen = 0
         pred_out = {}
-        num_steps = self.cnnutils.num_steps(dataset)
-        for step in range(num_steps):
-            patients, image_data, label_data = dataset.next_batch()
-            predictions, correct_, loss_, xloss_, l2loss_ = \
-                sess.run([eval_op, corr, loss, xloss, l2loss],
+        for patients, image_data, label_data, count in \
+                self.cnnutils.eval_batches(dataset):
+            correct_, loss_, xloss_, l2loss_ = \
+                sess.run([corr, loss, xloss, l2loss],
                 feed_dict={
                     images1: image_data[0],
                     images2: image_data[1],
@@ -181,10 +181,12 @@ class CNNMultimodal:
                     labels: label_data,
                     keep_prob: 1.0
                 })
+            # The padding of the last batch is not counted
+            correct_ = correct_[:count]
             print("Prediction:", correct_)
-            correct_predictions += predictions
-            pred_out.update(dict(zip(patients, correct_)))
-            total_seen += self.param['batch_size']
+            correct_predictions += np.sum(correct_)
+            pred_out.update(dict(zip(patients[:count], correct_)))
+            total_seen += count
             print("Accuracy until "+str(total_seen)+" data points is: " +
                       str(correct_predictions/total_seen))
             print("loss", loss_, xloss_, l2loss_)
@@ -209,33 +211,28 @@ class CNNMultimodal:
 
         """
         mode = 'Fusion'
+        # With a 'dataset' section, the training batches are read by a
+        # tf.data pipeline and the placeholders are only fed for evaluation
+        dataset = DatasetInput.from_params(self.param, train_data)
         with tf.Graph().as_default():
-            images1 = tf.placeholder(dtype=tf.float32,
-                                    shape=[None,
-                                           self.param['depth'],
-                                           self.param['height'],
-                                           self.param['width'],
-                                           self.param['channels']],
-                                     name=self.modalities[0]+'images')
-            images2 = tf.placeholder(dtype=tf.float32,
-                                     shape=[None,
-                                            self.param['depth'],
-                                            self.param['height'],
-                                            self.param['width'],
-                                            self.param['channels']],
-                                     name=self.modalities[1]+'images')
-
-            images3 = tf.placeholder(dtype=tf.float32,
-                                     shape=[None,
-                                            self.param['depth'],
-                                            self.param['height'],
-                                            self.param['width'],
-                                            self.param['channels']],
-                                     name=self.modalities[2] + 'images')
-
-            labels = tf.placeholder(dtype=tf.int8,
-                                    shape=[None, self.param['classes']],
-                                    name=mode+'labels')
+            image_shape = [self.param['depth'], self.param['height'],
+                           self.param['width'], self.param['channels']]
+            batch_images = [None, None, None]
+            batch_labels = None
+            if dataset is not None:
+                batch_images, batch_labels = dataset.next_batch(
+                    [image_shape] * 3)
+            images1 = placeholder(tf.float32, [None] + image_shape,
+                                  self.modalities[0] + 'images',
+                                  batch_images[0])
+            images2 = placeholder(tf.float32, [None] + image_shape,
+                                  self.modalities[1] + 'images',
+                                  batch_images[1])
+            images3 = placeholder(tf.float32, [None] + image_shape,
+                                  self.modalities[2] + 'images',
+                                  batch_images[2])
+            labels = placeholder(tf.int8, [None, self.param['classes']],
+                                 mode + 'labels', batch_labels)
             keep_prob = tf.placeholder(tf.float32, name=mode+'keep_prob')
             global_step = tf.get_variable(name=mode+'global_step',
                                           shape=[],
@@ -343,31 +340,29 @@ class CNNMultimodal:
                 summary_op = tf.summary.merge_all()
                 tf.get_default_graph().finalize()
 
-                for i in range(0, len(validation_data.files)):
-                    validation_data.batch_index[i] = 0
-                    train_data.batch_index[i] = 0
-                    validation_data.shuffle()
-                    train_data.shuffle()
+                validation_data.reset()
+                train_data.reset()
                 for step in range(1, num_steps):
                     print("Step:", step, "/", num_steps)
                     
                     start_time = time.time()
-                    _, image_data, label_data = train_data.next_batch()
+                    feed_dict = {keep_prob: self.param['keep_prob']}
+                    fetches = [summary_op, train_op, total_loss, xloss,
+                               l2loss]
+                    if dataset is None:
+                        _, image_data, label_data = train_data.next_batch()
+                        feed_dict.update({images1: image_data[0],
+                                          images2: image_data[1],
+                                          images3: image_data[2],
+                                          labels: label_data})
+                    elif step % 50 == 0:
+                        # The batch of the pipeline for the batch accuracy
+                        fetches += [[images1, images2, images3], labels]
+                    outputs = sess.run(fetches, feed_dict=feed_dict)
                     summary_values, _, loss_value, cross_loss, l2_loss = \
-                        sess.run(
-                        [summary_op,
-                         train_op,
-                         total_loss,
-                         xloss,
-                         l2loss],
-                        feed_dict={
-                            images1: image_data[0],
-                            images2: image_data[1],
-                            images3: image_data[2],
-                            labels: label_data,
-                            keep_prob: self.param['keep_prob']
-                        }
-                    )
+                        outputs[:5]
+                    if len(outputs) > 5:
+                        image_data, label_data = outputs[5:]
                     if step % num_batches_epoch == 0 or (step + 1) == num_steps:
                         checkpoint_path = self.param['checkpoint_path'] + \
                                           'multimodal_model.ckpt'
@@ -404,11 +399,8 @@ class CNNMultimodal:
                     # Saving Model Checkpoints for evaluation
                     if step % num_batches_epoch == 0 or (
                         step + 1) == num_steps:
-                        for i in range(0, len(validation_data.files)):
-                            validation_data.batch_index[i] = 0
-                            validation_data.shuffle()
-                            train_data.batch_index[i] = 0
-                            train_data.shuffle()
+                        validation_data.reset()
+                        train_data.reset()
 
                         # Evaluate against the training data.
                         print("Step: %d Training accuracy: %g " %
@@ -436,11 +428,8 @@ class CNNMultimodal:
                                                      loss=total_loss,
                                                      xloss=xloss,
                                                      l2loss=l2loss)))
-                        for i in range(0, len(validation_data.files)):
-                            validation_data.batch_index[i] = 0
-                            validation_data.shuffle()
-                            train_data.batch_index[i] = 0
-                            train_data.shuffle()
+                        validation_data.reset()
+                        train_data.reset()
                     sys.stdout.flush()
                 if test == True:
                     ckpt = tf.train.get_checkpoint_state(
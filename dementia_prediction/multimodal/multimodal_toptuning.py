@@ -6,6 +6,8 @@ import numpy as np
 import sys
 import pprint
 from dementia_prediction.cnn_utils import CNNUtils
+from dementia_prediction.feature_store import FeatureStore, FeatureDataInput
+from dementia_prediction.dataset_input import DatasetInput, placeholder
 
 class FusionToptune:
     """
@@ -29,9 +31,12 @@ class FusionToptune:
         pp.pprint(params)
 
 
-    def fuse_modalities(self, dataset):
-        features_images = np.array([], np.float)
-        patients, image_data, label_data = dataset.next_batch()
+    def feature_layers(self):
+        """
+        Returns: (mode, meta_path, layer_path, index) of the frozen fusion
+        layer of each modality
+        """
+        layers = []
         for i in range(0, len(self.modalities)):
             layer_path = ''
             if self.param['fusion_layer'] == 'conv7':
@@ -40,17 +45,34 @@ class FusionToptune:
                         'conv7:0'
             elif self.param['fusion_layer'] == 'conv1':
                 layer_path = 'conv1'
+            layers.append((self.modalities[i], self.meta_paths[i],
+                           layer_path, i))
+        return layers
+
+    def fuse_modalities(self, dataset, batch=None):
+        """
+        Returns: (patients, features, labels) of the next batch of the
+        dataset, or of the given batch read from it
+        """
+        if batch is None:
+            batch = dataset.next_batch()
+        if isinstance(dataset, FeatureDataInput):
+            # Features of the frozen layers are read from the feature store
+            return batch
+        features_images = np.array([], np.float)
+        patients, image_data, label_data = batch
+        for mode, meta_path, layer_path, i in self.feature_layers():
             if len(features_images) == 0:
                 features_images = self.cnnutils.get_features(
-                                                    self.modalities[i],
-                                                    self.meta_paths[i],
+                                                    mode,
+                                                    meta_path,
                                                     image_data[i],
                                                     layer_path)
             else:
                 features_images = np.append(features_images,
                                             self.cnnutils.get_features(
-                                                self.modalities[i],
-                                                self.meta_paths[i],
+                                                mode,
+                                                meta_path,
                                                 image_data[i],
                                                 layer_path),
                                             axis=4)
@@ -81,20 +103,22 @@ class FusionToptune:
         total_seen = 0
         pred_out = {}
 
-        num_steps = self.cnnutils.num_steps(dataset)
-
-        for step in range(num_steps):
-            patients, feature_images, label_data = self.fuse_modalities(dataset)
-            predictions, correct_, loss_, xloss_, l2loss_ = sess.run([eval_op, corr, loss, xloss, l2loss],
+        for batch in self.cnnutils.eval_batches(dataset):
+            count = batch[-1]
+            patients, feature_images, label_data = self.fuse_modalities(
+                dataset, batch[:-1])
+            correct_, loss_, xloss_, l2loss_ = sess.run([corr, loss, xloss, l2loss],
                                                     feed_dict={
                                                         fusion_input: feature_images,
                                                         labels: label_data,
                                                         keep_prob: 1.0
                                                     })
+            # The padding of the last batch is not counted
+            correct_ = correct_[:count]
             print("Prediction:", correct_)
-            correct_predictions += predictions
-            pred_out.update(dict(zip(patients, correct_)))
-            total_seen += self.param['batch_size']
+            correct_predictions += np.sum(correct_)
+            pred_out.update(dict(zip(patients[:count], correct_)))
+            total_seen += count
             print("Accuracy until " + str(total_seen) + " data points is: " +
                   str(correct_predictions / total_seen))
             print("loss", loss_, xloss_, l2loss_)
@@ -119,7 +143,30 @@ class FusionToptune:
             test: If true, tests the final model on the validation data
 
         """
+        store = FeatureStore.from_params(self.param)
+        if store is not None:
+            train_data = store.data_input(train_data, self.feature_layers(),
+                                          self.cnnutils)
+            validation_data = store.data_input(validation_data,
+                                               self.feature_layers(),
+                                               self.cnnutils)
+        # The tf.data pipeline reads the stored features, the frozen models
+        # can not run in its calls
+        dataset = None
+        if isinstance(train_data, FeatureDataInput):
+            dataset = DatasetInput.from_params(self.param, train_data)
+        elif self.param.get('dataset'):
+            print("The dataset input requires the feature_store, feeding the "
+                  "batches", flush=True)
         with tf.Graph().as_default():
+            batch_features = None
+            batch_labels = None
+            if dataset is not None:
+                shape = [1, 1, 1, 1536]
+                if self.param['fusion_layer'] == 'conv1':
+                    shape = [46, 55, 46, 135]
+                batch_features, batch_labels = dataset.next_batch([shape])
+                batch_features = batch_features[0]
             images1 = tf.placeholder(dtype=tf.float32,
                                      shape=[None,
                                             self.param['depth'],
@@ -142,9 +189,8 @@ class FusionToptune:
                                             self.param['width'],
                                             self.param['channels']],
                                      name=self.modalities[2] + 'images')
-            labels = tf.placeholder(dtype=tf.int8,
-                                    shape=[None, self.param['classes']],
-                                    name='fusionlabels')
+            labels = placeholder(tf.int8, [None, self.param['classes']],
+                                 'fusionlabels', batch_labels)
 
             keep_prob = tf.placeholder(tf.float32, name='fusionkeep_prob')
             global_step = tf.get_variable(name='fusionglobal_step',
@@ -174,18 +220,18 @@ class FusionToptune:
                 with tf.name_scope('Train') as scope:
                     logits = []
                     if self.param['fusion_layer'] == 'conv7':
-                        fusion_input = tf.placeholder(dtype=tf.float32,
-                                                        shape=[None, 1, 1, 1,
-                                                               1536],
-                                                        name='fusion_input')
+                        fusion_input = placeholder(tf.float32,
+                                                   [None, 1, 1, 1, 1536],
+                                                   'fusion_input',
+                                                   batch_features)
                         logits = self.cnnutils.fusion_conv7(fusion_input, keep_prob)
 
                         self.cnnutils.inference_loss(logits, labels)
                     if self.param['fusion_layer'] == 'conv1':
-                        fusion_input = tf.placeholder(dtype=tf.float32,
-                                                        shape=[None, 46, 55,
-                                                               46, 135],
-                                                        name='fusion_input')
+                        fusion_input = placeholder(tf.float32,
+                                                   [None, 46, 55, 46, 135],
+                                                   'fusion_input',
+                                                   batch_features)
                         logits = self.cnnutils.fusion_conv1(fusion_input,
                                                             keep_prob)
                         self.cnnutils.inference_loss(logits, labels)
@@ -228,28 +274,28 @@ class FusionToptune:
                 summary_op = tf.summary.merge_all()
                 tf.get_default_graph().finalize()
 
-                for i in range(0, len(validation_data.files)):
-                    validation_data.batch_index[i] = 0
-                    validation_data.shuffle()
-                    train_data.batch_index[i] = 0
-                    train_data.shuffle()
+                validation_data.reset()
+                train_data.reset()
 
                 for step in range(1, num_steps):
                     print("Step:", step, "Total:", num_steps)
                     start_time = time.time()
-                    _, features_images, label_data = self.fuse_modalities(
-                        train_data)
+                    feed_dict = {keep_prob: self.param['keep_prob']}
+                    fetches = [summary_op, train_op, total_loss, xloss,
+                               l2loss]
+                    if dataset is None:
+                        _, features_images, label_data = \
+                            self.fuse_modalities(train_data)
+                        feed_dict.update({fusion_input: features_images,
+                                          labels: label_data})
+                    elif step % 50 == 0:
+                        # The batch of the pipeline for the batch accuracy
+                        fetches += [fusion_input, labels]
+                    outputs = sess.run(fetches, feed_dict=feed_dict)
                     summary_values, _, loss_value, cross_loss, l2_loss = \
-                        sess.run(
-                        [summary_op,
-                         train_op,
-                         total_loss, xloss, l2loss],
-                        feed_dict={
-                            fusion_input: features_images,
-                            labels: label_data,
-                            keep_prob: self.param['keep_prob']
-                        }
-                    )
+                        outputs[:5]
+                    if len(outputs) > 5:
+                        features_images, label_data = outputs[5:]
                     if step % num_batches_epoch == 0 or (step + 1) == num_steps / 2:
                         checkpoint_path = self.param['checkpoint_path'] + \
                                           'model.ckpt'
@@ -285,11 +331,8 @@ class FusionToptune:
                     # Saving Model Checkpoints for evaluation
                     if step % num_batches_epoch == 0 or (
                         step + 1) == num_steps:
-                        for i in range(0, len(validation_data.files)):
-                            validation_data.batch_index[i] = 0
-                            validation_data.shuffle()
-                            train_data.batch_index[i] = 0
-                            train_data.shuffle()
+                        validation_data.reset()
+                        train_data.reset()
 
                         # Evaluate against the training data.
                         print("Step: %d Training accuracy: %g " %
@@ -315,11 +358,8 @@ class FusionToptune:
                                                      loss=total_loss,
                                                      xloss=xloss,
                                                      l2loss=l2loss)))
-                        for i in range(0, len(validation_data.files)):
-                            validation_data.batch_index[i] = 0
-                            validation_data.shuffle()
-                            train_data.batch_index[i] = 0
-                            train_data.shuffle()
+                        validation_data.reset()
+                        train_data.reset()
                     sys.stdout.flush()
                 '''
                 if test == True:
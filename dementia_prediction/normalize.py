@@ -1,12 +1,12 @@
 from os import path
 import os
 import pickle
-import re
 import sys
 import nibabel as nb
-import math
 import numpy as np
 from pathos.multiprocessing import ProcessPool
+from dementia_prediction.voxel_statistics import VoxelStatistics
+from dementia_prediction.catalog import Catalog
 
 
 class Normalize():
@@ -15,8 +15,10 @@ class Normalize():
         self.IMG_SIZE = params['img_size']
         self.params = params
         self.mode = params['mode']
-        self.mean_path = params['norm_mean_var'] + self.mode + '_data_mean.pkl'
-        self.var_path = params['norm_mean_var'] + self.mode + '_data_var.pkl'
+        self.mean_path = params['norm_mean_var'] + self.mode + '_data_mean.npy'
+        self.var_path = params['norm_mean_var'] + self.mode + '_data_var.npy'
+        self.stats_path = params['norm_mean_var'] + self.mode + \
+                          '_data_stats.npz'
         self.mean_norm = []
         self.var_norm = []
         self.train_dict = train_dict
@@ -25,37 +27,55 @@ class Normalize():
     def get_files(self, dir, regex, split_on):
         train_patients = []
         valid_patients = []
-        for directory in os.walk(dir):
-            # Walk inside the directory
-            for file in directory[2]:
-                # Match all files ending with 'regex'
-                input_file = os.path.join(directory[0], file)
-                if re.search(regex, input_file):
-                    pat_code = input_file.rsplit(split_on)
-                    patient_code = pat_code[0].rsplit('/', 1)[1]
-                    if patient_code in self.train_dict:
-                        train_patients.append(input_file)
-                    elif patient_code in self.valid_dict:
-                        valid_patients.append(input_file)
+        for entry in Catalog(dir, self.params.get('catalog_dir')).entries(
+                regex, split_on):
+            if entry.patient_code in self.train_dict:
+                train_patients.append(entry.path)
+            elif entry.patient_code in self.valid_dict:
+                valid_patients.append(entry.path)
         return train_patients, valid_patients
 
-    def mean_fun(self, filenames):
-        mean = [0 for x in range(0, self.params['img_size'])]
-        for file in filenames:
-            image = nb.load(file).get_data().flatten()
-            for i in range(0, self.params['img_size']):
-                mean[i] += image[i]
-        return mean
-
-    def var_fun(self, filenames):
-        variance = [0 for i in range(0, self.params['img_size'])]
-        with open(self.mean_path, 'rb') as filep:
-            global_mean = pickle.load(filep)
+    def accumulate(self, filenames):
+        """
+        Accumulates the voxel-wise mean and variance of a split of the
+        training data, reading every image once.
+        Args:
+            filenames: list of training image paths
+
+        Returns: VoxelStatistics of the split
+
+        """
+        stats = VoxelStatistics(self.params['img_size'])
         for file in filenames:
-            image = nb.load(file).get_data().flatten()
-            for i in range(0, self.params['img_size']):
-                variance[i] += math.pow((image[i] - global_mean[i]), 2)
-        return variance
+            stats.update(nb.load(file).get_data(), file)
+        return stats
+
+    @staticmethod
+    def legacy_path(stats_path):
+        return stats_path.rsplit('.npy', 1)[0] + '.pkl'
+
+    def stats_exist(self, stats_path):
+        return os.path.exists(stats_path) or \
+               os.path.exists(self.legacy_path(stats_path))
+
+    def load_array(self, stats_path):
+        """
+        Loads a stored statistics array. Statistics pickled as python lists
+        by older versions are converted to float64 arrays.
+        """
+        if not os.path.exists(stats_path):
+            with open(self.legacy_path(stats_path), 'rb') as filep:
+                return np.asarray(pickle.load(filep), dtype=np.float64)
+        return np.load(stats_path)
+
+    def load_statistics(self):
+        """
+        Loads the stored dataset mean and standard deviation.
+
+        Returns: (global_mean, global_variance) as float64 arrays
+
+        """
+        return self.load_array(self.mean_path), self.load_array(self.var_path)
 
     def per_image(self, train_data):
         for filename in train_data:
@@ -75,6 +95,10 @@ class Normalize():
             nb.save(im, output)
 
     def store(self, data):
+        mean_norm = np.asarray(self.mean_norm, dtype=np.float64)
+        var_norm = np.asarray(self.var_norm, dtype=np.float64)
+        # Voxels without variance across the training data are set to 0
+        zero_var = var_norm == 0
         for filename in data:
             pat_code = filename.rsplit(self.params['split_on'])
             patient_code = pat_code[0].rsplit('/', 1)[1]
@@ -84,15 +108,12 @@ class Normalize():
             if not os.path.exists(output):
                 mri_image = nb.load(filename)
                 affine = mri_image.get_affine()
-                mri_image = mri_image.get_data().flatten()
-                norm_image = []
-                for x, y, z in zip(mri_image, self.mean_norm, self.var_norm):
-                    if z == 0:
-                        norm_image.append(0)
-                    else:
-                        norm_image.append((x - y) / (z + self.params['epsilon']))
-                mean = np.array(norm_image).mean()
-                std = np.array(norm_image).std()
+                mri_image = mri_image.get_data().ravel()
+                norm_image = (mri_image - mean_norm) / \
+                             (var_norm + self.params['epsilon'])
+                norm_image[zero_var] = 0
+                mean = norm_image.mean()
+                std = norm_image.std()
                 norm_image = (norm_image - mean) / (std + self.params['epsilon'])
                 reshaped_image = np.reshape(norm_image, [self.params['height'],
                                                     self.params['width'],
@@ -102,44 +123,52 @@ class Normalize():
                 nb.save(im, output)
 
     def normalize(self, train_data):
-        mean = [0 for i in range(0, self.params['img_size'])]
-        var = [0 for i in range(0, self.params['img_size'])]
-        num_parallel = 10 
-        split = int(len(train_data) / num_parallel)
-        pool = ProcessPool(num_parallel)
-        train_splits = []
-        for par in range(0, num_parallel - 1):
-            train_splits.append(train_data[par * split:(par + 1) * split])
-        train_splits.append(train_data[(num_parallel - 1) * split:])
-
-        if not os.path.exists(self.mean_path):
-            mean_arrays = pool.map(self.mean_fun, train_splits)
-            for i in range(0, self.params['img_size']):
-                for j in range(0, len(mean_arrays)):
-                    mean[i] += mean_arrays[j][i]
-            global_mean = [i / len(train_data) for i in mean]
-            with open(self.mean_path, 'wb') as filep:
-                pickle.dump(global_mean, filep)
+        """
+        Computes the voxel-wise mean and standard deviation of the training
+        data in a single pass. The accumulator state is saved next to the
+        statistics, so only images added to the training data since the last
+        run are read. Statistics of older versions without a saved state are
+        taken to cover the current training data and seed the accumulator.
+        Args:
+            train_data: list of training image paths
+
+        Returns: (global_mean, global_variance) as float64 arrays, where
+        global_variance holds the sample standard deviation of each voxel
+
+        """
+        if not os.path.exists(self.stats_path) and \
+                self.stats_exist(self.mean_path) and \
+                self.stats_exist(self.var_path):
+            print("Resuming from the statistics in", self.mean_path,
+                  flush=True)
+            global_mean, global_variance = self.load_statistics()
+            VoxelStatistics.from_std(global_mean, global_variance,
+                                     train_data).save(self.stats_path)
+        stats, new_files = VoxelStatistics.resume(self.stats_path,
+                                                  self.params['img_size'],
+                                                  train_data)
+        print("Accumulated:", stats.count, "New:", len(new_files), flush=True)
+        if len(new_files) > 0:
+            num_parallel = 10
+            split = int(len(new_files) / num_parallel)
+            pool = ProcessPool(num_parallel)
+            train_splits = []
+            for par in range(0, num_parallel - 1):
+                train_splits.append(new_files[par * split:(par + 1) * split])
+            train_splits.append(new_files[(num_parallel - 1) * split:])
+            for split_stats in pool.map(self.accumulate, train_splits):
+                stats.merge(split_stats)
+            stats.save(self.stats_path)
+        if len(new_files) > 0 or not self.stats_exist(self.mean_path) or \
+                not self.stats_exist(self.var_path):
+            np.save(self.mean_path, stats.mean)
+            np.save(self.var_path, stats.std())
             # If you want to view mean image
             '''
-            reshaped_image = np.reshape(global_mean, [91, 109, 91])
+            reshaped_image = np.reshape(stats.mean, [91, 109, 91])
             sample_affine = nb.load(train_data[0]).get_affine()
             im = nb.Nifti1Image(reshaped_image, affine=sample_affine)
             nb.save(im, './mean_image.nii.gz')
             '''
-        with open(self.mean_path, 'rb') as filep:
-            global_mean = pickle.load(filep)
-        if not os.path.exists(self.var_path):
-            var_arrays = pool.map(self.var_fun, train_splits)
-            for i in range(0, self.params['img_size']):
-                for j in range(0, len(var_arrays)):
-                    var[i] += var_arrays[j][i]
-            global_variance = [math.sqrt(x / (len(train_data) - 1)) for x in
-                               var]
-            with open(self.var_path, 'wb') as filep:
-                pickle.dump(global_variance, filep)
-        with open(self.var_path, 'rb') as filep:
-            global_variance = pickle.load(filep)
-
-        return global_mean, global_variance
 
+        return self.load_statistics()
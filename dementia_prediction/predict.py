@@ -0,0 +1,298 @@
+"""
+This module scores new scans with one or more trained models, which are
+restored once and kept open for all scans.
+
+The models are the 'mode' and 'meta' entries of the cnn parameters, lists as
+for the ensemble or the strings of a single model. Model <i> reads the scan
+of the same name in the folder 'mode_folder<i+1>' if the parameters set it,
+else the given scan. The scans are read in batches of 'eval_batch_size'
+(default 'batch_size') images in a pool of threads while the previous batch
+is scored, and the class probabilities of the averaged logits are written
+per subject as soon as its batch is done.
+
+Score a folder, a file list or the paths on stdin ('-') with
+    python -m dementia_prediction.predict params.yaml <folder|file.txt|->
+or keep the models open for HTTP requests with
+    python -m dementia_prediction.predict params.yaml --serve 8080
+    curl --data-binary @scans.txt http://localhost:8080/predict
+"""
+
+import os
+import re
+import sys
+import csv
+import json
+import argparse
+import threading
+import collections
+from multiprocessing.pool import ThreadPool
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+from dementia_prediction.config_wrapper import Config
+from dementia_prediction.feature_extractor import FeatureExtractor
+from dementia_prediction.feature_store import subject_key
+from dementia_prediction.volume_cache import VolumeCache, load_volume
+
+
+def softmax(logits):
+    """
+    Returns: the class probabilities of each row of logits
+    """
+    exp = np.exp(logits - np.max(logits, axis=1, keepdims=True))
+    return exp / np.sum(exp, axis=1, keepdims=True)
+
+
+def scan_files(source, regex=None):
+    """
+    Yields the scans of a folder (matching 'regex' if set), of a text file
+    with one path per line, or of the lines of stdin for '-'
+    """
+    if source == '-':
+        lines = sys.stdin
+    elif os.path.isdir(source):
+        for filename in sorted(os.listdir(source)):
+            if regex is None or re.search(regex, filename):
+                yield os.path.join(source, filename)
+        return
+    else:
+        lines = open(source)
+    for line in lines:
+        if line.strip():
+            yield line.strip()
+
+
+class Predictor:
+    """
+    Initialize this class with the parameters of the models, see the module
+    docstring, and the number of threads reading the scans.
+    """
+
+    def __init__(self, params, workers=2):
+        self.param = params['cnn']
+        modes = self.param['mode']
+        meta_paths = self.param['meta']
+        # The parameters of a single model set one 'mode' and 'meta'
+        if isinstance(modes, str):
+            modes = [modes]
+        if isinstance(meta_paths, str):
+            meta_paths = [meta_paths]
+        count = self.param.get('ensemble_count', len(modes))
+        self.modes = [modes[i] for i in range(0, count)]
+        self.folders = [params.get('mode_folder' + str(i + 1))
+                        for i in range(0, count)]
+        self.extractors = [FeatureExtractor(mode, meta_paths[i])
+                           for i, mode in enumerate(self.modes)]
+        self.cache = VolumeCache.from_params(self.param)
+        self.batch_size = self.param.get('eval_batch_size',
+                                         self.param['batch_size'])
+        self.pool = ThreadPool(workers)
+        self.queue_depth = workers
+        # Serializes the runs of the restored sessions
+        self.lock = threading.Lock()
+
+    def logits_path(self, mode):
+        return 'Train' + mode + '/' + mode + 'logits/' + mode + 'logits:0'
+
+    def load(self, batch_files):
+        """
+        Returns: (images of each model, error message of each scan or None),
+        the images of unreadable scans are zero
+        """
+        shape = [self.param['depth'], self.param['height'],
+                 self.param['width']]
+        images = [np.zeros([len(batch_files)] + shape + [1], np.float32)
+                  for _ in self.modes]
+        errors = [None] * len(batch_files)
+        for iterate, filename in enumerate(batch_files):
+            try:
+                for index, folder in enumerate(self.folders):
+                    mode_file = filename
+                    if folder is not None:
+                        mode_file = os.path.join(folder,
+                                                 os.path.basename(filename))
+                    images[index][iterate, :, :, :, 0] = np.reshape(
+                        load_volume(mode_file, self.cache), shape)
+            except Exception as error:
+                errors[iterate] = repr(error)
+        return images, errors
+
+    def score(self, batch_files, images, errors, count):
+        """
+        Returns: the result of each of the first 'count' scans, a dictionary
+        with the subject, file, predicted class and class probabilities or
+        the error
+        """
+        with self.lock:
+            logits = [extractor.run(image_data,
+                                    self.logits_path(extractor.mode))
+                      for extractor, image_data in zip(self.extractors,
+                                                       images)]
+        probabilities = softmax(np.average(logits, axis=0)[:count])
+        results = []
+        for filename, error, probability in zip(batch_files, errors,
+                                                probabilities):
+            result = {'subject': subject_key(filename), 'file': filename}
+            if error is None:
+                result['class'] = int(np.argmax(probability))
+                result['probabilities'] = probability.tolist()
+            else:
+                result['error'] = error
+            results.append(result)
+        return results
+
+    def batches(self, filenames):
+        """
+        Yields (batch_files, count) of full batches, the last one padded with
+        copies of its last scan since older graphs only accept 'batch_size'
+        images
+        """
+        batch_files = []
+        for filename in filenames:
+            batch_files.append(filename)
+            if len(batch_files) == self.batch_size:
+                yield batch_files, self.batch_size
+                batch_files = []
+        if batch_files:
+            count = len(batch_files)
+            yield batch_files + [batch_files[-1]] * (self.batch_size -
+                                                     count), count
+
+    def predict(self, filenames):
+        """
+        Yields the result of each scan, see score(), in the order of the
+        scans. Up to 'workers' batches are read ahead.
+        """
+        pending = collections.deque()
+        for batch_files, count in self.batches(filenames):
+            pending.append((batch_files, count,
+                            self.pool.apply_async(self.load, (batch_files,))))
+            if len(pending) > self.queue_depth:
+                for result in self.score_pending(pending):
+                    yield result
+        while pending:
+            for result in self.score_pending(pending):
+                yield result
+
+    def score_pending(self, pending):
+        batch_files, count, loading = pending.popleft()
+        images, errors = loading.get()
+        return self.score(batch_files, images, errors, count)
+
+    def close(self):
+        self.pool.terminate()
+        for extractor in self.extractors:
+            extractor.close()
+
+
+def write_results(results, filep, classes):
+    """
+    Writes the results as CSV rows of subject, class and probabilities,
+    flushed after every row
+    """
+    writer = csv.writer(filep)
+    writer.writerow(['subject', 'class'] +
+                    ['probability_' + str(i) for i in range(0, classes)] +
+                    ['error'])
+    for result in results:
+        if 'error' in result:
+            writer.writerow([result['subject'], ''] + [''] * classes +
+                            [result['error']])
+        else:
+            writer.writerow([result['subject'], result['class']] +
+                            result['probabilities'] + [''])
+        filep.flush()
+
+
+def serve(predictor, port, host='localhost'):
+    """
+    Answers POST /predict requests, whose body lists one scan path per line
+    or is a JSON list of paths, with the JSON list of their results. Other
+    bodies are answered with 400 and failed scorings with 500 and the
+    error.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def send(self, code, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self.send(200, {'models': predictor.modes})
+            else:
+                self.send(404, {'error': 'unknown path'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self.send(404, {'error': 'unknown path'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                if length < 0:
+                    raise ValueError(length)
+                body = self.rfile.read(length).decode()
+            except ValueError:
+                self.send(400, {'error': 'invalid Content-Length or body'})
+                return
+            try:
+                filenames = json.loads(body)
+            except ValueError:
+                filenames = [line.strip() for line in body.splitlines()
+                             if line.strip()]
+            if not isinstance(filenames, list) or \
+                    not all(isinstance(name, str) for name in filenames):
+                self.send(400, {'error': 'the body must list scan paths'})
+                return
+            try:
+                results = list(predictor.predict(filenames))
+            except Exception as error:
+                self.send(500, {'error': repr(error)})
+                return
+            self.send(200, results)
+
+    server = HTTPServer((host, port), Handler)
+    print("Serving", predictor.modes, "on", host, port, flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Score scans with trained models loaded once")
+    parser.add_argument("paramfile", type=str,
+                        help='Path to the parameter file of the models')
+    parser.add_argument("source", type=str, nargs='?', default='-',
+                        help='Folder, file list or - for stdin')
+    parser.add_argument("--output", type=str,
+                        help='CSV file of the results, stdout if not set')
+    parser.add_argument("--workers", type=int, default=2,
+                        help='Threads reading the scans')
+    parser.add_argument("--serve", type=int, metavar='PORT',
+                        help='Answer HTTP requests on this port')
+    parser.add_argument("--host", type=str, default='localhost')
+    args = parser.parse_args()
+    config = Config()
+    config.parse(os.path.abspath(args.paramfile))
+    params = config.config.get('parameters')
+    predictor = Predictor(params, args.workers)
+    try:
+        if args.serve:
+            serve(predictor, args.serve, args.host)
+        else:
+            output = open(args.output, 'w', newline='') if args.output \
+                else sys.stdout
+            regex = params.get('regex')
+            write_results(predictor.predict(scan_files(args.source, regex)),
+                          output, params['cnn']['classes'])
+            if args.output:
+                output.close()
+    finally:
+        predictor.close()
@@ -0,0 +1,128 @@
+"""
+This module contains a wrapper which reads the batches of an input class in
+the background while the model trains on the current batch.
+"""
+
+import random
+import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+# Input object of a worker process, set once by the pool initializer
+_worker_input = None
+
+
+def _init_worker(data_input):
+    global _worker_input
+    _worker_input = data_input
+
+
+def _load_batch(batch_files, batch_classes, seed):
+    return _worker_input.load_batch(batch_files, batch_classes,
+                                    random.Random(seed))
+
+
+class PrefetchDataInput:
+    """
+    Wraps an input object (DataInput, MultichannelDataInput, FusionDataInput
+    or DataInputPerceptron) and keeps up to 'queue_depth' batches loading in
+    a pool of 'num_workers' threads or processes.
+
+    The class-balanced batches are still selected one after another in the
+    calling thread with the generator of the wrapped input, and each batch
+    gets its own augmentation seed, so the sequence of batches only depends
+    on the 'seed' parameter and not on the scheduling of the workers.
+    Batches are returned in the order they were selected.
+    """
+
+    def __init__(self, data_input, num_workers=2, queue_depth=4,
+                 workers='thread'):
+        self.data_input = data_input
+        self.queue_depth = queue_depth
+        self.pending = collections.deque()
+        if workers == 'process':
+            self.pool = multiprocessing.Pool(num_workers,
+                                             initializer=_init_worker,
+                                             initargs=(data_input,))
+            self.load = _load_batch
+        else:
+            self.pool = ThreadPool(num_workers)
+            self.load = self.load_batch
+            # Reused batch arrays must outlive the queued batches
+            buffer = data_input.buffer
+            if 0 < buffer.num_buffers < queue_depth + 2:
+                buffer.num_buffers = queue_depth + 2
+
+    @classmethod
+    def from_params(cls, params, data_input):
+        """
+        Wraps the input object if the cnn parameters contain a 'prefetch'
+        section, e.g. {'workers': 4, 'queue_depth': 8, 'mode': 'process'}.
+
+        Returns: the wrapped or the unchanged input object
+        """
+        prefetch = params.get('prefetch')
+        if not prefetch:
+            return data_input
+        if not isinstance(prefetch, dict):
+            prefetch = {}
+        return cls(data_input, num_workers=prefetch.get('workers', 2),
+                   queue_depth=prefetch.get('queue_depth', 4),
+                   workers=prefetch.get('mode', 'thread'))
+
+    def __getattr__(self, name):
+        # files, batch_index, name etc. are read from the wrapped input
+        if name == 'data_input':
+            raise AttributeError(name)
+        return getattr(self.data_input, name)
+
+    def load_batch(self, batch_files, batch_classes, seed):
+        return self.data_input.load_batch(batch_files, batch_classes,
+                                          random.Random(seed))
+
+    def fill(self):
+        while len(self.pending) < self.queue_depth:
+            batch_files, batch_classes = self.data_input.select_batch()
+            seed = self.data_input.random.getrandbits(32)
+            self.pending.append(self.pool.apply_async(
+                self.load, (batch_files, batch_classes, seed)))
+
+    def discard(self):
+        """
+        Drops the queued batches, e.g. before the file order changes.
+        """
+        while self.pending:
+            self.pending.popleft().wait()
+
+    def next_batch(self):
+        """
+        Returns: the next batch as (batch_filenames, batch_images,
+        batch_labels) of the wrapped input
+        """
+        self.fill()
+        batch = self.pending.popleft().get()
+        self.fill()
+        return batch
+
+    def shuffle(self):
+        self.discard()
+        self.data_input.shuffle()
+
+    def reset(self):
+        """
+        Starts a new pass over the data, discarding the queued batches.
+        """
+        self.discard()
+        self.data_input.reset()
+
+    def close(self):
+        """
+        Shuts the pool down, the wrapped input can still be read directly.
+        Closing again does nothing.
+        """
+        if self.pool is None:
+            return
+        self.discard()
+        self.pool.terminate()
+        self.pool.join()
+        self.pool = None
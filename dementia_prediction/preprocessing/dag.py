@@ -0,0 +1,180 @@
+"""
+This module declares the preprocessing stages as a dependency graph and
+decides which outputs are up to date.
+
+A build record stores for every output file the command which wrote it and
+the md5 hashes of its input files. An output is written again when its
+command, i.e. a tool parameter, or the content of one of its inputs
+changed. Outputs of a stage are inputs of the following stages, so a
+changed bet threshold recomputes the extracted brains and then only the
+registered, smoothed and subsampled images which depend on them.
+"""
+
+import os
+import json
+import hashlib
+
+
+class BuildRecord:
+    """
+    Initialize this class with the path of the JSON record file, which is
+    created with the first recorded output.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Hashes of the files by path, with the size and modification time
+        # they were computed for
+        self.hashes = {}
+        self.outputs = {}
+        if os.path.exists(path):
+            with open(path) as filep:
+                record = json.load(filep)
+            self.hashes = record['hashes']
+            self.outputs = record['outputs']
+
+    def hash(self, filename):
+        """
+        Returns: the md5 of the file content, None if it does not exist. The
+        hash is only computed again when the size or modification time of
+        the file changed.
+        """
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        cached = self.hashes.get(filename)
+        if cached is not None and cached[:2] == [stat.st_size,
+                                                 stat.st_mtime]:
+            return cached[2]
+        md5 = hashlib.md5()
+        with open(filename, 'rb') as filep:
+            for block in iter(lambda: filep.read(1 << 20), b''):
+                md5.update(block)
+        self.hashes[filename] = [stat.st_size, stat.st_mtime,
+                                 md5.hexdigest()]
+        return md5.hexdigest()
+
+    def signature(self, inputs, command):
+        """
+        Returns: the command and the hashes of the inputs of an output
+        """
+        return {'command': command,
+                'inputs': {filename: self.hash(filename)
+                           for filename in inputs}}
+
+    def up_to_date(self, outputs, signature):
+        """
+        Returns: True if all outputs exist and were written by the same
+        command from the same inputs. Existing outputs without a record,
+        written before the record was used, are recorded as they are.
+        """
+        if not all(os.path.exists(output) for output in outputs):
+            return False
+        for output in outputs:
+            if output not in self.outputs:
+                self.outputs[output] = signature
+        return all(self.outputs[output] == signature for output in outputs)
+
+    def update(self, outputs, signature):
+        for output in outputs:
+            self.outputs[output] = signature
+
+    def save(self):
+        tmp_path = self.path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'w') as filep:
+            json.dump({'hashes': self.hashes, 'outputs': self.outputs}, filep)
+        os.replace(tmp_path, self.path)
+
+
+class PreprocessingGraph:
+    """
+    The stages of a preprocessing script and their dependencies. Each stage
+    is a DataPipeline method with its parameters, run after the stages it
+    depends on.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.order = []
+
+    def add(self, name, function, deps=None, **params):
+        """
+        Declares a stage.
+        Args:
+            name: unique name of the stage
+            function: DataPipeline method run by the stage
+            deps: names of the stages whose outputs are inputs of this stage
+            params: keyword arguments of the method
+        """
+        if name in self.stages:
+            raise ValueError("Stage " + name + " is declared twice")
+        for dep in deps or []:
+            if dep not in self.stages:
+                raise ValueError("Stage " + name + " depends on unknown "
+                                 "stage " + dep)
+        self.stages[name] = {'function': function, 'deps': list(deps or []),
+                             'params': params}
+        # Dependencies are declared first, so the declaration order is a
+        # topological order
+        self.order.append(name)
+
+    def upstream(self, names):
+        """
+        Returns: the given stages and all stages they depend on
+        """
+        selected = set()
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            if name not in selected:
+                selected.add(name)
+                stack.extend(self.stages[name]['deps'])
+        return selected
+
+    def downstream(self, names):
+        """
+        Returns: the given stages and all stages depending on them
+        """
+        selected = set(names)
+        for name in self.order:
+            if any(dep in selected for dep in self.stages[name]['deps']):
+                selected.add(name)
+        return selected
+
+    def run(self, targets=None, start=None):
+        """
+        Runs the stages in dependency order. The up-to-date outputs of a
+        stage are skipped by the stage itself.
+        Args:
+            targets: names of the stages to build with the stages they
+                     depend on, all stages if None
+            start: names of stages to run with all stages depending on
+                   them, ignoring the stages before
+
+        Returns: True if all stages succeeded
+        """
+        for name in (targets or []) + (start or []):
+            if name not in self.stages:
+                raise ValueError("Unknown stage " + name)
+        selected = set(self.order)
+        if targets:
+            selected &= self.upstream(targets)
+        if start:
+            selected &= self.downstream(start)
+        failed = set()
+        for name in self.order:
+            if name not in selected:
+                continue
+            stage = self.stages[name]
+            # The outputs of a failed stage are incomplete inputs
+            if any(dep in failed for dep in stage['deps']):
+                print("Skipping stage", name, "after failed dependencies",
+                      flush=True)
+                failed.add(name)
+                continue
+            print("Stage:", name, flush=True)
+            if stage['function'](**stage['params']) is False:
+                print("Stage", name, "failed", flush=True)
+                failed.add(name)
+        return not failed
@@ -13,12 +13,20 @@ References:
 
 import os
 import re
-import subprocess
 import random
 import nibabel as nb
-import pickle
 from scipy.ndimage.interpolation import shift
 import sys
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+from dementia_prediction.catalog import Catalog
+from dementia_prediction.manifest import load_patients
+from dementia_prediction.augmentation_manifest import AugmentationManifest, \
+    rotation, translation, compose
+from dementia_prediction.preprocessing.scheduler import JobScheduler, \
+    in_process
+from dementia_prediction.preprocessing import native
 
 
 class DataPipeline:
@@ -46,9 +54,31 @@ class DataPipeline:
         """
         self.params = params
         self.input_folder = in_folder
+        # Runs the FSL commands of the stages, in parallel with a
+        # 'scheduler' section in the parameters
+        self.scheduler = JobScheduler.from_params(params)
+        # Runs the other commands, with the FSL stand-in of the 'executor'
+        # in the 'scheduler' section as well
+        self.executor = self.scheduler.executor
+        # Smoothing, subsampling, template averaging, tensor fitting and ASL
+        # subtraction with NumPy in place of fslmaths, dtifit and asl_file
+        self.native = (params or {}).get('native', 'False') == 'True'
+        # With an 'augmentation_manifest', rot_trans, rotate and translate
+        # record the transforms of the augmented images instead of writing
+        # them
+        self.augmented = AugmentationManifest.from_params(params)
+
+    def walk(self, folder):
+        """
+        Lists the folder tree from its catalog index instead of os.walk, only
+        the folders changed since the last stage are listed again.
+
+        Returns: (dirpath, dirnames, filenames) tuples as os.walk
+        """
+        return Catalog(folder, self.params.get('catalog_dir')).walk()
 
     def eddy_correction(self):
-        for directory in os.walk(self.input_folder):
+        for directory in self.walk(self.input_folder):
             # Walk inside the directory
             for file in directory[2]:
                 # Match all files ending with "-DTI.nii.gz"
@@ -58,16 +88,16 @@ class DataPipeline:
                     output_file = '{0}_eddy_corrected.nii.gz'. \
                         format(input_file.split('.nii.gz')[0])
 
-                    if not os.path.exists(output_file):
+                    if self.scheduler.submit(
+                            'eddy_correct {0} {1} 0 trilinear -v'
+                            .format(input_file, output_file), [output_file],
+                            input_file,
+                            'Generated eddy corrected: ' + output_file,
+                            [input_file]):
                         print("Eddy correcting DTI..: " + input_file)
-                        subprocess.call('eddy_correct {0} {1} 0 trilinear -v'
-                                        .format(input_file,
-                                                output_file),
-                                        shell=True)
-                        print('Generated eddy corrected: ' + output_file)
                     else:
                         print("File already exists: " + output_file)
-        return True
+        return self.scheduler.run('eddy_correction')
 
 
     def brain_extraction(self, regex, split_on, bias, dict=0, dict_path='./'):
@@ -75,11 +105,16 @@ class DataPipeline:
          This function extracts the brain from the raw T1 weighted MR Images
          using bet tool of FSL 5.0.
          It might take 5-6 minutes for an image of ~7MB.
-         Run this function parallelly with different file paths to get
-         optimal performance.
+         The images are extracted in parallel with the 'workers' of the
+         'scheduler' parameters.
         """
         ctr = 0
-        for directory in os.walk(self.input_folder):
+        if dict == 1:
+            # The dictionary is read once, from the pickle file or from the
+            # class labels of the 'dataset' of the pipeline's 'manifest'
+            pat_dict = load_patients(
+                {**(self.params or {}), 'dict_path': dict_path}, 'dict_path')
+        for directory in self.walk(self.input_folder):
             # Walk inside the directory
             for file in directory[2]:
                 input_file = os.path.join(directory[0], file)
@@ -90,8 +125,6 @@ class DataPipeline:
                     extract = 1
                     if dict == 1:
                         # This code is specific to ADNI file path
-                        fp = open(dict_path, 'rb')
-                        pat_dict = pickle.load(fp)
                         patient = input_file.rsplit('/',1)[1]
                         pat_list = patient.split('_')[1:4]
                         patient_code = '_'.join(pat_list)
@@ -103,27 +136,31 @@ class DataPipeline:
                         output_file = '{0}_brain.nii.gz'. \
                             format(input_file.split(split_on)[0])
 
-                        if not os.path.exists(output_file):
-
+                        cmd = 'bet {0} {1} -B -f {2} -m -v'.format(
+                                        input_file, output_file,
+                                        self.params['bet']["frac_intens_thres"])
+                        if bias is False:
+                            cmd = 'bet {0} {1} -f {2} -m -v'.format(
+                                input_file, output_file,
+                                self.params['bet']["frac_intens_thres"])
+                        if self.scheduler.submit(
+                                cmd, [output_file], input_file,
+                                'Generated extracted brain: ' + output_file,
+                                [input_file]):
                             print("Extracting brain from file: " + input_file)
-
-                            cmd = 'bet {0} {1} -B -f {2} -m -v'.format(
-                                            input_file, output_file,
-                                            self.params['bet']["frac_intens_thres"])
-                            if bias is False:
-                                cmd = 'bet {0} {1} -f {2} -m -v'.format(
-                                    input_file, output_file,
-                                    self.params['bet']["frac_intens_thres"])
-                            subprocess.call(cmd, shell=True)
-                            print('Generated extracted brain: ' + output_file)
                             ctr += 1
                         else:
                             print("File already exists: " + output_file)
         print(ctr)
-        return True
+        return self.scheduler.run('brain_extraction')
 
     def ASL_preprocess(self):
-        for directory in os.walk(self.input_folder):
+        # The native subtraction runs in a pool of processes, each holding
+        # one series at a time
+        pool = None
+        if self.native:
+            pool = ProcessPoolExecutor(max_workers=self.scheduler.workers)
+        for directory in self.walk(self.input_folder):
             # Walk inside the directory
             for file in directory[2]:
                 # Match all files ending with "-T1.nii.gz"
@@ -138,22 +175,30 @@ class DataPipeline:
                     output_diff_mean = '{0}_single_diff_mean.nii.gz'. \
                         format(input_file.split('.nii.gz')[0])
 
-                    if not os.path.exists(output_diff):
+                    command = 'asl_file --data={0} --ntis=1 --iaf=tc ' \
+                              '--diff --out={1} --mean={2}' \
+                        .format(input_file, output_diff, output_diff_mean)
+                    function = None
+                    if pool is not None:
+                        command = 'native_' + command
+                        function = functools.partial(
+                            in_process, pool, native.asl_subtraction,
+                            input_file, output_diff, output_diff_mean)
+                    if self.scheduler.submit(
+                            command, [output_diff, output_diff_mean],
+                            input_file,
+                            'Generated diff and diff mean: ' + output_diff,
+                            [input_file], function):
                         print("Extracting diff mean from file: " + input_file)
-                        subprocess.call('asl_file --data={0} --ntis=1 --iaf=tc '
-                                        '--diff --out={1} '
-                                        '--mean={2}'
-                                        .format(input_file,
-                                                output_diff,
-                                                output_diff_mean),
-                                        shell=True)
-                        print('Generated diff and diff mean: ' + output_diff)
                     else:
                         print("File already exists: " + output_diff)
-        return True
+        success = self.scheduler.run('ASL_preprocess')
+        if pool is not None:
+            pool.shutdown()
+        return success
 
     def calculate_tensor(self, out_folder):
-        for directory in os.walk(self.input_folder):
+        for directory in self.walk(self.input_folder):
             # Walk inside the directory
             for file in directory[2]:
                 # Match all files ending with "-DT1.nii.gz"
@@ -178,19 +223,26 @@ class DataPipeline:
                                 format(input_file_base)
                     grad_dir = '{0}.bvec'.format(input_file_base)
                     grad_val = '{0}.bval'.format(input_file_base)
-                    #if not os.path.exists(output_file_base+'_FA.nii.gz'):
-                    subprocess.call('dtifit -k {0} -o {1} -m {2} -r {3} -b {4}'
-                                    .format(input_file,
-                                            output_file_base,
-                                            brain_mask,
-                                            grad_dir,
-                                            grad_val),
-                                            shell=True)
-                    print("Generated S0, FA, MD, L1 - L3, V1 - V3 for "
-                          + output_file_base)
-                    #else:
-                    #   print(output_file_base+' vectors already exist')
-        return True
+                    # dtifit runs again only for new, interrupted or
+                    # outdated outputs
+                    output_fa = output_file_base + '_FA.nii.gz'
+                    command = 'dtifit -k {0} -o {1} -m {2} -r {3} -b {4}' \
+                        .format(input_file, output_file_base, brain_mask,
+                                grad_dir, grad_val)
+                    function = None
+                    if self.native:
+                        command = 'native_' + command
+                        function = functools.partial(
+                            native.tensor_fitting, input_file,
+                            output_file_base, brain_mask, grad_dir, grad_val)
+                    if not self.scheduler.submit(
+                            command, [output_fa], input_file,
+                            "Generated S0, FA, MD, L1 - L3, V1 - V3 for "
+                            + output_file_base,
+                            [input_file, brain_mask, grad_dir, grad_val],
+                            function):
+                        print(output_file_base+' vectors already exist')
+        return self.scheduler.run('calculate_tensor')
 
     def DTI_registration(self, regex, ref_path, suffix, in_folder, out_folder):
         """
@@ -216,7 +268,7 @@ class DataPipeline:
         if ref_path == 'T1':
             ref_flag = 0
 
-        for directory in os.walk(in_folder):
+        for directory in self.walk(in_folder):
             # Walk inside the directory
             for file in directory[2]:
                 # Match all files ending with 'regex'
@@ -229,32 +281,29 @@ class DataPipeline:
                     if ref_flag == 0:
                         ref_path = input_file.split('-DTI_MD.nii.gz')[0]
                         ref_path += '-T1_brain.nii.gz'
-                    if not os.path.exists(output_file):
+                    # Linear registration of brain with the template
+                    if self.scheduler.submit(
+                            'flirt -in {0} -ref {1} -out {2} -cost {3} '
+                            '-searchcost {4} -v'
+                            .format(input_file, ref_path, output_file,
+                                    self.params['registration']['cost'],
+                                    self.params['registration']['searchcost']),
+                            [output_file], input_file,
+                            'Generated aligned file: ' + output_file,
+                            [input_file, ref_path]):
                         print("Aligning " + input_file +
                               "\n with " + ref_path)
-                        # Linear registration of brain with the template
-                        subprocess.call('flirt -in {0} -ref {1} -out {2} '
-                                        '-cost {3} -searchcost {4} -v'
-                                        .format(input_file,
-                                                ref_path,
-                                                output_file,
-                                                self.params['registration']['cost'],
-                                                self.params['registration'][
-                                                    'searchcost']),
-                                        shell=True)
-                        print('Generated aligned file: ' +
-                                         output_file)
                     else:
                         print("File Already exists: " + output_file)
                     sys.stdout.flush()
-        return True
+        return self.scheduler.run('DTI_registration')
     def average_template(self, regex, in_folder, out_folder, avg_filename):
 
         # Prepare the command for generating the average template
         avg_template = out_folder + avg_filename
         output_files = []
         ctr = 0
-        for directory in os.walk(in_folder):
+        for directory in self.walk(in_folder):
             # Walk inside the directory
             for file in directory[2]:
                 # Match all files ending with 'regex'
@@ -265,15 +314,33 @@ class DataPipeline:
                     output_files.append(input_file)
                     ctr += 1
         #print(ctr, len(output_files))
-        if not os.path.exists(avg_template):
+        # The template is averaged again when an image changed
+        self.submit_average(output_files, avg_template)
+        return self.scheduler.run('average_template')
+
+    def submit_average(self, input_files, avg_template):
+        """
+        Queues the average of the images as a job of the scheduler, computed
+        by fslmaths or with 'native' by native.average.
+        """
+        function = None
+        if self.native:
+            # A running sum over the images, which are inputs of the job
+            # and not on a command line
+            command = 'native_average {0} {1}'.format(len(input_files),
+                                                      avg_template)
+            function = functools.partial(native.average, input_files,
+                                         avg_template,
+                                         self.scheduler.workers)
+        else:
             command = 'fslmaths '
-            command += ' -add '.join(output_files)
-            command += ' -div ' + str(len(output_files)) + \
+            command += ' -add '.join(input_files)
+            command += ' -div ' + str(len(input_files)) + \
                        ' ' + avg_template
-            print("Number of Images: " + str(len(output_files)))
-            subprocess.call(command, shell=True)
-            print("Study specific average template: " + avg_template)
-        return True
+        if self.scheduler.submit(command, [avg_template], avg_template,
+                                 "Study specific average template: " +
+                                 avg_template, input_files, function):
+            print("Number of Images: " + str(len(input_files)))
 
     def linear_registration(self, ref_path, iteration):
         """
@@ -308,7 +375,7 @@ class DataPipeline:
         if iteration == 0:
             reference = "avg_template"
             #reference = "mni"
-        for directory in os.walk(self.input_folder):
+        for directory in self.walk(self.input_folder):
             # Walk inside the directory
             for file in directory[2]:
                 # Match all files ending with 'regex'
@@ -319,25 +386,25 @@ class DataPipeline:
                         format(input_file.split(split_on)[0], reference)
                     output_matrix = '{0}_{1}_aligned_matrix.mat'. \
                         format(input_file.split(split_on)[0], reference)
-                    if not os.path.exists(output_file):
+                    # Linear registration of brain with the template
+                    if self.scheduler.submit(
+                            'flirt -in {0} -ref {1} -out {2} -omat {3} '
+                            '-cost {4} -searchcost {5} -v'
+                            .format(input_file, ref_path, output_file,
+                                    output_matrix,
+                                    self.params['registration']['cost'],
+                                    self.params['registration']['searchcost']),
+                            [output_file, output_matrix], input_file,
+                            'Generated aligned file: ' + output_file,
+                            [input_file, ref_path]):
                         print("Aligning " + input_file +
                               "\n with " + ref_path)
-                        # Linear registration of brain with the template
-                        subprocess.call('flirt -in {0} -ref {1} -out {2} '
-                                        '-omat {3} -cost {4} -searchcost {5} -v'
-                                        .format(input_file,
-                                                ref_path,
-                                                output_file,
-                                                output_matrix,
-                                                self.params['registration']['cost'],
-                                                self.params['registration'][
-                                                    'searchcost']),
-                                        shell=True)
-                        print('Generated aligned file: ' +
-                                         output_file)
-                        output_files.append(output_file)
                     else:
                         print("File Already exists: " + output_file)
+                    output_files.append(output_file)
+        # The average template needs all aligned images
+        if not self.scheduler.run('linear_registration'):
+            return False
         # If this is not the last iteration
         if iteration >= 1:
             # Prepare the command for generating the average template
@@ -345,13 +412,9 @@ class DataPipeline:
             avg_template += '/T1_avg_study_template.nii.gz'
 
             if not os.path.exists(avg_template):
-                command = 'fslmaths '
-                command += ' -add '.join(output_files)
-                command += ' -div ' + str(len(output_files)) + \
-                           ' ' + avg_template
-                print("Number of Images: " + str(len(output_files)))
-                subprocess.call(command, shell=True)
-                print("Study specific average template: " + avg_template)
+                self.submit_average(output_files, avg_template)
+                if not self.scheduler.run('average_template'):
+                    return False
 
                 # Re-register all MR Images on the average template
                 #if self.linear_registration(avg_template, iteration - 1):
@@ -360,9 +423,9 @@ class DataPipeline:
 
     def move(self, regex, out):
         ctr = 0
-        subprocess.call('mkdir {0}'
-                        .format(out), shell=True)
-        for directory in os.walk(self.input_folder):
+        self.executor.call('mkdir {0}'
+                          .format(out))
+        for directory in self.walk(self.input_folder):
             # Walk inside the directory
             for file in directory[2]:
                 # Match all files ending with 'regex'
@@ -377,9 +440,8 @@ class DataPipeline:
                     print("Creating folder "+folder)
                     """
                     output_file = out+'/'+str(input_file.rsplit('/',1)[1])
-                    subprocess.call("cp {0} {1}".format(input_file,
-                                                        output_file),
-                                    shell=True)
+                    self.executor.call("cp {0} {1}".format(input_file,
+                                                          output_file))
                     print("File No:" +str(ctr+1)+" Generated "+output_file)
                     ctr += 1
 
@@ -393,7 +455,7 @@ class DataPipeline:
         counter = 0
 
 
-        for directory in os.walk(in_folder):
+        for directory in self.walk(in_folder):
             # Walk inside the directory
             for file in directory[2]:
                 # Match all files ending with 'regex'
@@ -404,18 +466,24 @@ class DataPipeline:
                     output_path = output_file.split(split_on)[0]
                     output_file = output_path + '_smoothed.nii.gz'
 
-                    if not os.path.exists(output_file):
+                    sigma = self.params['registration']['gauss_smooth_sigma']
+                    command = 'fslmaths {0} -s {1} {2}'.format(
+                        input_file, sigma, output_file)
+                    function = None
+                    if self.native:
+                        command = 'native_' + command
+                        function = functools.partial(
+                            native.gaussian_smoothing, input_file,
+                            output_file, sigma)
+                    if self.scheduler.submit(
+                            command, [output_file], input_file,
+                            'File No.: ' + str(counter + 1) +
+                            ' Generated output: ' + output_file,
+                            [input_file], function):
                         print("Smoothing image: " + input_file)
-                        subprocess.call('fslmaths {0} -s {1} {2}'
-                                        .format(input_file,
-                                                self.params['registration'][
-                                                    'gauss_smooth_sigma'],
-                                                output_file),
-                                        shell=True)
                         counter += 1
-                        print('File No.: ' + str(counter) +
-                              ' Generated output: ' + output_file)
                 sys.stdout.flush()
+        return self.scheduler.run('gaussian_smoothing')
 
     def subsample(self, regex, split_on, in_folder, out_folder):
         """
@@ -425,7 +493,7 @@ class DataPipeline:
 
         counter = 0
 
-        for directory in os.walk(in_folder):
+        for directory in self.walk(in_folder):
             # Walk inside the directory
             for file in directory[2]:
                 # Match all files ending with 'regex'
@@ -436,20 +504,26 @@ class DataPipeline:
                     output_path = output_file.split(split_on)[0]
                     output_file = output_path + '_subsampled.nii.gz'
 
-                    if not os.path.exists(output_file):
+                    command = 'fslmaths {0} -subsamp2 {1}'.format(
+                        input_file, output_file)
+                    function = None
+                    if self.native:
+                        command = 'native_' + command
+                        function = functools.partial(
+                            native.subsample, input_file, output_file)
+                    if self.scheduler.submit(
+                            command, [output_file], input_file,
+                            'File No.: ' + str(counter + 1) +
+                            ' Generated output: ' + output_file,
+                            [input_file], function):
                         print("Subsampling image: " + input_file)
-                        subprocess.call('fslmaths {0} -subsamp2 {1}'
-                                        .format(input_file,
-                                                output_file),
-                                        shell=True)
                         counter += 1
-                        print('File No.: ' + str(counter) +
-                              ' Generated output: ' + output_file)
                 sys.stdout.flush()
+        return self.scheduler.run('subsample')
 
     def rot_trans(self, regex, split_on, in_folder, out_folder):
         counter = 0
-        for directory in os.walk(in_folder):
+        for directory in self.walk(in_folder):
             # Walk inside the directory
             for file in directory[2]:
                 # Match all files ending with 'regex'
@@ -473,21 +547,37 @@ class DataPipeline:
                         rot_matrix = 'rot3_{0}.mat'.format(direction)
                         angle_rot = 3 if random.uniform(0, 1) > 0.5 \
                             else -3
+                        if self.augmented is not None:
+                            shift_axis = [3 * x_axis, 3 * y_axis, 3 * z_axis]
+                            rotated = rotation(direction, angle_rot)
+                            # Recorded images keep their angle, as translate
+                            # keeps its entries
+                            for suffix, transform in [
+                                    ('_sub_rot3_', rotated),
+                                    ('_sub_trans3_', translation(shift_axis)),
+                                    ('_sub_rot3_trans3_', compose(
+                                        rotated, translation(shift_axis)))]:
+                                name = output_path + suffix + direction + \
+                                    '.nii.gz'
+                                if os.path.basename(name) not in \
+                                        self.augmented.entries:
+                                    self.augmented.add(name, input_file,
+                                                       transform)
+                                    counter += 1
+                            continue
                         print("Rotating image: " + input_file)
-                        subprocess.call('makerot -c {0},{1},{2} -a {3},{4},'
-                                            '{5} -t {6} -o {7}'
-                                            .format(self.params['dim']['x']/2,
-                                                    self.params['dim']['y']/2,
-                                                    self.params['dim']['z']/2,
-                                                    x_axis, y_axis, z_axis,
-                                                    angle_rot, rot_matrix),
-                                            shell=True)
-                        subprocess.call('flirt -in {0} -ref {1} -out '
-                                        '{2} -applyxfm -init {3}'
-                                        .format(input_file, input_file,
-                                                output_file,
-                                                rot_matrix),
-                                        shell=True)
+                        self.executor.call('makerot -c {0},{1},{2} -a {3},{4},'
+                                              '{5} -t {6} -o {7}'
+                                              .format(self.params['dim']['x']/2,
+                                                      self.params['dim']['y']/2,
+                                                      self.params['dim']['z']/2,
+                                                      x_axis, y_axis, z_axis,
+                                                      angle_rot, rot_matrix))
+                        self.executor.call('flirt -in {0} -ref {1} -out '
+                                          '{2} -applyxfm -init {3}'
+                                          .format(input_file, input_file,
+                                                  output_file,
+                                                  rot_matrix))
                         print("Generated image: "+output_file)
 
                         # Translating input image
@@ -541,6 +631,11 @@ class DataPipeline:
                         counter += 1
                         print('File No.: ' + str(counter) +
                               ' Generated output: ' + output_file)
+        if self.augmented is not None:
+            self.augmented.save()
+            print("Recorded", counter, "augmented images in",
+                  self.augmented.path)
+        return True
 
     def translate(self, regex, split_on, in_folder, out_folder, pixels,
                   patient_list=[]):
@@ -550,7 +645,7 @@ class DataPipeline:
         patient_flag = True
         if len(patient_list) == 0:
             patient_flag = False
-        for directory in os.walk(in_folder):
+        for directory in self.walk(in_folder):
             # Walk inside the directory
             for file in directory[2]:
                 # Match all files ending with 'regex'
@@ -561,18 +656,19 @@ class DataPipeline:
                     if patient_flag == False or patient_code in patient_list:
                         output = out_folder + patient_code + \
                                  '_trans'+split_on
-                        if not os.path.exists(output):
+                        if self.augmented is not None:
+                            if os.path.basename(output) not in \
+                                    self.augmented.entries:
+                                self.augmented.add(output, input_file,
+                                                   translation(
+                                                       self.shift_axis(
+                                                           pixels)))
+                                counter += 1
+                        elif not os.path.exists(output):
                             mri_image = nb.load(input_file)
                             aff = mri_image.get_affine()
                             mri_image = mri_image.get_data()
-                            direction = random.randint(1, 3)
-                            shift_axis = [pixels, 0, 0]
-                            if direction == 1:
-                                shift_axis = [pixels, 0, 0]
-                            elif direction == 2:
-                                shift_axis = [pixels, 4, 0]
-                            else:
-                                shift_axis = [0, 0, pixels]
+                            shift_axis = self.shift_axis(pixels)
                             translated_image = shift(mri_image, shift_axis,
                                                      mode='nearest')
                             im = nb.Nifti1Image(translated_image, affine=aff)
@@ -580,6 +676,26 @@ class DataPipeline:
                             print("Saving to " + output)
                         else:
                             print("Exists" + output)
+        if self.augmented is not None:
+            self.augmented.save()
+            print("Recorded", counter, "augmented images in",
+                  self.augmented.path)
+        return True
+
+    @staticmethod
+    def shift_axis(pixels):
+        """
+        Returns: the shift of translate() along a random axis
+        """
+        direction = random.randint(1, 3)
+        shift_axis = [pixels, 0, 0]
+        if direction == 1:
+            shift_axis = [pixels, 0, 0]
+        elif direction == 2:
+            shift_axis = [pixels, 4, 0]
+        else:
+            shift_axis = [0, 0, pixels]
+        return shift_axis
 
     def rotate(self, regex, split_on, in_folder, out_folder, angle,
                patient_list=[]):
@@ -594,7 +710,7 @@ class DataPipeline:
         patient_flag = True
         if len(patient_list) == 0:
             patient_flag = False
-        for directory in os.walk(in_folder):
+        for directory in self.walk(in_folder):
             # Walk inside the directory
             for file in directory[2]:
                 # Match all files ending with 'regex'
@@ -617,24 +733,34 @@ class DataPipeline:
                                                                 split_on)
                             rot_matrix = 'rot_{0}.mat'.format(direction)
                             angle_rot = random.uniform(-angle, angle)
+                            if self.augmented is not None:
+                                if os.path.basename(output_file) not in \
+                                        self.augmented.entries:
+                                    self.augmented.add(output_file,
+                                                       input_file,
+                                                       rotation(direction,
+                                                                angle_rot))
+                                    counter += 1
+                                continue
                             print("Rotating image: " + input_file)
-                            subprocess.call('makerot -c {0},{1},{2} -a {3},'
-                                            '{4},'
-                                            '{5} -t {6} -o {7}'
-                                            .format(self.params['dim']['x']/2,
-                                                    self.params['dim']['y']/2,
-                                                    self.params['dim']['z']/2,
-                                                    x_axis, y_axis, z_axis,
-                                                    angle_rot, rot_matrix),
-                                            shell=True)
-                            subprocess.call('flirt -in {0} -ref {1} -out '
-                                            '{2} -applyxfm -init {3}'
-                                            .format(input_file, input_file,
-                                                    output_file,
-                                                    rot_matrix),
-                                            shell=True)
+                            self.executor.call('makerot -c {0},{1},{2} -a {3},'
+                                              '{4},'
+                                              '{5} -t {6} -o {7}'
+                                              .format(self.params['dim']['x']/2,
+                                                      self.params['dim']['y']/2,
+                                                      self.params['dim']['z']/2,
+                                                      x_axis, y_axis, z_axis,
+                                                      angle_rot, rot_matrix))
+                            self.executor.call('flirt -in {0} -ref {1} -out '
+                                              '{2} -applyxfm -init {3}'
+                                              .format(input_file, input_file,
+                                                      output_file,
+                                                      rot_matrix))
                             counter += 1
                             print('File No.: ' + str(counter) +
                                   ' Generated output: ' + output_file)
-
+        if self.augmented is not None:
+            self.augmented.save()
+            print("Recorded", counter, "augmented images in",
+                  self.augmented.path)
         return True
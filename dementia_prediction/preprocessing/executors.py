@@ -0,0 +1,308 @@
+"""
+This module contains the executors which run the commands of the
+preprocessing stages.
+
+The ShellExecutor runs each command in a shell. The SimulatedExecutor is a
+stand-in for FSL: it writes the outputs of bet, flirt, fslmaths, dtifit,
+eddy_correct, asl_file and makerot with NumPy, e.g. masking, resampling or
+copying the input, and takes as long as a cost model of each tool. With it
+the throughput, parallel scaling and incremental rebuilds of the pipeline can
+be measured on synthetic images, on machines without FSL.
+"""
+
+import os
+import time
+import shlex
+import random
+import signal
+import shutil
+import resource
+import threading
+import subprocess
+import numpy as np
+import nibabel as nb
+import scipy.ndimage as snd
+
+from dementia_prediction.preprocessing import native
+
+# Seconds per command of each tool, a fixed part and a part per MB of input
+# files, roughly as measured for the 1.5 T T1 and DTI images
+DEFAULT_COSTS = {'bet': {'base': 20, 'per_mb': 40},
+                 'flirt': {'base': 10, 'per_mb': 8},
+                 'fslmaths': {'base': 1, 'per_mb': 0.5},
+                 'dtifit': {'base': 5, 'per_mb': 3},
+                 'eddy_correct': {'base': 30, 'per_mb': 10},
+                 'asl_file': {'base': 1, 'per_mb': 0.2},
+                 'makerot': {'base': 0.1, 'per_mb': 0},
+                 'cp': {'base': 0, 'per_mb': 0.01},
+                 'mkdir': {'base': 0, 'per_mb': 0}}
+
+
+def make_executor(spec=None, timeout=None):
+    """
+    Returns: the executor of the 'executor' section of the scheduler spec,
+    e.g. {'type': 'simulated', 'scale': 0.01}, a ShellExecutor if it is not
+    set
+    """
+    spec = dict(spec or {})
+    kind = spec.pop('type', 'shell')
+    if kind == 'shell':
+        return ShellExecutor(timeout)
+    if kind == 'simulated':
+        return SimulatedExecutor(timeout=timeout, **spec)
+    raise ValueError("Unknown executor " + str(kind))
+
+
+class ShellExecutor:
+    """
+    Runs the commands in a shell, each in its own process group which is
+    killed after 'timeout' seconds.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+
+    def run(self, command):
+        """
+        Returns: (return code, CPU seconds, peak resident memory in MB) of
+        the command and its children, the return code is None on timeout
+        """
+        process = subprocess.Popen(command, shell=True,
+                                   start_new_session=True)
+        # The command is reaped with wait4, which returns the resources used
+        # by it and its children
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        while True:
+            pid, status, usage = os.wait4(
+                process.pid, 0 if deadline is None else os.WNOHANG)
+            if pid != 0:
+                break
+            if time.time() > deadline:
+                os.killpg(process.pid, signal.SIGKILL)
+                pid, status, usage = os.wait4(process.pid, 0)
+                status = None
+                break
+            time.sleep(0.05)
+        if status is None:
+            returncode = None
+        elif os.WIFEXITED(status):
+            returncode = os.WEXITSTATUS(status)
+        else:
+            returncode = -os.WTERMSIG(status)
+        process.returncode = returncode
+        return returncode, usage.ru_utime + usage.ru_stime, \
+            usage.ru_maxrss / 1024
+
+    def call(self, command):
+        """
+        Returns: the return code of the command, as subprocess.call
+        """
+        return self.run(command)[0]
+
+
+class SimulatedExecutor(ShellExecutor):
+    """
+    Initialize this class with the cost model of the simulated tools:
+        costs: dictionary of tool name and {'base': <seconds>, 'per_mb':
+               <seconds>}, updating DEFAULT_COSTS
+        scale: factor of all costs, e.g. 0.001 to simulate a cohort in
+               seconds (default 1)
+        jitter: standard deviation of the log-normal noise of the costs
+                (default 0)
+        seed: seed of the noise
+        timeout: commands whose cost exceeds 'timeout' seconds fail without
+                 outputs
+    """
+
+    def __init__(self, costs=None, scale=1.0, jitter=0.0, seed=None,
+                 timeout=None):
+        super().__init__(timeout)
+        self.costs = {tool: dict(cost) for tool, cost in
+                      DEFAULT_COSTS.items()}
+        for tool, cost in (costs or {}).items():
+            self.costs.setdefault(tool, {'base': 0, 'per_mb': 0}).update(
+                cost)
+        self.scale = scale
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tools = {'bet': self.bet, 'flirt': self.flirt,
+                      'fslmaths': self.fslmaths, 'dtifit': self.dtifit,
+                      'eddy_correct': self.copy, 'asl_file': self.asl_file,
+                      'makerot': self.makerot, 'cp': self.copy,
+                      'mkdir': self.mkdir}
+
+    def cost(self, tool, args):
+        """
+        Returns: the simulated seconds of a command, from the size of the
+        existing files among its arguments
+        """
+        files = set(arg.split('=', 1)[-1] for arg in args)
+        megabytes = sum(os.path.getsize(filename) for filename in files
+                        if os.path.isfile(filename)) / 2 ** 20
+        cost = self.costs[tool]['base'] + self.costs[tool]['per_mb'] * \
+            megabytes
+        if self.jitter > 0:
+            with self.lock:
+                cost *= self.random.lognormvariate(0, self.jitter)
+        return cost * self.scale
+
+    def run(self, command):
+        """
+        Writes the outputs of the command and waits until its cost has
+        passed.
+
+        Returns: (return code, CPU seconds, peak resident memory in MB) of
+        the emulation, the return code is 127 for unknown tools and None on
+        timeout
+        """
+        start = time.time()
+        cpu = time.thread_time()
+        args = shlex.split(command)
+        if not args or args[0] not in self.tools:
+            print("Simulated executor: unknown tool in " + command,
+                  flush=True)
+            return 127, 0, 0
+        cost = self.cost(args[0], args[1:])
+        if self.timeout is not None and cost > self.timeout:
+            time.sleep(self.timeout)
+            return None, 0, 0
+        try:
+            self.tools[args[0]](args[1:])
+            returncode = 0
+        except Exception as error:
+            print("Simulated " + command + " failed: " + repr(error),
+                  flush=True)
+            returncode = 1
+        cpu = time.thread_time() - cpu
+        time.sleep(max(0, cost - (time.time() - start)))
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return returncode, cpu, max_rss / 1024
+
+    @staticmethod
+    def number(arg):
+        try:
+            float(arg)
+        except ValueError:
+            return False
+        return True
+
+    @staticmethod
+    def options(args):
+        """
+        Returns: (positional arguments, dictionary of the '-x value' and
+        '--x=value' options, flags map to True)
+        """
+        positional = []
+        options = {}
+        index = 0
+        while index < len(args):
+            arg = args[index]
+            if arg.startswith('--'):
+                name, _, value = arg[2:].partition('=')
+                options[name] = value or True
+            elif arg.startswith('-') and not SimulatedExecutor.number(arg):
+                if index + 1 < len(args) and (
+                        not args[index + 1].startswith('-') or
+                        SimulatedExecutor.number(args[index + 1])):
+                    options[arg[1:]] = args[index + 1]
+                    index += 1
+                else:
+                    options[arg[1:]] = True
+            else:
+                positional.append(arg)
+            index += 1
+        return positional, options
+
+    def bet(self, args):
+        """
+        Keeps the voxels above the fraction '-f' of the robust maximum and
+        writes the mask with '-m'.
+        """
+        positional, options = self.options(args)
+        image, data = native.load(positional[0])
+        output = positional[1].split('.nii')[0]
+        threshold = float(options.get('f', 0.5)) * np.percentile(data, 98)
+        mask = snd.binary_fill_holes(data > threshold)
+        native.save(data * mask, image.affine, image.header,
+                    output + '.nii.gz')
+        if 'm' in options:
+            native.save(mask.astype(np.float32), image.affine, image.header,
+                        output + '_mask.nii.gz')
+
+    def flirt(self, args):
+        """
+        Resamples the input to the grid of the reference, with the matrix of
+        '-init' for '-applyxfm', and writes the identity as '-omat'.
+        """
+        _, options = self.options(args)
+        image, data = native.load(options['in'])
+        reference = nb.load(options['ref'])
+        if 'applyxfm' in options and 'init' in options:
+            inverse = np.linalg.inv(np.loadtxt(options['init']))
+            data = snd.affine_transform(data, inverse[:3, :3],
+                                        inverse[:3, 3], order=1,
+                                        mode='nearest')
+        factors = [new / old for new, old in zip(reference.shape[:3],
+                                                 data.shape[:3])]
+        data = snd.zoom(data, factors, order=1, mode='nearest')
+        native.save(data, reference.affine, reference.header,
+                    options['out'].split('.nii')[0] + '.nii.gz')
+        if 'omat' in options:
+            np.savetxt(options['omat'], np.eye(4), fmt='%.6f')
+
+    def fslmaths(self, args):
+        """
+        Smoothing (-s), subsampling (-subsamp2) and the average of images
+        ('-add ... -div'), as the native stages.
+        """
+        if len(args) == 4 and args[1] == '-s':
+            native.gaussian_smoothing(args[0], args[3], float(args[2]))
+        elif len(args) == 3 and args[1] == '-subsamp2':
+            native.subsample(args[0], args[2])
+        elif '-div' in args:
+            native.average([arg for arg in args[:args.index('-div')]
+                            if arg != '-add'], args[-1])
+        else:
+            raise ValueError("Unsupported fslmaths operations")
+
+    def dtifit(self, args):
+        _, options = self.options(args)
+        native.tensor_fitting(options['k'], options['o'], options['m'],
+                              options['r'], options['b'])
+
+    def asl_file(self, args):
+        _, options = self.options(args)
+        native.asl_subtraction(options['data'], options['out'],
+                               options['mean'])
+
+    def makerot(self, args):
+        """
+        Writes the rotation around the axis '-a' by '-t' degrees about the
+        center '-c' to the matrix file '-o'.
+        """
+        _, options = self.options(args)
+        axis = np.array(options['a'].split(','), dtype=np.float64)
+        axis /= np.linalg.norm(axis)
+        center = np.array(options['c'].split(','), dtype=np.float64)
+        angle = np.radians(float(options['t']))
+        cross = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]],
+                          [-axis[1], axis[0], 0]])
+        rotation = np.eye(3) + np.sin(angle) * cross + \
+            (1 - np.cos(angle)) * cross.dot(cross)
+        matrix = np.eye(4)
+        matrix[:3, :3] = rotation
+        matrix[:3, 3] = center - rotation.dot(center)
+        np.savetxt(options['o'], matrix, fmt='%.6f')
+
+    @staticmethod
+    def copy(args):
+        # eddy_correct <input> <output> <reference volume> is a copy
+        shutil.copyfile(args[0], args[1])
+
+    @staticmethod
+    def mkdir(args):
+        for folder in args:
+            os.makedirs(folder, exist_ok=True)
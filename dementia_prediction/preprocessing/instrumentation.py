@@ -0,0 +1,138 @@
+"""
+This module records the resources used by the commands of the preprocessing
+stages.
+
+For every command the scheduler runs, the profile stores its stage, subject
+and tool with the wall time, the CPU time and peak resident memory of the
+command process and its children, and the bytes of its input and output
+files. Each stage adds its total wall and CPU time. The records are kept in a
+JSON file, extended by every run, and written as CSV alongside it for
+spreadsheets.
+
+Print the slowest stages and subjects of a profile with
+    python -m dementia_prediction.preprocessing.instrumentation profile.json
+"""
+
+import os
+import csv
+import json
+import argparse
+import threading
+import collections
+
+# Columns of the command records and of the CSV file
+FIELDS = ['stage', 'subject', 'tool', 'command', 'success', 'attempts',
+          'start', 'wall', 'cpu', 'max_rss_mb', 'bytes_read',
+          'bytes_written']
+
+
+def file_bytes(filenames):
+    """
+    Returns: the total size of the existing files
+    """
+    return sum(os.path.getsize(filename) for filename in filenames
+               if os.path.isfile(filename))
+
+
+class ResourceProfile:
+    """
+    Initialize this class with the path of the JSON profile, which is created
+    on the first save().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.commands = []
+        self.stages = []
+        if os.path.exists(path):
+            with open(path) as filep:
+                profile = json.load(filep)
+            self.commands = profile['commands']
+            self.stages = profile['stages']
+
+    def add_command(self, record):
+        """
+        Adds the record of a command, a dictionary with the keys of FIELDS.
+        """
+        with self.lock:
+            self.commands.append(record)
+
+    def add_stage(self, stage, start, wall, cpu, commands, failed,
+                  subjects):
+        with self.lock:
+            self.stages.append({'stage': stage, 'start': start,
+                                'wall': wall, 'cpu': cpu,
+                                'commands': commands, 'failed': failed,
+                                'subjects': subjects})
+
+    def save(self):
+        """
+        Writes the JSON profile and the commands as CSV, <path>.csv without
+        the .json extension.
+        """
+        with self.lock:
+            tmp_path = self.path + '.' + str(os.getpid()) + '.tmp'
+            with open(tmp_path, 'w') as filep:
+                json.dump({'commands': self.commands,
+                           'stages': self.stages}, filep, indent=1)
+            os.replace(tmp_path, self.path)
+            csv_path = self.path.rsplit('.json', 1)[0] + '.csv'
+            tmp_path = csv_path + '.' + str(os.getpid()) + '.tmp'
+            with open(tmp_path, 'w', newline='') as filep:
+                writer = csv.DictWriter(filep, FIELDS)
+                writer.writeheader()
+                writer.writerows(self.commands)
+            os.replace(tmp_path, csv_path)
+
+    def summary(self, top=10, stage=None):
+        """
+        Returns: a table of the stages by total wall time and of the 'top'
+        slowest commands with their subjects, only of the given stage if
+        'stage' is set
+        """
+        commands = [record for record in self.commands
+                    if stage is None or record['stage'] == stage]
+        stages = collections.OrderedDict()
+        for record in self.stages:
+            if stage is not None and record['stage'] != stage:
+                continue
+            total = stages.setdefault(record['stage'], collections.Counter())
+            for key in ['wall', 'cpu', 'commands', 'failed', 'subjects']:
+                total[key] += record[key]
+        lines = ['{0:<24}{1:>10}{2:>10}{3:>10}{4:>8}{5:>12}'.format(
+            'Stage', 'Wall [s]', 'CPU [s]', 'Commands', 'Failed',
+            'Subjects/h')]
+        for name, total in sorted(stages.items(),
+                                  key=lambda item: -item[1]['wall']):
+            rate = total['subjects'] * 3600 / total['wall'] \
+                if total['wall'] > 0 else 0
+            lines.append('{0:<24}{1:>10.1f}{2:>10.1f}{3:>10}{4:>8}'
+                         '{5:>12.1f}'.format(str(name), total['wall'],
+                                             total['cpu'], total['commands'],
+                                             total['failed'], rate))
+        lines.append('')
+        lines.append('{0:<24}{1:<40}{2:>10}{3:>10}{4:>10}{5:>12}'.format(
+            'Stage', 'Subject', 'Wall [s]', 'CPU [s]', 'RSS [MB]',
+            'Read [MB]'))
+        for record in sorted(commands, key=lambda item: -item['wall'])[:top]:
+            subject = str(record['subject'])
+            if len(subject) > 38:
+                subject = '...' + subject[-35:]
+            lines.append('{0:<24}{1:<40}{2:>10.1f}{3:>10.1f}{4:>10.1f}'
+                         '{5:>12.1f}'.format(str(record['stage']), subject,
+                                             record['wall'], record['cpu'],
+                                             record['max_rss_mb'],
+                                             record['bytes_read'] / 2 ** 20))
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Print the slowest stages and subjects of a profile")
+    parser.add_argument("profile", type=str, help='Path to the JSON profile')
+    parser.add_argument("--top", type=int, default=20,
+                        help='Number of slowest commands')
+    parser.add_argument("--stage", type=str, help='Only this stage')
+    args = parser.parse_args()
+    print(ResourceProfile(args.profile).summary(args.top, args.stage))
@@ -0,0 +1,182 @@
+"""
+This module contains in-process NumPy versions of the FSL operations of the
+preprocessing pipeline: Gaussian smoothing (fslmaths -s), subsampling by 2
+(fslmaths -subsamp2), the voxel-wise average of a set of images (the
+'-add ... -div' template command), the diffusion tensor fit (dtifit) and
+the tag-control subtraction of ASL series (asl_file --diff --mean).
+
+The functions read and write NIfTI files with nibabel, so the stages run
+without FSL and without a process per image. Outputs keep the header and
+data type of their input as fslmaths does, the tensor and ASL maps are
+float32.
+"""
+
+import numpy as np
+import nibabel as nb
+import scipy.ndimage as snd
+from concurrent.futures import ThreadPoolExecutor
+
+# Separable kernel of fslmaths -subsamp2, which averages the neighbourhood of
+# every second voxel
+SUBSAMPLE_KERNEL = np.array([0.25, 0.5, 0.25])
+
+
+def load(filename):
+    """
+    Returns: (image, data) with the voxel values as a float32 array
+    """
+    image = nb.load(filename)
+    return image, np.asarray(image.dataobj, dtype=np.float32)
+
+
+def save(data, affine, header, filename):
+    output = nb.Nifti1Image(data, affine, header)
+    nb.save(output, filename)
+
+
+def gaussian_smoothing(input_file, output_file, sigma):
+    """
+    Smooths an image with a Gaussian kernel of standard deviation 'sigma' in
+    mm, as fslmaths -s. Volumes of 4D images are smoothed separately.
+    """
+    image, data = load(input_file)
+    zooms = image.header.get_zooms()[:3]
+    sigmas = [sigma / zoom for zoom in zooms] + [0] * (data.ndim - 3)
+    smoothed = snd.gaussian_filter(data, sigmas, mode='constant')
+    save(smoothed, image.affine, image.header, output_file)
+
+
+def subsample(input_file, output_file):
+    """
+    Halves the resolution of an image as fslmaths -subsamp2, keeping the new
+    voxels centred on every second old voxel. Each new voxel is the average
+    of the 3x3x3 neighbourhood of its old voxel with weights 1/4, 1/2, 1/4
+    per axis.
+    """
+    image, data = load(input_file)
+    for axis in range(0, 3):
+        data = snd.correlate1d(data, SUBSAMPLE_KERNEL, axis=axis,
+                               mode='nearest')
+    subsampled = np.ascontiguousarray(data[::2, ::2, ::2])
+    affine = image.affine.copy()
+    affine[:3, :3] = affine[:3, :3] * 2
+    header = image.header.copy()
+    header.set_zooms(tuple(zoom * 2 for zoom in header.get_zooms()[:3]) +
+                     header.get_zooms()[3:])
+    save(subsampled, affine, header, output_file)
+
+
+def average(input_files, output_file, workers=4):
+    """
+    Averages the images voxel-wise with a running sum. The images are loaded
+    by a pool of 'workers' threads, at most 'workers' images at a time.
+    """
+    total = None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(input_files), workers):
+            for image, data in executor.map(
+                    load, input_files[start:start + workers]):
+                if total is None:
+                    first = image
+                    total = np.zeros(data.shape, dtype=np.float64)
+                total += data
+    save((total / len(input_files)).astype(np.float32), first.affine,
+         first.header, output_file)
+
+
+def tensor_design(bvals, bvecs):
+    """
+    Returns: the (directions, 7) design matrix of the log-linear tensor fit,
+    log(S) = design . [log(S0), Dxx, Dyy, Dzz, Dxy, Dxz, Dyz]
+    """
+    bvals = np.asarray(bvals, dtype=np.float64)
+    gx, gy, gz = np.asarray(bvecs, dtype=np.float64)
+    return np.stack([np.ones_like(bvals),
+                     -bvals * gx * gx, -bvals * gy * gy, -bvals * gz * gz,
+                     -2 * bvals * gx * gy, -2 * bvals * gx * gz,
+                     -2 * bvals * gy * gz], axis=1)
+
+
+def fit_tensors(signals, design):
+    """
+    Fits the diffusion tensors of a batch of voxels by ordinary least squares
+    on the log signal, as dtifit does, and decomposes them at once.
+    Args:
+        signals: (voxels, directions) array
+        design: design matrix of tensor_design()
+
+    Returns: dictionary of (voxels,) arrays 'S0', 'L1', 'L2', 'L3', 'MD',
+    'FA' and (voxels, 3) arrays 'V1', 'V2', 'V3', the eigenvalues in
+    decreasing order with their eigenvectors
+    """
+    log_signals = np.log(np.maximum(signals, 1e-6)).T
+    coefficients = np.linalg.pinv(design).dot(log_signals).T
+    tensors = np.empty((len(coefficients), 3, 3))
+    for (row, col), index in zip([(0, 0), (1, 1), (2, 2), (0, 1), (0, 2),
+                                  (1, 2)], range(1, 7)):
+        tensors[:, row, col] = coefficients[:, index]
+        tensors[:, col, row] = coefficients[:, index]
+    # Eigenvalues in increasing order
+    eigenvalues, eigenvectors = np.linalg.eigh(tensors)
+    md = eigenvalues.mean(axis=1)
+    norm = np.sqrt(np.sum(eigenvalues ** 2, axis=1))
+    deviation = np.sqrt(np.sum((eigenvalues - md[:, None]) ** 2, axis=1))
+    fa = np.zeros(len(md))
+    nonzero = norm > 0
+    fa[nonzero] = np.sqrt(1.5) * deviation[nonzero] / norm[nonzero]
+    return {'S0': np.exp(coefficients[:, 0]), 'MD': md, 'FA': fa,
+            'L1': eigenvalues[:, 2], 'L2': eigenvalues[:, 1],
+            'L3': eigenvalues[:, 0], 'V1': eigenvectors[:, :, 2],
+            'V2': eigenvectors[:, :, 1], 'V3': eigenvectors[:, :, 0]}
+
+
+def tensor_fitting(input_file, output_base, brain_mask, grad_dir, grad_val,
+                   chunk_size=100000):
+    """
+    Fits the diffusion tensor of every voxel in the brain mask as dtifit and
+    writes the <output_base>_FA, _MD, _L1 - _L3, _V1 - _V3 and _S0 images.
+    The voxels are fitted in chunks of 'chunk_size'.
+    """
+    image, data = load(input_file)
+    mask = np.asarray(nb.load(brain_mask).dataobj) > 0
+    design = tensor_design(np.loadtxt(grad_val).ravel(),
+                           np.loadtxt(grad_dir).reshape(3, -1))
+    voxels = np.nonzero(mask)
+    outputs = {}
+    for start in range(0, len(voxels[0]), chunk_size):
+        chunk = tuple(index[start:start + chunk_size] for index in voxels)
+        fit = fit_tensors(data[chunk], design)
+        for name, values in fit.items():
+            if name not in outputs:
+                outputs[name] = np.zeros(mask.shape + values.shape[1:],
+                                         dtype=np.float32)
+            outputs[name][chunk] = values
+    for name, values in outputs.items():
+        # The maps are 3D, the eigenvectors 4D with 3 volumes
+        header = image.header.copy()
+        header.set_data_dtype(np.float32)
+        header.set_data_shape(values.shape)
+        save(values, image.affine, header,
+             output_base + '_' + name + '.nii.gz')
+
+
+def asl_subtraction(input_file, output_diff, output_diff_mean):
+    """
+    Subtracts the tag from the control volumes of a 4D ASL series with
+    alternating tag and control volumes, as asl_file --iaf=tc --diff --mean.
+    Writes the (x, y, z, pairs) differences to 'output_diff' and their mean
+    over the pairs to 'output_diff_mean'.
+    """
+    image, data = load(input_file)
+    if data.ndim != 4 or data.shape[3] % 2 != 0:
+        raise ValueError("Expected tag-control pairs in " + input_file +
+                         " of shape " + str(data.shape))
+    diff = data[..., 1::2] - data[..., 0::2]
+    # The series is no longer needed for the mean
+    del data
+    header = image.header.copy()
+    header.set_data_dtype(np.float32)
+    save(diff, image.affine, header, output_diff)
+    header = header.copy()
+    header.set_data_shape(diff.shape[:3])
+    save(diff.mean(axis=3), image.affine, header, output_diff_mean)
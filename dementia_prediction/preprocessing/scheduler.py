@@ -0,0 +1,286 @@
+"""
+This module runs the FSL commands of the preprocessing stages in parallel.
+
+The commands of a stage are queued and run by a bounded pool of worker
+threads, each waiting on its command. The number of concurrent commands
+of a tool (bet, flirt, fslmaths, ...) can be limited separately, failed or
+timed out commands are retried, and the running commands are recorded in a
+state file, so the partial outputs of an interrupted stage are written again
+when it resumes. With a build record, outputs whose inputs or command changed
+are written again as well, see dag.py.
+
+Jobs can also be Python functions, e.g. the NumPy stages of native.py, which
+run in the worker threads instead of a subprocess. The commands themselves
+are run by an executor, a shell or the simulated FSL of executors.py.
+
+With a profile, the wall and CPU time, peak memory and file bytes of every
+command are recorded, see instrumentation.py.
+"""
+
+import os
+import json
+import time
+import resource
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dementia_prediction.preprocessing.dag import BuildRecord
+from dementia_prediction.preprocessing.instrumentation import \
+    ResourceProfile, file_bytes
+from dementia_prediction.preprocessing.executors import make_executor
+
+
+def in_process(pool, function, *args):
+    """
+    Runs a function in a process pool and waits for its result, so a job of
+    the scheduler threads can compute in another process.
+    """
+    return pool.submit(function, *args).result()
+
+
+class JobScheduler:
+    """
+    Initialize this class with the scheduler spec, e.g. the 'scheduler'
+    section of the preprocessing parameters:
+        workers: number of commands run at a time (default 1)
+        limits: dictionary of tool name and maximum number of concurrent
+                commands of the tool, e.g. {'bet': 8} (default no limits).
+                The native jobs 'native_<tool>' count towards the limit of
+                <tool> unless they have their own.
+        retries: number of times a failed command is run again (default 0)
+        timeout: seconds after which a command is killed, None for no
+                 timeout (default None)
+        state: path of the JSON file recording the running commands, None
+               for no state file (default None)
+        record: path of the JSON build record of the outputs, None to only
+                check that the outputs exist (default None)
+        profile: path of the JSON resource profile of the commands, None for
+                 no profile (default None)
+        executor: executor of the commands, e.g. {'type': 'simulated',
+                  'scale': 0.01} for the FSL stand-in of executors.py
+                  (default a shell)
+        save_interval: seconds between the saves of the state file and the
+                       build record after finished commands, both are saved
+                       at the end of run() (default 10)
+    """
+
+    def __init__(self, workers=1, limits=None, retries=0, timeout=None,
+                 state=None, record=None, profile=None, executor=None,
+                 save_interval=10):
+        self.workers = workers
+        self.limits = {tool: threading.Semaphore(limit)
+                       for tool, limit in (limits or {}).items()}
+        self.retries = retries
+        self.timeout = timeout
+        self.state_path = state
+        self.save_interval = save_interval
+        self.saved = time.time()
+        self.lock = threading.Lock()
+        self.jobs = []
+        # Commands started and not finished, with their outputs
+        self.running = {}
+        if state is not None and os.path.exists(state):
+            with open(state) as filep:
+                self.running = json.load(filep)
+        self.record = None
+        if record is not None:
+            self.record = BuildRecord(record)
+        self.executor = make_executor(executor, timeout)
+        self.profile = None
+        if profile is not None:
+            self.profile = ResourceProfile(profile)
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Returns: the scheduler configured with the 'scheduler' section of
+        the parameters, running one command at a time if it is not set.
+        """
+        spec = (params or {}).get('scheduler') or {}
+        return cls(**spec)
+
+    def submit(self, command, outputs, subject=None, message=None,
+               inputs=(), function=None):
+        """
+        Queues a shell command for the next run(), unless its outputs are up
+        to date.
+        Args:
+            command: shell command, its first word is the tool name
+            outputs: list of the files written by the command
+            subject: the image or subject the command processes, used for the
+                     throughput
+            message: printed when the command succeeded
+            inputs: list of the files read by the command
+            function: optional function called without arguments in place of
+                      the shell command, which then only describes the job
+                      with its tool name and parameters. Timeouts do not
+                      apply to functions.
+
+        Returns: True if the command was queued
+        """
+        signature = None
+        if self.record is not None:
+            signature = self.record.signature(inputs, command)
+        if not self.pending(outputs, signature):
+            return False
+        self.jobs.append({'command': command, 'outputs': list(outputs),
+                          'inputs': list(inputs), 'subject': subject,
+                          'message': message, 'signature': signature,
+                          'function': function})
+        return True
+
+    def pending(self, outputs, signature=None):
+        """
+        Returns: True if an output is missing, was written by a command
+        which was interrupted or, with a build record, has another command
+        or input hashes than 'signature'
+        """
+        interrupted = set(output for command_outputs in self.running.values()
+                          for output in command_outputs)
+        if any(not os.path.exists(output) or output in interrupted
+               for output in outputs):
+            return True
+        if self.record is None or signature is None:
+            return False
+        return not self.record.up_to_date(outputs, signature)
+
+    def call(self, job):
+        """
+        Runs the function of a job or its command with the executor.
+
+        Returns: (return code, CPU seconds, peak resident memory in MB). The
+        return code is 1 if the function raised an exception and None on
+        timeout. For functions, the CPU time is that of the worker thread and
+        the memory the peak of the whole process.
+        """
+        if job['function'] is not None:
+            cpu = time.thread_time()
+            try:
+                job['function']()
+                returncode = 0
+            except Exception as error:
+                print("Error in " + job['command'] + ": " + repr(error),
+                      flush=True)
+                returncode = 1
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return returncode, time.thread_time() - cpu, max_rss / 1024
+        return self.executor.run(job['command'])
+
+    def update(self, job, running):
+        with self.lock:
+            if running:
+                # A command is recorded before it writes its outputs
+                self.running[job['command']] = job['outputs']
+                self.save()
+            else:
+                # Finished commands which are not saved yet only run again
+                # after an interruption
+                self.running.pop(job['command'], None)
+                if time.time() - self.saved >= self.save_interval:
+                    self.save_all()
+
+    def limit(self, tool):
+        """
+        Returns: the semaphore of the limit of a tool, None if it has none
+        """
+        if tool not in self.limits and tool.startswith('native_'):
+            tool = tool[len('native_'):]
+        return self.limits.get(tool)
+
+    def execute(self, job):
+        tool = job['command'].split()[0]
+        limit = self.limit(tool)
+        self.update(job, True)
+        for attempt in range(0, self.retries + 1):
+            if limit is not None:
+                limit.acquire()
+            start = time.time()
+            try:
+                returncode, cpu, max_rss = self.call(job)
+            finally:
+                if limit is not None:
+                    limit.release()
+            if self.profile is not None:
+                self.profile.add_command({
+                    'stage': job.get('stage'), 'subject': job['subject'],
+                    'tool': tool, 'command': job['command'],
+                    'success': returncode == 0, 'attempts': attempt + 1,
+                    'start': start, 'wall': time.time() - start, 'cpu': cpu,
+                    'max_rss_mb': max_rss,
+                    'bytes_read': file_bytes(job['inputs']),
+                    'bytes_written': file_bytes(job['outputs'])})
+            if returncode == 0:
+                break
+            # Partial outputs are removed, so they are not taken as done
+            for output in job['outputs']:
+                if os.path.exists(output):
+                    os.remove(output)
+            print("Command failed (" + ("timeout" if returncode is None else
+                                        "exit " + str(returncode)) +
+                  ", attempt " + str(attempt + 1) + "): " + job['command'],
+                  flush=True)
+        else:
+            self.update(job, False)
+            return False
+        with self.lock:
+            if self.record is not None:
+                self.record.update(job['outputs'], job['signature'])
+        self.update(job, False)
+        if job['message'] is not None:
+            print(job['message'], flush=True)
+        return True
+
+    def save(self):
+        if self.state_path is None:
+            return
+        tmp_path = self.state_path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'w') as filep:
+            json.dump(self.running, filep)
+        os.replace(tmp_path, self.state_path)
+
+    def save_all(self):
+        """
+        Saves the state file and the build record, with the lock held.
+        """
+        self.save()
+        if self.record is not None:
+            self.record.save()
+        self.saved = time.time()
+
+    def run(self, stage=None):
+        """
+        Runs the queued commands and prints the throughput.
+        Args:
+            stage: name of the stage in the profile and its summary
+
+        Returns: True if all commands succeeded
+        """
+        jobs = self.jobs
+        self.jobs = []
+        for job in jobs:
+            job['stage'] = stage
+        start = time.time()
+        cpu = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = cpu.ru_utime + cpu.ru_stime + time.process_time()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(self.execute, jobs))
+        finally:
+            with self.lock:
+                self.save_all()
+        elapsed = time.time() - start
+        subjects = len(set(job['subject'] for job, result in
+                           zip(jobs, results) if result))
+        print("Ran", len(jobs), "commands,", results.count(False), "failed,",
+              "in", round(elapsed, 1), "s")
+        if jobs and elapsed > 0:
+            print("Throughput:", round(subjects * 3600 / elapsed, 1),
+                  "subjects/hour", flush=True)
+        if self.profile is not None and jobs:
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            cpu = usage.ru_utime + usage.ru_stime + time.process_time() - cpu
+            self.profile.add_stage(stage, start, elapsed, cpu, len(jobs),
+                                   results.count(False), subjects)
+            self.profile.save()
+            print(self.profile.summary(5, stage), flush=True)
+        return all(results)
@@ -0,0 +1,57 @@
+""" This module tests the augmentation module. """
+import random
+import unittest
+import importlib
+import numpy as np
+import scipy.ndimage as snd
+from settings import PROJECT
+AUGMENTATION = importlib.import_module(PROJECT + ".augmentation")
+AUG = AUGMENTATION.Augmentation
+
+
+class TestAugmentation(unittest.TestCase):
+    """ Test the Augmentation class """
+
+    def setUp(self):
+        """ Prepare a smooth random image """
+        rng = np.random.RandomState(0)
+        self.image = snd.gaussian_filter(rng.rand(15, 17, 13), 2)\
+            .astype(np.float32)
+
+    def test_rotation(self):
+        """ A rotation should match scipy.ndimage.rotate """
+        aug = AUG(order=1)
+        for plane in [(0, 1), (0, 2), (1, 2)]:
+            matrix = aug.rotation_matrix(plane, 3)
+            result = aug.transform(self.image, (matrix, np.zeros(3)))
+            expected = snd.rotate(self.image, 3, plane, reshape=False,
+                                  order=1, mode='nearest')
+            np.testing.assert_allclose(result, expected, atol=1e-5)
+
+    def test_translation(self):
+        """ A translation should match scipy.ndimage.shift """
+        aug = AUG(order=1)
+        result = aug.transform(self.image, (np.eye(3), np.array([0, 2.5, 0])))
+        expected = snd.shift(self.image, [0, 2.5, 0], order=1, mode='nearest')
+        np.testing.assert_allclose(result, expected, atol=1e-5)
+
+    def test_seeded_batch(self):
+        """ The same seed should give the same batch, shared by modalities """
+        aug = AUG(mode='combined')
+        batches = []
+        for _ in range(2):
+            batch = np.stack([self.image] * 3)[..., None]
+            other = batch.copy()
+            aug.augment([batch, other], random.Random(7))
+            np.testing.assert_array_equal(batch, other)
+            batches.append(batch)
+        np.testing.assert_array_equal(batches[0], batches[1])
+        self.assertFalse(np.allclose(batches[0][0], self.image[..., None]))
+        self.assertFalse(np.allclose(batches[0][0], batches[0][1]))
+
+    def test_probability(self):
+        """ By default one in 7 images stays unchanged """
+        aug = AUG()
+        rng = random.Random(0)
+        unchanged = sum(aug.sample(rng) is None for _ in range(7000))
+        self.assertAlmostEqual(unchanged / 7000, 1 / 7, delta=0.02)
@@ -0,0 +1,124 @@
+""" This module tests the augmentation_manifest module. """
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import importlib
+import numpy as np
+import nibabel as nb
+import scipy.ndimage as snd
+from settings import PROJECT
+MANIFEST = importlib.import_module(PROJECT + ".augmentation_manifest")
+EXECUTORS = importlib.import_module(PROJECT + ".preprocessing.executors")
+
+
+class ImageCache:
+    """ Reads the images as VolumeCache.load, without a cache folder """
+
+    @staticmethod
+    def load(filename):
+        return np.asarray(nb.load(filename).dataobj, dtype=np.float32)
+
+
+class TestAugmentationManifest(unittest.TestCase):
+    """ Test the AugmentationManifest class """
+
+    def setUp(self):
+        """ Write a smooth random source image """
+        self.tmp = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.image = snd.gaussian_filter(rng.rand(15, 17, 13), 2)\
+            .astype(np.float32)
+        self.source = os.path.join(self.tmp, 'CON001-T1.nii.gz')
+        nb.save(nb.Nifti1Image(self.image, np.eye(4)), self.source)
+        self.path = os.path.join(self.tmp, 'augmentation.json')
+        manifest = MANIFEST.AugmentationManifest(self.path)
+        manifest.add('CON001-T1_rot_x.nii.gz', self.source,
+                     MANIFEST.rotation('x', 3))
+        manifest.add('CON001-T1_rot3_trans3_y.nii.gz', self.source,
+                     MANIFEST.compose(MANIFEST.rotation('y', -3),
+                                      MANIFEST.translation([0, 3, 0])))
+        manifest.save()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_expand(self):
+        """ The augmented images should follow their source images """
+        manifest = MANIFEST.AugmentationManifest(self.path)
+        other = os.path.join(self.tmp, 'CON002-T1.nii.gz')
+        self.assertEqual(manifest.expand([self.source, other]), [
+            self.source, other,
+            os.path.join(self.tmp, 'CON001-T1_rot3_trans3_y.nii.gz'),
+            os.path.join(self.tmp, 'CON001-T1_rot_x.nii.gz')])
+
+    def test_lazy_resampling(self):
+        """ Augmented images should match the materialized transforms """
+        manifest = MANIFEST.AugmentationManifest(self.path, cache_size=1)
+        rotated = manifest.load(os.path.join(self.tmp,
+                                             'CON001-T1_rot_x.nii.gz'),
+                                ImageCache)
+        expected = snd.rotate(self.image, 3, (1, 2), reshape=False, order=1,
+                              mode='nearest')
+        np.testing.assert_allclose(rotated, expected, atol=1e-5)
+        combined = manifest.load(os.path.join(
+            self.tmp, 'CON001-T1_rot3_trans3_y.nii.gz'), ImageCache)
+        expected = snd.shift(snd.rotate(self.image, 3, (0, 2), reshape=False,
+                                        order=1, mode='nearest'),
+                             [0, 3, 0], order=1, mode='nearest')
+        # Both resamplings interpolate the image once
+        np.testing.assert_allclose(combined[2:-2, 5:-2, 2:-2],
+                                   expected[2:-2, 5:-2, 2:-2], atol=0.02)
+        np.testing.assert_allclose(manifest.load(self.source, ImageCache),
+                                   self.image)
+
+    def test_simulated_makerot(self):
+        """ Rotations should match makerot applied by SimulatedExecutor """
+        executor = EXECUTORS.SimulatedExecutor(scale=0)
+        manifest = MANIFEST.AugmentationManifest(self.path)
+        center = ','.join(str((size - 1) / 2.0) for size in self.image.shape)
+        for direction, axis in [('x', '1,0,0'), ('y', '0,1,0'),
+                                ('z', '0,0,1')]:
+            matrix = os.path.join(self.tmp, 'rot_' + direction + '.mat')
+            output = os.path.join(self.tmp, 'flirt_' + direction + '.nii.gz')
+            self.assertEqual(executor.call(
+                'makerot -c {0} -a {1} -t 5 -o {2}'.format(center, axis,
+                                                           matrix)), 0)
+            self.assertEqual(executor.call(
+                'flirt -in {0} -ref {0} -out {1} -applyxfm -init {2}'.format(
+                    self.source, output, matrix)), 0)
+            name = os.path.join(self.tmp, 'CON001-T1_rot5_' + direction +
+                                '.nii.gz')
+            manifest.add(name, self.source, MANIFEST.rotation(direction, 5))
+            np.testing.assert_allclose(manifest.load(name, ImageCache),
+                                       ImageCache.load(output), atol=1e-4)
+
+    def test_translation_order(self):
+        """ Translations should be cubic as scipy.ndimage.shift """
+        name = os.path.join(self.tmp, 'CON001-T1_trans.nii.gz')
+        for order, expected in [(None, 3), (1, 1)]:
+            manifest = MANIFEST.AugmentationManifest(self.path, order=order)
+            manifest.add(name, self.source, MANIFEST.translation([3, 0, 0]))
+            np.testing.assert_allclose(
+                manifest.load(name, ImageCache),
+                snd.shift(self.image, [3, 0, 0], order=expected,
+                          mode='nearest'), atol=1e-5)
+
+    def test_cache(self):
+        """ The least recently read image should be evicted """
+        manifest = MANIFEST.AugmentationManifest(self.path, cache_size=1)
+        names = [os.path.join(self.tmp, 'CON001-T1_rot_x.nii.gz'),
+                 os.path.join(self.tmp, 'CON001-T1_rot3_trans3_y.nii.gz')]
+        first = manifest.load(names[0], ImageCache)
+        self.assertIs(manifest.load(names[0], ImageCache), first)
+        manifest.load(names[1], ImageCache)
+        self.assertIsNot(manifest.load(names[0], ImageCache), first)
+        self.assertEqual((manifest.hits, manifest.misses), (1, 3))
+        copy = pickle.loads(pickle.dumps(manifest))
+        self.assertEqual(len(copy.cache), 0)
+        np.testing.assert_allclose(copy.load(names[0], ImageCache), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
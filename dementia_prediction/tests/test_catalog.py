@@ -0,0 +1,86 @@
+""" This module tests the catalog module. """
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import importlib
+from settings import PROJECT
+CATALOG = importlib.import_module(PROJECT + ".catalog")
+
+
+class TestCatalog(unittest.TestCase):
+    """ Test the Catalog class """
+
+    def setUp(self):
+        """ Prepare a data folder with two patients """
+        self.tmp = tempfile.mkdtemp()
+        self.data = os.path.join(self.tmp, 'data')
+        self.index = os.path.join(self.tmp, 'index')
+        for patient in ['CON001', 'PRO002']:
+            os.makedirs(os.path.join(self.data, patient))
+            for suffix in ['-T1.nii.gz', '-T1_brain.nii.gz']:
+                self.touch(patient, patient + suffix)
+        # Folders changed within the timestamp resolution are listed again
+        for dirpath, _, _ in os.walk(self.data):
+            os.utime(dirpath, (time.time() - 60, time.time() - 60))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def touch(self, patient, filename):
+        """ Create an empty image file """
+        open(os.path.join(self.data, patient, filename), 'w').close()
+
+    def catalog(self):
+        """ Open the catalog from its stored index """
+        return CATALOG.Catalog(self.data, self.index)
+
+    def test_walk(self):
+        """ The listing should match os.walk """
+        walked = sorted((dirpath, sorted(dirs), sorted(files))
+                        for dirpath, dirs, files in os.walk(self.data))
+        self.assertEqual(sorted(self.catalog().walk()), walked)
+
+    def test_incremental_refresh(self):
+        """ Only the changed folders should be listed again """
+        self.assertEqual(self.catalog().refresh(), 3)
+        self.assertEqual(self.catalog().refresh(), 0)
+        self.touch('PRO002', 'PRO002-T1_brain_smoothed.nii.gz')
+        os.utime(os.path.join(self.data, 'PRO002'), (0, 0))
+        catalog = self.catalog()
+        self.assertEqual(catalog.refresh(), 1)
+        self.assertEqual(len(catalog.entries(r'_smoothed\.nii\.gz$')), 1)
+
+    def test_same_tick(self):
+        """ Files added or rewritten without a new folder mtime are found """
+        folder = os.path.join(self.data, 'CON001')
+        os.utime(folder, None)
+        mtime = os.stat(folder).st_mtime
+        self.assertEqual(self.catalog().refresh(), 3)
+        self.touch('CON001', 'CON001-T1_brain_smoothed.nii.gz')
+        os.utime(folder, (mtime, mtime))
+        catalog = self.catalog()
+        self.assertEqual(catalog.refresh(), 1)
+        self.assertEqual(len(catalog.entries(r'_smoothed\.nii\.gz$')), 1)
+        os.utime(folder, (time.time() - 60, time.time() - 60))
+        self.assertEqual(catalog.refresh(), 1)
+        self.assertEqual(catalog.refresh(), 0)
+        with open(os.path.join(folder, 'CON001-T1.nii.gz'), 'w') as filep:
+            filep.write('image')
+        self.assertEqual(catalog.entries(r'CON001-T1\.nii\.gz$')[0].size, 5)
+
+    def test_files_per_class(self):
+        """ The query should match the patient codes and class labels """
+        class_files = self.catalog().files_per_class(
+            r'-T1_brain\.nii\.gz$', '-T1', {'CON001': 0, 'PRO002': 1},
+            ['PRO002'], 2)
+        self.assertEqual(class_files, [[], [os.path.join(
+            self.data, 'PRO002', 'PRO002-T1_brain.nii.gz')]])
+        entry = self.catalog().entries(r'CON001-T1\.nii\.gz$', '-T1')[0]
+        self.assertEqual(entry.patient_code, 'CON001')
+        self.assertEqual(entry.stage, '-T1.nii.gz')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+""" This module tests the preprocessing dag module. """
+import os
+import shutil
+import tempfile
+import unittest
+import importlib
+from settings import PROJECT
+DAG = importlib.import_module(PROJECT + ".preprocessing.dag")
+SCHEDULER = importlib.import_module(PROJECT + ".preprocessing.scheduler")
+
+
+class TestPreprocessingGraph(unittest.TestCase):
+    """ Test the incremental stages of a two stage graph """
+
+    def setUp(self):
+        """ Prepare an input image and the file names of the stages """
+        self.tmp = tempfile.mkdtemp()
+        self.input = os.path.join(self.tmp, 'input')
+        self.first = os.path.join(self.tmp, 'first')
+        self.second = os.path.join(self.tmp, 'second')
+        self.record = os.path.join(self.tmp, 'record.json')
+        with open(self.input, 'w') as filep:
+            filep.write('image')
+        self.runs = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def stage(self, stage, command, inputs, outputs):
+        """ Submit a stage command and record whether it ran """
+        if self.scheduler.submit(command, outputs, inputs[0], None, inputs):
+            self.runs.append(stage)
+        return self.scheduler.run()
+
+    def run_graph(self, threshold, targets=None):
+        """ Run the graph with the given parameter of the first stage """
+        self.runs = []
+        self.scheduler = SCHEDULER.JobScheduler(record=self.record)
+        graph = DAG.PreprocessingGraph()
+        graph.add('first', self.stage, stage='first',
+                  command='echo {0} | cat {1} - > {2}'.format(
+                      threshold, self.input, self.first),
+                  inputs=[self.input], outputs=[self.first])
+        graph.add('second', self.stage, deps=['first'], stage='second',
+                  command='cat {0} {0} > {1}'.format(self.first, self.second),
+                  inputs=[self.first], outputs=[self.second])
+        self.assertTrue(graph.run(targets))
+        return self.runs
+
+    def test_incremental(self):
+        """ Only outputs with changed inputs or parameters should run """
+        self.assertEqual(self.run_graph(0.35), ['first', 'second'])
+        self.assertEqual(self.run_graph(0.35), [])
+        self.assertEqual(self.run_graph(0.4, ['first']), ['first'])
+        self.assertEqual(self.run_graph(0.4), ['second'])
+        with open(self.input, 'a') as filep:
+            filep.write('changed')
+        self.assertEqual(self.run_graph(0.4), ['first', 'second'])
+
+    def test_selection(self):
+        """ Targets and start stages should select the upstream and
+        downstream stages """
+        graph = DAG.PreprocessingGraph()
+        for name, deps in [('a', []), ('b', ['a']), ('c', ['b']),
+                           ('d', ['a'])]:
+            graph.add(name, lambda: None, deps=deps)
+        self.assertEqual(graph.upstream(['c']), {'a', 'b', 'c'})
+        self.assertEqual(graph.downstream(['b']), {'b', 'c'})
+        self.assertRaises(ValueError, graph.add, 'e', lambda: None, ['x'])
+
+
+if __name__ == '__main__':
+    unittest.main()
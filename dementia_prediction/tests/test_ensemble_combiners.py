@@ -0,0 +1,60 @@
+""" This module tests the ensemble_combiners module. """
+import unittest
+import importlib
+import numpy as np
+from settings import PROJECT
+COMBINERS = importlib.import_module(PROJECT + ".ensemble_combiners")
+
+
+class TestEnsembleCombiners(unittest.TestCase):
+    """ Test the combiners on random member logits """
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.labels = rng.randint(0, 3, 200)
+        # Members whose logits favour the true class by decreasing margins
+        self.logits = rng.randn(5, 200, 3)
+        for member, margin in enumerate([2.0, 1.0, 0.5, 0.0, 0.0]):
+            self.logits[member, np.arange(200), self.labels] += margin
+
+    def test_weighted_mean(self):
+        """ Equal weights give the average of np.average """
+        np.testing.assert_allclose(
+            COMBINERS.weighted_mean(self.logits),
+            np.average(self.logits, axis=0))
+        np.testing.assert_allclose(
+            COMBINERS.weighted_mean(self.logits, [0, 2, 0, 0, 0]),
+            self.logits[1])
+
+    def test_majority_vote(self):
+        """ The majority class wins, ties go to the larger probability """
+        logits = np.array([[[3.0, 0, 0]], [[0, 1.0, 0]], [[0, 0, 1.0]],
+                           [[3.0, 0, 0]], [[0, 2.0, 0]]])
+        self.assertEqual(np.argmax(COMBINERS.majority_vote(logits), 1)[0], 0)
+        self.assertEqual(np.argmax(COMBINERS.majority_vote(logits[1:3]),
+                                   1)[0], 1)
+
+    def test_accuracies(self):
+        """ The batched scores equal the scores of each combination """
+        weights = COMBINERS.subset_weights(5)
+        self.assertEqual(len(weights), 31)
+        scores = COMBINERS.accuracies(self.logits, self.labels, weights,
+                                      chunk_size=7)
+        for row, score in zip(weights, scores):
+            combined = COMBINERS.weighted_mean(self.logits, row)
+            self.assertAlmostEqual(
+                np.mean(np.argmax(combined, 1) == self.labels), score)
+
+    def test_greedy_selection(self):
+        """ The selection starts with the best member and improves """
+        counts, history = COMBINERS.greedy_selection(self.logits,
+                                                     self.labels)
+        self.assertGreater(counts[0], 0)
+        self.assertEqual(len(history), np.sum(counts))
+        self.assertTrue(np.all(np.diff(history) > 0))
+        single = COMBINERS.accuracies(self.logits, self.labels, np.eye(5))
+        self.assertEqual(history[0], np.max(single))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+""" This module tests the evaluation_batches module. """
+import os
+import shutil
+import tempfile
+import unittest
+import importlib
+import numpy as np
+import nibabel as nb
+from settings import PROJECT
+EVALUATION = importlib.import_module(PROJECT + ".evaluation_batches")
+DATA_INPUT = importlib.import_module(PROJECT + ".data_input")
+
+
+class ListInput:
+    """ Input object whose images are the indices of the files """
+
+    def __init__(self, files):
+        self.files = files
+        self.num_classes = len(files)
+
+    def load_batch(self, batch_files, batch_classes, rng=None):
+        images = np.array([int(filename.split('_')[1])
+                           for filename in batch_files])
+        labels = np.zeros((len(batch_files), self.num_classes))
+        labels[np.arange(len(batch_files)), batch_classes] = 1
+        return batch_files, images, labels
+
+
+class Wrapper:
+    """ Stands for the prefetching wrapper of an input """
+
+    def __init__(self, data_input):
+        self.data_input = data_input
+
+    def __getattr__(self, name):
+        if name == 'data_input':
+            raise AttributeError(name)
+        return getattr(self.data_input, name)
+
+
+class TestEvaluationBatches(unittest.TestCase):
+    """ Test the evaluation iterator """
+
+    def setUp(self):
+        # An imbalanced input of 7 and 2 images
+        self.data_input = ListInput(
+            [['a_{0}'.format(i) for i in [4, 1, 6, 0, 5, 3, 2]],
+             ['b_7', 'b_8']])
+
+    def test_exactly_once(self):
+        """ Every image is read once, the last batch is padded """
+        batches = list(EVALUATION.evaluation_batches(self.data_input, 4))
+        self.assertEqual([batch[3] for batch in batches], [4, 4, 1])
+        for files, images, labels, _ in batches:
+            self.assertEqual(len(files), 4)
+            self.assertEqual(images.shape, (4,))
+        images = np.concatenate([images[:count] for _, images, _, count
+                                 in batches])
+        self.assertEqual(images.tolist(), list(range(0, 9)))
+        labels = np.concatenate([labels[:count] for _, _, labels, count
+                                 in batches])
+        self.assertEqual(np.argmax(labels, 1).tolist(), [0] * 7 + [1] * 2)
+        # The padding repeats the last image
+        self.assertEqual(batches[-1][0], ['b_8'] * 4)
+
+    def test_deterministic(self):
+        """ The order does not depend on the shuffled file lists """
+        first = [batch[0] for batch in
+                 EVALUATION.evaluation_batches(self.data_input, 5)]
+        self.data_input.files[0].reverse()
+        second = [batch[0] for batch in
+                  EVALUATION.evaluation_batches(Wrapper(self.data_input), 5)]
+        self.assertEqual(first, second)
+
+
+class TestTrainingInput(unittest.TestCase):
+    """ Evaluate an augmented training input """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        files = [[], []]
+        for index in range(0, 6):
+            filename = os.path.join(self.tmp, 'SUB{0}.nii.gz'.format(index))
+            nb.save(nb.Nifti1Image(rng.rand(9, 8, 7).astype(np.float32),
+                                   np.eye(4)), filename)
+            files[index % 2].append(filename)
+        self.params = {'cnn': {'batch_size': 2, 'depth': 9, 'height': 8,
+                               'width': 7, 'seed': 3,
+                               'augmentation': {'rotation': 10,
+                                                'translation': 2}}}
+        self.files = files
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def data_input(self):
+        return DATA_INPUT.DataInput(self.params, [list(class_files) for
+                                                  class_files in self.files],
+                                    'train')
+
+    def test_order_unchanged(self):
+        """ The next batch is the one of an input which was not evaluated """
+        evaluated = self.data_input()
+        evaluated.select_batch()
+        first = list(EVALUATION.evaluation_batches(evaluated, 4))
+        second = list(EVALUATION.evaluation_batches(evaluated, 4))
+        reference = self.data_input()
+        reference.select_batch()
+        self.assertEqual(evaluated.select_batch(), reference.select_batch())
+        self.assertIsNotNone(evaluated.augmentation)
+        # The images are not augmented and the same in every evaluation
+        for (_, images, _, count), (_, again, _, _) in zip(first, second):
+            np.testing.assert_array_equal(images, again)
+        image = np.asarray(nb.load(first[0][0][0]).dataobj)
+        np.testing.assert_array_equal(first[0][1][0, :, :, :, 0], image)
+
+
+if __name__ == '__main__':
+    unittest.main()
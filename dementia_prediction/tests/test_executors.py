@@ -0,0 +1,85 @@
+""" This module tests the preprocessing executors module. """
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import importlib
+import numpy as np
+import nibabel as nb
+from settings import PROJECT
+EXECUTORS = importlib.import_module(PROJECT + ".preprocessing.executors")
+SCHEDULER = importlib.import_module(PROJECT + ".preprocessing.scheduler")
+
+
+class TestSimulatedExecutor(unittest.TestCase):
+    """ Test the SimulatedExecutor class """
+
+    def setUp(self):
+        """ Write a bright cube in a dark image """
+        self.tmp = tempfile.mkdtemp()
+        image = np.ones((12, 12, 12), np.float32)
+        image[3:9, 3:9, 3:9] = 100
+        self.input = self.path('CON001-T1.nii.gz')
+        nb.save(nb.Nifti1Image(image, np.eye(4)), self.input)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def test_tools(self):
+        """ The simulated tools should write the outputs of FSL """
+        executor = EXECUTORS.SimulatedExecutor(scale=0)
+        brain = self.path('CON001-T1_brain.nii.gz')
+        self.assertEqual(executor.call('bet {0} {1} -B -f 0.3 -m -v'.format(
+            self.input, brain)), 0)
+        mask = nb.load(self.path('CON001-T1_brain_mask.nii.gz')).get_fdata()
+        self.assertEqual(mask.sum(), 6 ** 3)
+        self.assertEqual(executor.call(
+            'flirt -in {0} -ref {1} -out {2} -omat {3} -cost corratio'.format(
+                brain, self.input, self.path('aligned.nii.gz'),
+                self.path('aligned.mat'))), 0)
+        self.assertEqual(executor.call('fslmaths {0} -subsamp2 {1}'.format(
+            self.path('aligned.nii.gz'), self.path('sub.nii.gz'))), 0)
+        self.assertEqual(nb.load(self.path('sub.nii.gz')).shape, (6, 6, 6))
+        self.assertEqual(executor.call('makerot -c 6,6,6 -a 0,0,1 -t -90 '
+                                       '-o {0}'.format(self.path('rot.mat'))),
+                         0)
+        np.testing.assert_allclose(np.loadtxt(self.path('rot.mat'))[:2, :2],
+                                   [[0, 1], [-1, 0]], atol=1e-6)
+        self.assertEqual(executor.call('unknown_tool x'), 127)
+        self.assertEqual(executor.call('fslmaths {0} -bin {1}'.format(
+            self.input, self.path('bin.nii.gz'))), 1)
+
+    def test_cost_model(self):
+        """ Commands should take the time of the cost model """
+        executor = EXECUTORS.SimulatedExecutor(
+            costs={'cp': {'base': 0.2, 'per_mb': 0}}, timeout=0.5)
+        start = time.time()
+        executor.call('cp {0} {1}'.format(self.input, self.path('copy')))
+        self.assertGreaterEqual(time.time() - start, 0.2)
+        self.assertTrue(os.path.exists(self.path('copy')))
+        executor.costs['cp']['base'] = 1
+        self.assertIsNone(executor.call('cp {0} {1}'.format(
+            self.input, self.path('slow'))))
+        self.assertFalse(os.path.exists(self.path('slow')))
+
+    def test_scheduler(self):
+        """ Simulated commands should run in parallel on the scheduler """
+        scheduler = SCHEDULER.JobScheduler(
+            workers=4, executor={'type': 'simulated',
+                                 'costs': {'cp': {'base': 0.2}}})
+        for i in range(0, 4):
+            output = self.path('out' + str(i))
+            scheduler.submit('cp {0} {1}'.format(self.input, output),
+                             [output], i, inputs=[self.input])
+        start = time.time()
+        self.assertTrue(scheduler.run())
+        self.assertLess(time.time() - start, 0.6)
+        self.assertEqual(len(os.listdir(self.tmp)), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
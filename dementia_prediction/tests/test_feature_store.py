@@ -0,0 +1,213 @@
+""" This module tests the feature_store module. """
+import os
+import glob
+import shutil
+import tempfile
+import unittest
+import importlib
+from functools import partial
+import numpy as np
+import nibabel as nb
+from settings import PROJECT
+FEATURE_STORE = importlib.import_module(PROJECT + ".feature_store")
+COMBINERS = importlib.import_module(PROJECT + ".ensemble_combiners")
+MULTICHANNEL_INPUT = importlib.import_module(PROJECT + ".multichannel_input")
+FUSION_INPUT = importlib.import_module(PROJECT + ".fusion_input")
+
+
+class ListInput:
+    """ Input object whose images are the numbers in the file names """
+
+    def __init__(self, files, batch_size):
+        self.files = files
+        self.num_classes = len(files)
+        self.params = {'batch_size': batch_size}
+        self.augmentation = 'rotation'
+        self.loaded = []
+
+    def load_batch(self, batch_files, batch_classes, rng=None):
+        self.loaded.append(self.augmentation)
+        images = np.array([[float(os.path.basename(filename).split('_')[0])]
+                           for filename in batch_files])
+        return batch_files, images, None
+
+    def select_batch(self):
+        return self.files[1][:1] + self.files[0][:2], [1, 0, 0]
+
+
+class LayerOutputs:
+    """ Stands for CNNUtils, the features are the images times 10 """
+
+    def __init__(self, fail_after=None, store_dir=None):
+        self.calls = 0
+        self.fail_after = fail_after
+        self.store_dir = store_dir
+        self.written = []
+
+    def get_features(self, mode, meta_path, image_data, layer_path):
+        self.calls += 1
+        if self.store_dir is not None:
+            # The rows of the chunk being written
+            self.written += [np.load(path, mmap_mode='r')[:, 0].tolist()
+                             for path in glob.glob(os.path.join(
+                                 self.store_dir, '*', '*.tmp'))]
+        if self.calls == self.fail_after:
+            raise RuntimeError("session failed")
+        return image_data * 10
+
+
+class TestFeatureStore(unittest.TestCase):
+    """ Test the FeatureStore, FeatureSet and FeatureDataInput classes """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.meta_path = os.path.join(self.tmp, 'model.meta')
+        open(self.meta_path, 'w').close()
+        self.layers = [('T1', self.meta_path, 'conv/Relu:0', None)]
+        self.data_input = ListInput(
+            [[os.path.join(self.tmp, 'train', '{0}_T1.nii.gz'.format(i))
+              for i in [4, 1, 6, 0, 5]],
+             [os.path.join(self.tmp, 'train', '{0}_T1.nii.gz'.format(i))
+              for i in [3, 2]]], 2)
+        self.store = FEATURE_STORE.FeatureStore(
+            os.path.join(self.tmp, 'store'), chunk_size=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_chunks(self):
+        """ Every image is stored once in chunks and read from them """
+        layer_outputs = LayerOutputs()
+        feature_set, = self.store.extract(self.data_input, self.layers,
+                                          layer_outputs)
+        # 7 images in chunks of 3, batches of 2 within a chunk
+        self.assertEqual(feature_set.index['chunks'], 3)
+        self.assertEqual(layer_outputs.calls, 5)
+        self.assertEqual(set(self.data_input.loaded), {None})
+        self.assertEqual(self.data_input.augmentation, 'rotation')
+        keys = ['{0}_T1.nii.gz'.format(i) for i in [6, 0, 2, 5]]
+        np.testing.assert_array_equal(feature_set.get(keys),
+                                      [[60], [0], [20], [50]])
+        # Stored images are not extracted again
+        self.store.extract(self.data_input, self.layers, layer_outputs)
+        self.assertEqual(layer_outputs.calls, 5)
+
+    def test_checkpoint_change(self):
+        """ The features of an older checkpoint are extracted again """
+        self.store.extract(self.data_input, self.layers, LayerOutputs())
+        stat = os.stat(self.meta_path)
+        os.utime(self.meta_path, (stat.st_atime, stat.st_mtime + 10))
+        feature_set = FEATURE_STORE.FeatureSet(
+            self.store.store_dir, *self.layers[0][:3])
+        self.assertEqual(len(feature_set.missing(['4_T1.nii.gz'])), 1)
+        layer_outputs = LayerOutputs()
+        self.store.extract(self.data_input, self.layers, layer_outputs)
+        self.assertEqual(layer_outputs.calls, 5)
+
+    def test_failed_extraction(self):
+        """ The augmentation is restored if the extraction fails """
+        layer_outputs = LayerOutputs(fail_after=2,
+                                     store_dir=self.store.store_dir)
+        with self.assertRaises(RuntimeError):
+            self.store.extract(self.data_input, self.layers, layer_outputs)
+        self.assertEqual(self.data_input.augmentation, 'rotation')
+        # The first batch was in the chunk file, which is removed
+        self.assertEqual(layer_outputs.written, [[0, 10, 0]])
+        self.assertEqual(glob.glob(os.path.join(self.store.store_dir, '*',
+                                                '*')), [])
+
+    def test_subject_key(self):
+        """ Images of another folder are found by their file name """
+        feature_sets = self.store.extract(self.data_input, self.layers,
+                                          LayerOutputs())
+        feature_input = FEATURE_STORE.FeatureDataInput(self.data_input,
+                                                       feature_sets)
+        _, features, labels = feature_input.load_batch(
+            [os.path.join(self.tmp, 'other', '3_T1.nii.gz'),
+             os.path.join(self.tmp, 'train', '1_T1.nii.gz')], [1, 0])
+        np.testing.assert_array_equal(features, [[30], [10]])
+        np.testing.assert_array_equal(labels, [[0, 1], [1, 0]])
+        files, features, _ = feature_input.next_batch()
+        self.assertEqual(files, self.data_input.select_batch()[0])
+        np.testing.assert_array_equal(features, [[30], [40], [10]])
+        # Features of several layers are concatenated along the channels
+        feature_input = FEATURE_STORE.FeatureDataInput(self.data_input,
+                                                       feature_sets * 2)
+        _, features, _ = feature_input.next_batch()
+        np.testing.assert_array_equal(features, [[30, 30], [40, 40],
+                                                 [10, 10]])
+
+
+class ChannelMeans:
+    """ Stands for CNNUtils, the features are the channel means of the
+    images of a member """
+
+    def get_features(self, mode, meta_path, image_data, layer_path):
+        images = image_data if isinstance(image_data, list) else [image_data]
+        return np.concatenate([np.mean(np.reshape(
+            image, [len(image), -1, image.shape[-1]]), 1)
+                               for image in images], 1)
+
+
+class TestEnsembleMembers(unittest.TestCase):
+    """ Test the images of the ensemble members stored as in
+    CNNEnsembleModels.member_logits """
+
+    def setUp(self):
+        """ Subjects whose modality i has the value subject + 10 i """
+        self.tmp = tempfile.mkdtemp()
+        modalities = ['T1', 'T2', 'DTI']
+        self.params = {'cnn': {'batch_size': 2, 'depth': 2, 'height': 2,
+                               'width': 2, 'mode': modalities,
+                               'modality': modalities}}
+        for i, modality in enumerate(modalities):
+            folder = os.path.join(self.tmp, modality) + '/'
+            os.makedirs(folder)
+            self.params['mode_folder' + str(i + 1)] = folder
+            for subject in range(0, 3):
+                nb.save(nb.Nifti1Image(np.full((2, 2, 2), subject + 10.0 * i,
+                                               np.float32), np.eye(4)),
+                        folder + 'S{0}.nii.gz'.format(subject))
+        self.data = ([self.params['mode_folder1'] + 'S0.nii.gz',
+                      self.params['mode_folder1'] + 'S1.nii.gz'],
+                     [self.params['mode_folder1'] + 'S2.nii.gz'])
+        self.meta_path = os.path.join(self.tmp, 'model.meta')
+        open(self.meta_path, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def member_features(self, data_input, count):
+        """ Returns: the stored features of each member of the ensemble """
+        layers = [('M' + str(m), self.meta_path, 'logits:0',
+                   partial(COMBINERS.member_images, member=m, members=count))
+                  for m in range(0, count)]
+        store = FEATURE_STORE.FeatureStore(
+            os.path.join(self.tmp, 'store', str(count)), chunk_size=2)
+        feature_sets = store.extract(data_input, layers, ChannelMeans())
+        keys = ['S{0}.nii.gz'.format(subject) for subject in range(0, 3)]
+        return [feature_set.get(keys) for feature_set in feature_sets]
+
+    def test_multichannel(self):
+        """ All members see the channels of every image of the batch """
+        data_input = MULTICHANNEL_INPUT.MultichannelDataInput(
+            self.params, self.data, 'valid')
+        for features in self.member_features(data_input, 3):
+            np.testing.assert_array_equal(
+                features, [[0, 10, 20], [1, 11, 21], [2, 12, 22]])
+
+    def test_fusion(self):
+        """ Members see their modality, or all of them over epochs """
+        data_input = FUSION_INPUT.FusionDataInput(self.params, self.data,
+                                                  'valid')
+        for m, features in enumerate(self.member_features(data_input, 3)):
+            np.testing.assert_array_equal(features,
+                                          [[10 * m], [10 * m + 1],
+                                           [10 * m + 2]])
+        for features in self.member_features(data_input, 4):
+            np.testing.assert_array_equal(
+                features, [[0, 10, 20], [1, 11, 21], [2, 12, 22]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+""" This module tests the manifest module. """
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import importlib
+from settings import PROJECT
+MANIFEST = importlib.import_module(PROJECT + ".manifest")
+
+
+class TestManifest(unittest.TestCase):
+    """ Test the Manifest class and load_patients """
+
+    def setUp(self):
+        """ Prepare a manifest with two folds """
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'manifest.db')
+        self.labels = {'CON001': 0, 'CON002': 1, 'CON003': 0}
+        manifest = MANIFEST.Manifest(self.path)
+        manifest.add_subjects('UHG', self.labels, {'CON001': 'scanner1'})
+        manifest.add_split('UHG', 1, 'train', ['CON002', 'CON001'])
+        manifest.add_split('UHG', 1, 'valid', ['CON003'])
+        manifest.add_split('UHG', 2, 'train', ['CON003'])
+        manifest.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_queries(self):
+        """ Labels, scanners, splits and folds should be read back """
+        manifest = MANIFEST.Manifest(self.path)
+        self.assertEqual(manifest.labels('UHG'), self.labels)
+        self.assertEqual(manifest.scanners('UHG'), {'CON001': 'scanner1'})
+        self.assertEqual(list(manifest.split('UHG', 1, 'train')),
+                         ['CON002', 'CON001'])
+        self.assertEqual(manifest.split('UHG', 1, 'valid'), {'CON003': 0})
+        self.assertEqual(manifest.folds('UHG'), [1, 2])
+        self.assertEqual(manifest.labels('ADNI'), {})
+        manifest.close()
+
+    def test_load_patients(self):
+        """ The manifest should replace the pickle dictionaries """
+        pickle_path = os.path.join(self.tmp, 'patients.pkl')
+        with open(pickle_path, 'wb') as filep:
+            pickle.dump(self.labels, filep)
+        self.assertEqual(MANIFEST.load_patients(
+            {'class_labels': pickle_path}, 'class_labels'), self.labels)
+        params = {'manifest': self.path, 'dataset': 'UHG', 'fold': '2'}
+        self.assertEqual(MANIFEST.load_patients(params, 'class_labels'),
+                         self.labels)
+        self.assertEqual(MANIFEST.load_patients(params, 'train_data',
+                                                'train'), {'CON003': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+""" This module tests the native preprocessing module. """
+import os
+import shutil
+import tempfile
+import unittest
+import importlib
+import numpy as np
+import nibabel as nb
+from settings import PROJECT
+NATIVE = importlib.import_module(PROJECT + ".preprocessing.native")
+
+
+class TestNative(unittest.TestCase):
+    """ Test the NumPy versions of the fslmaths operations """
+
+    def setUp(self):
+        """ Prepare images with 2mm voxels """
+        self.tmp = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.affine = np.diag([2., 2., 2., 1.])
+        self.files = []
+        for i in range(0, 3):
+            filename = os.path.join(self.tmp, 'image' + str(i) + '.nii.gz')
+            nb.save(nb.Nifti1Image(rng.rand(9, 8, 7).astype(np.float32),
+                                   self.affine), filename)
+            self.files.append(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def data(self, filename):
+        return np.asarray(nb.load(filename).dataobj)
+
+    def test_smoothing(self):
+        """ A constant image should stay constant away from the border """
+        output = os.path.join(self.tmp, 'smoothed.nii.gz')
+        constant = os.path.join(self.tmp, 'constant.nii.gz')
+        nb.save(nb.Nifti1Image(np.ones((9, 9, 9), np.float32), self.affine),
+                constant)
+        NATIVE.gaussian_smoothing(constant, output, 2)
+        # A 2mm sigma is one voxel, the centre is unaffected by the border
+        self.assertAlmostEqual(float(self.data(output)[4, 4, 4]), 1, 3)
+
+    def test_subsample(self):
+        """ Subsampling should halve the shape and double the voxel size """
+        output = os.path.join(self.tmp, 'subsampled.nii.gz')
+        NATIVE.subsample(self.files[0], output)
+        image = nb.load(output)
+        self.assertEqual(image.shape, (5, 4, 4))
+        np.testing.assert_allclose(image.header.get_zooms(), (4, 4, 4))
+        data = self.data(self.files[0])
+        expected = np.einsum('i,j,k,ijk', NATIVE.SUBSAMPLE_KERNEL,
+                             NATIVE.SUBSAMPLE_KERNEL, NATIVE.SUBSAMPLE_KERNEL,
+                             data[1:4, 1:4, 1:4])
+        self.assertAlmostEqual(float(image.get_fdata()[1, 1, 1]),
+                               float(expected), 5)
+
+    def test_average(self):
+        """ The running sum should match the mean of the images """
+        output = os.path.join(self.tmp, 'average.nii.gz')
+        NATIVE.average(self.files, output, workers=2)
+        expected = np.mean([self.data(filename) for filename in self.files],
+                           axis=0)
+        np.testing.assert_allclose(self.data(output), expected, rtol=1e-6)
+
+    def test_tensor_fitting(self):
+        """ Noiseless signals should give back the tensors of the mask """
+        rng = np.random.RandomState(1)
+        bvecs = rng.randn(3, 12)
+        bvecs /= np.linalg.norm(bvecs, axis=0)
+        bvecs = np.concatenate([np.zeros((3, 1)), bvecs], axis=1)
+        bvals = np.concatenate([[0], np.full(12, 1000.0)])
+        tensor = np.diag([1.7e-3, 0.3e-3, 0.3e-3])
+        coefficients = [np.log(500), 1.7e-3, 0.3e-3, 0.3e-3, 0, 0, 0]
+        signal = np.exp(NATIVE.tensor_design(bvals, bvecs).dot(coefficients))
+        dwi = np.tile(signal, (4, 3, 2, 1)).astype(np.float32)
+        mask = np.ones((4, 3, 2), np.float32)
+        mask[0] = 0
+        base = os.path.join(self.tmp, 'CON001-DTI')
+        dwi_image = nb.Nifti1Image(dwi, self.affine)
+        dwi_image.header.set_xyzt_units('mm', 'sec')
+        dwi_image.header['descrip'] = b'DWI series'
+        nb.save(dwi_image, base + '.nii.gz')
+        nb.save(nb.Nifti1Image(mask, self.affine), base + '_mask.nii.gz')
+        np.savetxt(base + '.bval', bvals[None])
+        np.savetxt(base + '.bvec', bvecs)
+        NATIVE.tensor_fitting(base + '.nii.gz', base, base + '_mask.nii.gz',
+                              base + '.bvec', base + '.bval', chunk_size=5)
+        eigenvalues = np.diag(tensor)
+        expected_fa = np.sqrt(1.5) * np.linalg.norm(
+            eigenvalues - eigenvalues.mean()) / np.linalg.norm(eigenvalues)
+        fa_map = self.data(base + '_FA.nii.gz')
+        np.testing.assert_allclose(fa_map[1:], expected_fa, rtol=1e-4)
+        self.assertTrue(np.all(fa_map[0] == 0))
+        np.testing.assert_allclose(self.data(base + '_MD.nii.gz')[1:],
+                                   eigenvalues.mean(), rtol=1e-4)
+        np.testing.assert_allclose(
+            np.abs(self.data(base + '_V1.nii.gz')[1:, :, :, 0]), 1, rtol=1e-4)
+        # The maps keep the header of the series
+        for name, shape in [('FA', (4, 3, 2)), ('V1', (4, 3, 2, 3))]:
+            header = nb.load(base + '_' + name + '.nii.gz').header
+            self.assertEqual(header.get_data_shape(), shape)
+            self.assertEqual(header.get_data_dtype(), np.float32)
+            self.assertEqual(header.get_xyzt_units(), ('mm', 'sec'))
+            self.assertEqual(header['descrip'], b'DWI series')
+
+    def test_asl_subtraction(self):
+        """ Control minus tag of each pair and their mean """
+        series = np.zeros((4, 3, 2, 6), np.float32)
+        series[..., 0::2] = 10
+        series[..., 1::2] = 10 + np.arange(1, 4)
+        filename = os.path.join(self.tmp, 'CON001-ASL.nii.gz')
+        nb.save(nb.Nifti1Image(series, self.affine), filename)
+        diff = os.path.join(self.tmp, 'CON001-ASL_single_diff.nii.gz')
+        mean = os.path.join(self.tmp, 'CON001-ASL_single_diff_mean.nii.gz')
+        NATIVE.asl_subtraction(filename, diff, mean)
+        self.assertEqual(self.data(diff).shape, (4, 3, 2, 3))
+        np.testing.assert_allclose(self.data(diff)[1, 1, 1], [1, 2, 3])
+        np.testing.assert_allclose(self.data(mean), 2)
+        nb.save(nb.Nifti1Image(series[..., :5], self.affine), filename)
+        with self.assertRaises(ValueError):
+            NATIVE.asl_subtraction(filename, diff, mean)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+""" This module tests the normalize module. """
+import os
+import shutil
+import tempfile
+import unittest
+import importlib
+import numpy as np
+from settings import PROJECT
+NORMALIZE = importlib.import_module(PROJECT + ".normalize")
+VOXEL_STATISTICS = importlib.import_module(PROJECT + ".voxel_statistics")
+
+
+class TestNormalize(unittest.TestCase):
+    """ Test the stored statistics of the Normalize class """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        params = {'img_size': 60, 'mode': 'T1',
+                  'norm_mean_var': os.path.join(self.tmp, '')}
+        self.normalize = NORMALIZE.Normalize(params, {}, {})
+        # The images are not read if the statistics cover them
+        self.files = [os.path.join(self.tmp, 'missing' + str(i))
+                      for i in range(0, 5)]
+        rng = np.random.RandomState(0)
+        self.mean = rng.rand(60)
+        self.std = rng.rand(60)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_legacy_statistics(self):
+        """ Statistics without a saved state seed the accumulator """
+        np.save(self.normalize.mean_path, self.mean)
+        np.save(self.normalize.var_path, self.std)
+        mean, std = self.normalize.normalize(self.files)
+        np.testing.assert_allclose(mean, self.mean)
+        np.testing.assert_allclose(std, self.std)
+        stats = VOXEL_STATISTICS.VoxelStatistics.load(
+            self.normalize.stats_path)
+        self.assertEqual(stats.files, self.files)
+        np.testing.assert_allclose(stats.std(), self.std)
+
+    def test_missing_statistics(self):
+        """ Deleted mean and std files are written from the saved state """
+        VOXEL_STATISTICS.VoxelStatistics.from_std(
+            self.mean, self.std, self.files).save(self.normalize.stats_path)
+        mean, std = self.normalize.normalize(self.files)
+        np.testing.assert_allclose(mean, self.mean)
+        np.testing.assert_allclose(std, self.std)
+        self.assertTrue(os.path.exists(self.normalize.var_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+""" This module tests the robust_fisher_class and robust_fisher_parallel
+modules. """
+import os
+import sys
+import pickle
+import shutil
+import tempfile
+import unittest
+import importlib
+import subprocess
+import yaml
+import numpy as np
+import nibabel as nb
+import scipy.stats as sc
+from skimage import util
+from settings import PROJECT
+ROBUST_FISHER = importlib.import_module(
+    PROJECT + ".classical.feature_generation.robust_fisher_class")
+
+
+def voxel_windows(image, params):
+    """ Yields the window values of each voxel as the per-voxel loop did """
+    padded = util.pad(image, params['pad'], 'constant')
+    patch_size = params['patch_size']
+    windows = util.view_as_windows(padded,
+                                   window_shape=(patch_size, patch_size, 1))
+    for i in range(0, params['depth']):
+        for j in range(0, params['height']):
+            for k in range(1, params['width'] + 1):
+                yield np.reshape(windows[i, j, k], -1).tolist()
+
+
+def loop_fisher(images, labels, params):
+    """
+    Returns: the statistics of the robust Fisher score computed voxel by
+    voxel with np.histogram and scipy.stats.entropy
+    """
+    size = params['depth'] * params['height'] * params['width']
+    min_patient = [sys.maxsize] * size
+    max_patient = [-sys.maxsize] * size
+    for image in images:
+        for ctr, arr in enumerate(voxel_windows(image, params)):
+            max_patient[ctr] = max(max_patient[ctr], np.max(arr))
+            min_patient[ctr] = min(min_patient[ctr], np.min(arr))
+    bins = [[0] if low == 0 or low == high else
+            np.linspace(low, high, params['num_bins'] + 1)
+            for low, high in zip(min_patient, max_patient)]
+    prob = {1: np.zeros((size, params['num_bins'])),
+            0: np.zeros((size, params['num_bins']))}
+    for image, label in zip(images, labels):
+        for ctr, arr in enumerate(voxel_windows(image, params)):
+            if len(bins[ctr]) != 1:
+                values, _ = np.histogram(arr, bins[ctr])
+                prob[label][ctr] += values / len(arr)
+    valid = np.array([len(bins_) != 1 for bins_ in bins])
+    mean = {}
+    for label in [0, 1]:
+        mean[label] = prob[label] / labels.count(label)
+        mean[label][(mean[label] == 0) & valid[:, None]] = params['epsilon']
+    std = {1: np.zeros(size), 0: np.zeros(size)}
+    for image, label in zip(images, labels):
+        for ctr, arr in enumerate(voxel_windows(image, params)):
+            if len(bins[ctr]) != 1:
+                values, _ = np.histogram(arr, bins[ctr])
+                std[label][ctr] += sc.entropy(values / len(arr),
+                                              mean[label][ctr])
+    numerator = np.zeros(size)
+    score = np.zeros(size)
+    for ctr in range(0, size):
+        if valid[ctr]:
+            numerator[ctr] = sc.entropy(mean[1][ctr], mean[0][ctr]) + \
+                sc.entropy(mean[0][ctr], mean[1][ctr])
+        denominator = std[1][ctr] + std[0][ctr]
+        if denominator != 0:
+            score[ctr] = numerator[ctr] / denominator
+    return {'min': min_patient, 'max': max_patient, 'valid': valid,
+            'prob': prob, 'mean': mean, 'std': std, 'numerator': numerator,
+            'score': score}
+
+
+class Cohort(unittest.TestCase):
+    """ Base class of the tests on a synthetic cohort """
+
+    def setUp(self):
+        """ Write a small cohort of images with a brighter class """
+        self.tmp = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.params = {'patch_size': 3, 'num_bins': 5, 'pad': 1,
+                       'epsilon': 0.00001, 'depth': 6, 'height': 5,
+                       'width': 4, 'split_on': '_T1.nii.gz',
+                       'patient_dict': os.path.join(self.tmp, 'labels.pkl')}
+        self.images = []
+        self.labels = []
+        self.files = []
+        for index in range(0, 6):
+            label = index % 2
+            image = rng.rand(6, 5, 4) + 1 + 0.3 * label
+            # Zero voxels have no bins
+            image[0, 0, :] = 0
+            self.images.append(image)
+            self.labels.append(label)
+            self.files.append(os.path.join(
+                self.tmp, 'SUB{0}_T1.nii.gz'.format(index)))
+            nb.save(nb.Nifti1Image(image, np.eye(4)), self.files[-1])
+        with open(self.params['patient_dict'], 'wb') as filep:
+            pickle.dump({'SUB' + str(index): label for index, label
+                         in enumerate(self.labels)}, filep)
+        self.expected = loop_fisher(self.images, self.labels, self.params)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+class TestRobustFisher(Cohort):
+    """ Test the vectorized statistics against the per-voxel loop """
+
+    def test_loop_equivalence(self):
+        """ Min, max, histograms, deviations and scores equal the loop """
+        robust = ROBUST_FISHER.RobustFisher(self.params)
+        min_patient, max_patient = robust.min_max(self.files)
+        np.testing.assert_array_equal(min_patient, self.expected['min'])
+        np.testing.assert_array_equal(max_patient, self.expected['max'])
+        robust.valid, robust.edges = robust.bins(min_patient, max_patient)
+        np.testing.assert_array_equal(robust.valid, self.expected['valid'])
+        self.assertTrue(0 < np.count_nonzero(robust.valid) <
+                        len(robust.valid))
+        prob_progressive, prob_stable = robust.histogram_dist(self.files)
+        np.testing.assert_array_equal(
+            prob_progressive, self.expected['prob'][1].astype(np.float32))
+        np.testing.assert_array_equal(
+            prob_stable, self.expected['prob'][0].astype(np.float32))
+        robust.mean_progressive = self.expected['mean'][1]
+        robust.mean_stable = self.expected['mean'][0]
+        std_progressive, std_stable = robust.std_dev(self.files)
+        np.testing.assert_array_equal(std_progressive, self.expected['std'][1])
+        np.testing.assert_array_equal(std_stable, self.expected['std'][0])
+        np.testing.assert_array_equal(
+            robust.fisher_score(std_progressive, std_stable),
+            self.expected['score'])
+
+
+class TestRobustFisherParallel(Cohort):
+    """ Test the stages of the robust_fisher_parallel script """
+
+    def run_script(self, resume):
+        """ Runs the script on the cohort, resuming finished stages """
+        params = dict(self.params, resume=resume, datadir=self.tmp,
+                      regex=r'_T1\.nii\.gz',
+                      train_dict=os.path.join(self.tmp, 'train.pkl'),
+                      valid_dict=os.path.join(self.tmp, 'valid.pkl'))
+        params['features_path'] = os.path.join(self.tmp, 'features.pkl')
+        for stage in ['min', 'max', 'bin', 'mean_prog', 'mean_stab',
+                      'std_prog', 'std_stab']:
+            params[stage + '_path'] = os.path.join(self.tmp, stage + '.npy')
+        shutil.copy(params['patient_dict'], params['train_dict'])
+        with open(params['valid_dict'], 'wb') as filep:
+            pickle.dump({}, filep)
+        paramfile = os.path.join(self.tmp, 'params.yaml')
+        with open(paramfile, 'w') as filep:
+            yaml.dump({'parameters': params}, filep)
+        # The script imports feature_generation from the classical folder
+        root = os.path.dirname(os.path.dirname(ROBUST_FISHER.__file__))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            [root, os.path.dirname(os.path.dirname(root))] +
+            os.environ.get('PYTHONPATH', '').split(os.pathsep)))
+        process = subprocess.run(
+            [sys.executable, os.path.join(root, 'feature_generation',
+                                          'robust_fisher_parallel.py'),
+             paramfile], cwd=root, env=env, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, universal_newlines=True)
+        self.assertEqual(process.returncode, 0, process.stdout)
+        with open(params['features_path'], 'rb') as filep:
+            return params, np.array(pickle.load(filep))
+
+    def test_stages(self):
+        """ Dense float32 state, merged scores and resumed stages """
+        params, scores = self.run_script('False')
+        size = len(self.expected['valid'])
+        valid = self.expected['valid']
+        for key, label in [('mean_prog_path', 1), ('mean_stab_path', 0)]:
+            mean = np.load(params[key])
+            self.assertEqual((mean.dtype, mean.shape),
+                             (np.float32, (size, self.params['num_bins'])))
+            self.assertFalse(mean[~valid].any())
+            np.testing.assert_allclose(mean[valid],
+                                       self.expected['mean'][label][valid],
+                                       rtol=1e-6)
+        self.assertEqual(np.load(params['bin_path']).shape,
+                         (size, self.params['num_bins'] + 1))
+        # Deviations averaged over the 3 images of each class
+        denominator = (self.expected['std'][1] + self.expected['std'][0]) / 3
+        expected = np.zeros(size)
+        expected[denominator != 0] = self.expected['numerator'][
+            denominator != 0] / denominator[denominator != 0]
+        np.testing.assert_array_equal(scores == 0, expected == 0)
+        np.testing.assert_allclose(scores, expected, rtol=1e-5)
+        # Without the images, all stages must be loaded from their results
+        std_progressive = np.load(params['std_prog_path']) * 2
+        np.save(params['std_prog_path'], std_progressive)
+        for filename in self.files:
+            os.remove(filename)
+        params, resumed = self.run_script('True')
+        robust = ROBUST_FISHER.RobustFisher(params)
+        robust.valid, robust.edges = robust.bins(np.load(params['min_path']),
+                                                 np.load(params['max_path']))
+        robust.mean_progressive = np.load(params['mean_prog_path'])
+        robust.mean_stable = np.load(params['mean_stab_path'])
+        np.testing.assert_array_equal(resumed, robust.fisher_score(
+            std_progressive, np.load(params['std_stab_path'])))
+
+
+if __name__ == '__main__':
+    unittest.main()
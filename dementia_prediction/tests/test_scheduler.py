@@ -0,0 +1,138 @@
+""" This module tests the preprocessing scheduler module. """
+import os
+import json
+import time
+import functools
+import shutil
+import tempfile
+import unittest
+import importlib
+from settings import PROJECT
+SCHEDULER = importlib.import_module(PROJECT + ".preprocessing.scheduler")
+
+
+def touch(filename):
+    """ Create an empty file """
+    open(filename, 'w').close()
+
+
+class TestJobScheduler(unittest.TestCase):
+    """ Test the JobScheduler class """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def test_parallel_limits(self):
+        """ Commands of a limited tool should not overlap """
+        scheduler = SCHEDULER.JobScheduler(workers=4, limits={'sh': 1})
+        for i in range(0, 4):
+            output = self.path('out' + str(i))
+            scheduler.submit(
+                "sh -c 'test ! -e {0} && touch {0} && sleep 0.05 && "
+                "rm {0} && touch {1}'".format(self.path('lock'), output),
+                [output], i)
+        self.assertTrue(scheduler.run())
+        self.assertEqual(len(os.listdir(self.tmp)), 4)
+
+    def test_native_limits(self):
+        """ Native jobs should count towards the limit of their tool """
+        scheduler = SCHEDULER.JobScheduler(workers=4, limits={'fslmaths': 1})
+        running = []
+        overlaps = []
+
+        def smooth(output):
+            running.append(output)
+            overlaps.append(len(running))
+            time.sleep(0.05)
+            running.remove(output)
+            open(output, 'w').close()
+
+        for i in range(0, 4):
+            output = self.path('out' + str(i))
+            scheduler.submit('native_fslmaths {0} -s 2'.format(output),
+                             [output], i,
+                             function=functools.partial(smooth, output))
+        self.assertTrue(scheduler.run())
+        self.assertEqual(max(overlaps), 1)
+
+    def test_retries_and_timeout(self):
+        """ Failed commands should be retried and timeouts killed """
+        counter = self.path('counter')
+        output = self.path('out')
+        scheduler = SCHEDULER.JobScheduler(retries=2, timeout=1)
+        scheduler.submit("echo x >> {0}; test $(wc -l < {0}) -ge 2 && "
+                         "touch {1}".format(counter, output), [output])
+        scheduler.submit("sleep 10; touch {0}".format(self.path('slow')),
+                         [self.path('slow')])
+        self.assertFalse(scheduler.run())
+        self.assertTrue(os.path.exists(output))
+        self.assertFalse(os.path.exists(self.path('slow')))
+
+    def test_resume(self):
+        """ Outputs of interrupted commands should be pending """
+        output = self.path('out')
+        open(output, 'w').close()
+        state = self.path('state.json')
+        with open(state, 'w') as filep:
+            json.dump({'bet in out': [output]}, filep)
+        scheduler = SCHEDULER.JobScheduler(state=state)
+        self.assertTrue(scheduler.pending([output]))
+        self.assertFalse(SCHEDULER.JobScheduler().pending([output]))
+        scheduler.submit('true', [output])
+        scheduler.run()
+        self.assertTrue(SCHEDULER.JobScheduler(state=state).pending([output]))
+
+    def test_throttled_saves(self):
+        """ The build record should be saved once per interval and run """
+        record = self.path('record.json')
+        scheduler = SCHEDULER.JobScheduler(workers=4, record=record,
+                                           state=self.path('state.json'),
+                                           save_interval=3600)
+        saves = []
+        save = scheduler.record.save
+        scheduler.record.save = lambda: saves.append(save())
+        outputs = [self.path('out' + str(i)) for i in range(0, 50)]
+        for output in outputs:
+            scheduler.submit('touch ' + output, [output],
+                             function=functools.partial(touch, output))
+        self.assertTrue(scheduler.run())
+        self.assertEqual(len(saves), 1)
+        self.assertEqual(sorted(json.load(open(record))['outputs']),
+                         sorted(outputs))
+        self.assertEqual(json.load(open(self.path('state.json'))), {})
+
+    def test_profile(self):
+        """ Every command should be recorded with its resources """
+        source = self.path('in')
+        with open(source, 'w') as filep:
+            filep.write('x' * 1000)
+        profile = self.path('profile.json')
+        scheduler = SCHEDULER.JobScheduler(workers=2, profile=profile)
+        for i in range(0, 2):
+            output = self.path('out' + str(i))
+            scheduler.submit("python -c 'sum(range(3000000))' && cp {0} {1}"
+                             .format(source, output), [output], i,
+                             inputs=[source])
+        self.assertTrue(scheduler.run('copy'))
+        records = json.load(open(profile))
+        self.assertEqual(len(records['commands']), 2)
+        for record in records['commands']:
+            self.assertEqual(record['stage'], 'copy')
+            self.assertTrue(record['success'])
+            self.assertGreater(record['cpu'], 0)
+            self.assertGreater(record['max_rss_mb'], 0)
+            self.assertEqual(record['bytes_read'], 1000)
+            self.assertEqual(record['bytes_written'], 1000)
+        self.assertEqual(records['stages'][0]['commands'], 2)
+        self.assertTrue(os.path.exists(self.path('profile.csv')))
+        self.assertIn('copy', scheduler.profile.summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
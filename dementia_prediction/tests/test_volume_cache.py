@@ -0,0 +1,62 @@
+""" This module tests the volume_cache module. """
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import importlib
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import nibabel as nb
+from settings import PROJECT
+CACHE = importlib.import_module(PROJECT + ".volume_cache")
+
+
+class TestVolumeCache(unittest.TestCase):
+    """ Test the VolumeCache class """
+
+    def setUp(self):
+        """ Write small images of distinct values """
+        self.tmp = tempfile.mkdtemp()
+        self.files = []
+        for index in range(0, 64):
+            filename = os.path.join(self.tmp, 'SUB{0:03d}.nii.gz'.format(
+                index))
+            nb.save(nb.Nifti1Image(np.full((6, 7, 5), index, np.float32),
+                                   np.eye(4)), filename)
+            self.files.append(filename)
+        self.cache_dir = os.path.join(self.tmp, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_concurrent_load(self):
+        """ Threads convert new images at the same time """
+        cache = CACHE.VolumeCache(self.cache_dir)
+        pool = ThreadPool(8)
+        try:
+            images = pool.map(cache.load, self.files)
+        finally:
+            pool.terminate()
+        for index, image in enumerate(images):
+            self.assertEqual(image.shape, (6, 7, 5))
+            self.assertTrue(np.all(image == index))
+        # The saved index lists every image and no temporary file is left
+        with open(os.path.join(self.cache_dir, 'index.pkl'), 'rb') as filep:
+            self.assertEqual(sorted(pickle.load(filep)), self.files)
+        self.assertEqual([name for name in os.listdir(self.cache_dir)
+                          if name.endswith('.tmp')], [])
+
+    def test_changed_source(self):
+        """ A rewritten image is converted again """
+        cache = CACHE.VolumeCache(self.cache_dir)
+        self.assertEqual(cache.load(self.files[0])[0, 0, 0], 0)
+        nb.save(nb.Nifti1Image(np.full((6, 7, 5), 9, np.float32),
+                               np.eye(4)), self.files[0])
+        os.utime(self.files[0], (1, 1))
+        cache = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(cache.load(self.files[0])[0, 0, 0], 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+""" This module tests the voxel_statistics module. """
+import os
+import tempfile
+import unittest
+import importlib
+import numpy as np
+from settings import PROJECT
+VOXEL_STATISTICS = importlib.import_module(PROJECT + ".voxel_statistics")
+STATS = VOXEL_STATISTICS.VoxelStatistics
+
+
+class TestVoxelStatistics(unittest.TestCase):
+    """ Test the VoxelStatistics class """
+
+    def setUp(self):
+        """ Prepare random images with a large offset """
+        rng = np.random.RandomState(0)
+        self.images = rng.rand(11, 4, 5, 3).astype(np.float32) * 50 + 1000
+        self.files = ['image' + str(i) for i in range(len(self.images))]
+
+    def accumulate(self, indices):
+        """ Accumulate the images with the given indices """
+        stats = STATS(60)
+        for i in indices:
+            stats.update(self.images[i], self.files[i])
+        return stats
+
+    def test_two_pass_equivalence(self):
+        """ Single pass statistics should match the two-pass result """
+        stats = self.accumulate(range(len(self.images)))
+        flat = self.images.reshape(len(self.images), -1).astype(np.float64)
+        np.testing.assert_allclose(stats.mean, flat.mean(axis=0))
+        np.testing.assert_allclose(stats.std(), flat.std(axis=0, ddof=1))
+
+    def test_merge(self):
+        """ Merging partial accumulators should match a single one """
+        full = self.accumulate(range(len(self.images)))
+        merged = STATS(60)
+        for split in [range(0, 4), range(4, 4), range(4, 11)]:
+            merged.merge(self.accumulate(split))
+        self.assertEqual(merged.count, full.count)
+        self.assertEqual(merged.files, full.files)
+        np.testing.assert_allclose(merged.mean, full.mean)
+        np.testing.assert_allclose(merged.m2, full.m2)
+
+    def test_from_std(self):
+        """ An accumulator seeded with mean and std should merge as one """
+        part = self.accumulate(range(0, 6))
+        seeded = STATS.from_std(part.mean, part.std(), self.files[:6])
+        seeded.merge(self.accumulate(range(6, 11)))
+        full = self.accumulate(range(len(self.images)))
+        self.assertEqual(seeded.files, full.files)
+        np.testing.assert_allclose(seeded.mean, full.mean)
+        np.testing.assert_allclose(seeded.std(), full.std())
+
+    def test_resume(self):
+        """ A saved state should only require the newly added images """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'stats.npz')
+            self.accumulate(range(0, 6)).save(path)
+            stats, new_files = STATS.resume(path, 60, self.files)
+            self.assertEqual(stats.count, 6)
+            self.assertEqual(new_files, self.files[6:])
+
+            # Removed images invalidate the saved state
+            stats, new_files = STATS.resume(path, 60, self.files[1:])
+            self.assertEqual(stats.count, 0)
+            self.assertEqual(new_files, self.files[1:])
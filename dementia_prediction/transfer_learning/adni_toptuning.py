@@ -5,6 +5,8 @@ import tensorflow as tf
 import numpy as np
 import sys
 from dementia_prediction.cnn_utils import CNNUtils
+from dementia_prediction.feature_store import FeatureStore, FeatureDataInput
+from dementia_prediction.dataset_input import DatasetInput, placeholder
 
 class TransferToptune:
     """
@@ -30,6 +32,34 @@ class TransferToptune:
                             name=scope.name)
         return logits
 
+    def feature_layers(self):
+        """
+        Returns: (mode, meta_path, layer_path, index) of the frozen layer
+        """
+        layer_path = ''
+        if self.param['transfer'] == 'fullcn':
+            layer_path = 'TrainADNI_T1/ADNI_T1fullcn2/ADNI_T1fullcn2:0'
+        elif self.param['transfer'] == 'conv1':
+            layer_path = 'conv1'
+        return [("ADNI_T1", self.param['meta_path'], layer_path, None)]
+
+    def transfer_features(self, dataset, batch=None):
+        """
+        Returns: (patients, features, labels) of the next batch, or of the
+        given batch read from the dataset, with the output of the frozen
+        layer as features
+        """
+        if batch is None:
+            batch = dataset.next_batch()
+        if isinstance(dataset, FeatureDataInput):
+            # Features of the frozen layer are read from the feature store
+            return batch
+        patients, image_data, label_data = batch
+        mode, meta_path, layer_path, _ = self.feature_layers()[0]
+        features_images = self.cnnutils.get_features(mode, meta_path,
+                                                     image_data, layer_path)
+        return patients, features_images, label_data
+
     def evaluation(self, sess, eval_op, dataset, images, transfer_input,
                    labels, keep_prob, loss, xloss, l2loss, corr):
         """
@@ -48,39 +78,23 @@ class TransferToptune:
         correct_predictions = 0
         total_seen = 0
         pred_out = {}
-        class_max_size = 0
-        data_size = 0
-        for i in range(0, len(dataset.files)):
-            data_size += len(dataset.files[i])
-            if len(dataset.files[i]) > class_max_size:
-                class_max_size = len(dataset.files[i])
-        num_steps = int(class_max_size / (self.param['batch_size']/len(dataset.files)))
-        if class_max_size%(self.param['batch_size']/len(dataset.files)) != 0:
-            num_steps += 1
-        print("Num steps:", num_steps, "Data size:", data_size)
-        for step in range(num_steps):
-            patients, image_data, label_data = dataset.next_batch()
-            layer_path = ''
-            if self.param['transfer'] == 'fullcn':
-                layer_path = 'TrainADNI_T1/ADNI_T1fullcn2/ADNI_T1fullcn2:0'
-            elif self.param['transfer'] == 'conv1':
-                layer_path = 'conv1'
-            features_images = self.cnnutils.get_features("ADNI_T1",
-                                                         self.param[
-                                                             'meta_path'],
-                                                         image_data,
-                                                         layer_path)
-            predictions, correct_, loss_, xloss_, l2loss_ = \
-                sess.run([eval_op, corr, loss, xloss, l2loss],
+        for batch in self.cnnutils.eval_batches(dataset):
+            count = batch[-1]
+            patients, features_images, label_data = \
+                self.transfer_features(dataset, batch[:-1])
+            correct_, loss_, xloss_, l2loss_ = \
+                sess.run([corr, loss, xloss, l2loss],
                 feed_dict={
                     transfer_input: features_images,
                     labels: label_data,
                     keep_prob: 1.0
                 })
+            # The padding of the last batch is not counted
+            correct_ = correct_[:count]
             print("Prediction:", correct_)
-            correct_predictions += predictions
-            pred_out.update(dict(zip(patients, correct_)))
-            total_seen += self.param['batch_size']
+            correct_predictions += np.sum(correct_)
+            pred_out.update(dict(zip(patients[:count], correct_)))
+            total_seen += count
             print("Accuracy until "+str(total_seen)+" data points is: " +
                       str(correct_predictions/total_seen))
             print("loss", loss_)
@@ -105,7 +119,30 @@ class TransferToptune:
             test: Test the final model on the validation data
         """
         mode = self.param['mode']
+        store = FeatureStore.from_params(self.param)
+        if store is not None:
+            train_data = store.data_input(train_data, self.feature_layers(),
+                                          self.cnnutils)
+            validation_data = store.data_input(validation_data,
+                                               self.feature_layers(),
+                                               self.cnnutils)
+        # The tf.data pipeline reads the stored features, the frozen model
+        # can not run in its calls
+        dataset = None
+        if isinstance(train_data, FeatureDataInput):
+            dataset = DatasetInput.from_params(self.param, train_data)
+        elif self.param.get('dataset'):
+            print("The dataset input requires the feature_store, feeding the "
+                  "batches", flush=True)
         with tf.Graph().as_default():
+            batch_features = None
+            batch_labels = None
+            if dataset is not None:
+                shape = [512]
+                if self.param['transfer'] == 'conv1':
+                    shape = [46, 55, 46, 45]
+                batch_features, batch_labels = dataset.next_batch([shape])
+                batch_features = batch_features[0]
             images = tf.placeholder(dtype=tf.float32,
                                     shape=[None,
                                            self.param['depth'],
@@ -113,9 +150,8 @@ class TransferToptune:
                                            self.param['width'],
                                            self.param['channels']],
                                     name=mode+'images')
-            labels = tf.placeholder(dtype=tf.int8,
-                                    shape=[None, self.param['classes']],
-                                    name=mode+'labels')
+            labels = placeholder(tf.int8, [None, self.param['classes']],
+                                 mode + 'labels', batch_labels)
             keep_prob = tf.placeholder(tf.float32, name=mode+'keep_prob')
             global_step = tf.get_variable(name=mode+'global_step',
                                           shape=[],
@@ -142,17 +178,17 @@ class TransferToptune:
                 with tf.name_scope('Train'+mode) as scope:
                     logits = []
                     if self.param['transfer'] == 'fullcn':
-                        transfer_input = tf.placeholder(dtype=tf.float32,
-                                                shape = [None, 512],
-                                                name=mode + 'transfer_input')
+                        transfer_input = placeholder(tf.float32, [None, 512],
+                                                     mode + 'transfer_input',
+                                                     batch_features)
                         logits = self.inference_fullcn(transfer_input)
 
                         self.cnnutils.inference_loss(logits, labels)
                     if self.param['transfer'] == 'conv1':
-                        transfer_input = tf.placeholder(dtype=tf.float32,
-                                                        shape=[None, 46, 55,
-                                                               46, 45],
-                                                name=mode + 'transfer_input')
+                        transfer_input = placeholder(tf.float32,
+                                                     [None, 46, 55, 46, 45],
+                                                     mode + 'transfer_input',
+                                                     batch_features)
                         logits = self.cnnutils.inference_conv2(
                             transfer_input, keep_prob)
                         self.cnnutils.inference_loss(logits, labels)
@@ -194,38 +230,28 @@ class TransferToptune:
                 summary_op = tf.summary.merge_all()
                 tf.get_default_graph().finalize()
 
-                for i in range(0, len(validation_data.files)):
-                    validation_data.batch_index[i] = 0
-                    validation_data.shuffle()
-                    train_data.batch_index[i] = 0
-                    train_data.shuffle()
+                validation_data.reset()
+                train_data.reset()
 
                 for step in range(1, num_steps):
                     print("Step:", step,"Total:", num_steps)
                     start_time = time.time()
-                    _, image_data, label_data = train_data.next_batch()
-                    layer_path = ''
-                    if self.param['transfer'] == 'fullcn':
-                        layer_path = 'TrainADNI_T1/ADNI_T1fullcn2/ADNI_T1fullcn2:0'
-                    elif self.param['transfer'] == 'conv1':
-                        layer_path = 'conv1'
-                    features_images = self.cnnutils.get_features("ADNI_T1",
-                                                                 self.param[
-                                                                     'meta_path'],
-                                                                 image_data,
-                                                                 layer_path)
-                    summary_values, _, loss_value, cross_loss, l2_loss = sess.run(
-                        [summary_op,
-                         train_op,
-                         total_loss,
-                         xloss,
-                         l2loss],
-                        feed_dict={
-                            transfer_input: features_images,
-                            labels: label_data,
-                            keep_prob: self.param['keep_prob']
-                        }
-                    )
+                    feed_dict = {keep_prob: self.param['keep_prob']}
+                    fetches = [summary_op, train_op, total_loss, xloss,
+                               l2loss]
+                    if dataset is None:
+                        _, features_images, label_data = \
+                            self.transfer_features(train_data)
+                        feed_dict.update({transfer_input: features_images,
+                                          labels: label_data})
+                    elif step % 50 == 0:
+                        # The batch of the pipeline for the batch accuracy
+                        fetches += [transfer_input, labels]
+                    outputs = sess.run(fetches, feed_dict=feed_dict)
+                    summary_values, _, loss_value, cross_loss, l2_loss = \
+                        outputs[:5]
+                    if len(outputs) > 5:
+                        features_images, label_data = outputs[5:]
                     if step % num_batches_epoch == 0 or (step + 1) == num_steps:
                         checkpoint_path = self.param['checkpoint_path'] + \
                                           'transfer_model.ckpt'
@@ -257,11 +283,8 @@ class TransferToptune:
 
                     # Saving Model Checkpoints for evaluation
                     if step % num_batches_epoch == 0 or (step + 1) == num_steps:
-                        for i in range(0, len(validation_data.files)):
-                            validation_data.batch_index[i] = 0
-                            validation_data.shuffle()
-                            train_data.batch_index[i] = 0
-                            train_data.shuffle()
+                        validation_data.reset()
+                        train_data.reset()
 
                         # Evaluate against the training data.
                         print("Step: %d Training accuracy: %g " %
@@ -289,11 +312,8 @@ class TransferToptune:
                                                      loss=total_loss,
                                                      xloss=xloss,
                                                      l2loss=l2loss)))
-                        for i in range(0, len(validation_data.files)):
-                            validation_data.batch_index[i] = 0
-                            validation_data.shuffle()
-                            train_data.batch_index[i] = 0
-                            train_data.shuffle()
+                        validation_data.reset()
+                        train_data.reset()
                     sys.stdout.flush()
                 '''
                 if test == True:
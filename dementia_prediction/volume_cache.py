@@ -0,0 +1,163 @@
+"""
+This module contains a cache of decompressed MR images for the input classes.
+
+Every gzipped NIfTI image is converted once into a contiguous float32 .npy file
+in the cache folder. Later reads memory-map that file instead of decompressing
+the image again. An index maps each source image to its cache file together
+with the size and modification time of the source when it was converted, so
+that a changed source image is converted again.
+"""
+
+import os
+import pickle
+import hashlib
+import tempfile
+import threading
+import numpy as np
+import nibabel as nb
+
+
+def temporary_file(path):
+    """
+    Returns: a new temporary file in the folder of 'path', opened for
+    writing, whose name is unique across processes and threads
+    """
+    # Created with mkstemp, and kept when closed
+    return tempfile.NamedTemporaryFile(dir=os.path.dirname(path),
+                                       suffix='.tmp', delete=False)
+
+
+class VolumeCache:
+    """
+    Initialize this class with the cache folder. Set 'check' to 'hash' to
+    validate cache entries with the md5 of the source image in addition to
+    its size and modification time.
+    """
+
+    def __init__(self, cache_dir, check='mtime'):
+        self.cache_dir = cache_dir
+        self.check = check
+        self.index_path = os.path.join(cache_dir, 'index.pkl')
+        self.index = {}
+        # Guards the index, which threads of a prefetching pool update
+        self.lock = threading.Lock()
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as filep:
+                self.index = pickle.load(filep)
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Returns: the cache configured with the 'volume_cache' folder and the
+        optional 'volume_cache_check' mode of the cnn parameters, None if no
+        cache folder is set.
+        """
+        if not params.get('volume_cache'):
+            return None
+        return cls(params['volume_cache'],
+                   params.get('volume_cache_check', 'mtime'))
+
+    @staticmethod
+    def file_hash(filename):
+        md5 = hashlib.md5()
+        with open(filename, 'rb') as filep:
+            for chunk in iter(lambda: filep.read(1 << 20), b''):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+    def cache_path(self, filename):
+        """
+        Returns: the cache file of a source image, unique per source path
+        """
+        name = filename.rsplit('/', 1)[-1].split('.nii')[0]
+        key = hashlib.md5(os.path.abspath(filename).encode()).hexdigest()
+        return os.path.join(self.cache_dir, name + '_' + key[:12] + '.npy')
+
+    def source_state(self, filename):
+        stat = os.stat(filename)
+        state = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        if self.check == 'hash':
+            state['md5'] = self.file_hash(filename)
+        return state
+
+    def is_valid(self, entry, state):
+        if entry is None or not os.path.exists(entry['path']):
+            return False
+        return all(entry.get(key) == value for key, value in state.items())
+
+    def convert(self, filename, state):
+        """
+        Decompresses a source image into its float32 cache file.
+        """
+        path = self.cache_path(filename)
+        image = np.asarray(nb.load(filename).dataobj, dtype=np.float32)
+        # Write to a temporary file of its own first so that concurrent
+        # readers never see a partially written cache file
+        with temporary_file(path) as filep:
+            np.save(filep, np.ascontiguousarray(image))
+        os.replace(filep.name, path)
+        entry = dict(state)
+        entry.update({'path': path, 'shape': image.shape})
+        with self.lock:
+            self.index[filename] = entry
+            self.save_index()
+        return entry
+
+    def save_index(self):
+        """
+        Writes the index, the caller holds the lock.
+        """
+        with temporary_file(self.index_path) as filep:
+            pickle.dump(self.index, filep)
+        os.replace(filep.name, self.index_path)
+
+    def load(self, filename):
+        """
+        Returns: a read-only memory-mapped float32 view of the image, the
+        image is converted first if it is not cached or has changed.
+        """
+        state = self.source_state(filename)
+        entry = self.index.get(filename)
+        if not self.is_valid(entry, state):
+            entry = self.convert(filename, state)
+        return np.load(entry['path'], mmap_mode='r')
+
+    def warm(self, filenames):
+        """
+        Converts all given images ahead of training.
+        """
+        for filename in filenames:
+            self.load(filename)
+        print("Cached", len(filenames), "images in", self.cache_dir,
+              flush=True)
+
+    def __getstate__(self):
+        # Worker processes get their own lock
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+
+def load_volume(filename, cache=None, augmented=None):
+    """
+    Loads an MR image from the cache if one is given, else from the NIfTI
+    file.
+    Args:
+        filename: path of the NIfTI image
+        cache: VolumeCache or None
+        augmented: AugmentationManifest which resamples its augmented images
+                   from their source images, or None
+
+    Returns: the image array
+    """
+    if augmented is not None:
+        return augmented.load(filename, cache)
+    if cache is not None:
+        return cache.load(filename)
+    return np.asanyarray(nb.load(filename).dataobj)
@@ -0,0 +1,145 @@
+"""
+This module contains a single-pass accumulator for the voxel-wise mean and
+variance of a set of MR images.
+
+The statistics are updated with Welford's algorithm for every image and
+partial results of parallel workers are combined with the pairwise update of
+Chan et al., so every training image has to be read only once.
+
+References:
+    T.F. Chan, G.H. Golub and R.J. LeVeque. Updating formulae and a pairwise
+    algorithm for computing sample variances. Technical Report STAN-CS-79-773,
+    Stanford University, 1979
+"""
+
+import os
+import numpy as np
+
+
+class VoxelStatistics:
+    """
+    Running voxel-wise mean and sum of squared deviations (M2) of images
+    of a fixed size. The filenames of the accumulated images are kept so
+    that a saved state can be resumed with only the images added since.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self.mean = np.zeros(size, dtype=np.float64)
+        self.m2 = np.zeros(size, dtype=np.float64)
+        self.files = []
+
+    def update(self, image, filename=None):
+        """
+        Adds a single image to the statistics.
+        Args:
+            image: image array with 'size' voxels
+            filename: path of the image, recorded for resuming
+        """
+        image = np.asarray(image, dtype=np.float64).ravel()
+        self.count += 1
+        delta = image - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (image - self.mean)
+        if filename is not None:
+            self.files.append(filename)
+
+    def merge(self, other):
+        """
+        Combines the statistics of another accumulator into this one.
+        Args:
+            other: VoxelStatistics of a disjoint set of images
+
+        Returns: self
+        """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count = other.count
+            self.mean = other.mean.copy()
+            self.m2 = other.m2.copy()
+        else:
+            count = self.count + other.count
+            delta = other.mean - self.mean
+            self.mean += delta * (other.count / count)
+            self.m2 += other.m2 + np.square(delta) * \
+                (self.count * other.count / count)
+            self.count = count
+        self.files += other.files
+        return self
+
+    @classmethod
+    def from_std(cls, mean, std, files, ddof=1):
+        """
+        Returns: the accumulator of the images 'files' with the given
+        voxel-wise mean and standard deviation with 'ddof' delta degrees of
+        freedom
+        """
+        stats = cls(np.size(mean))
+        stats.count = len(files)
+        stats.mean = np.asarray(mean, dtype=np.float64).ravel().copy()
+        stats.m2 = np.square(np.asarray(std, dtype=np.float64).ravel()) * \
+            (stats.count - ddof)
+        stats.files = list(files)
+        return stats
+
+    def variance(self, ddof=1):
+        """
+        Returns: the voxel-wise variance with 'ddof' delta degrees of freedom
+        """
+        return self.m2 / (self.count - ddof)
+
+    def std(self, ddof=1):
+        """
+        Returns: the voxel-wise standard deviation, by default the sample
+        standard deviation as used for the dataset normalization
+        """
+        return np.sqrt(self.variance(ddof))
+
+    def save(self, path):
+        """
+        Stores the accumulator state in a .npz file.
+        """
+        # np.savez appends .npz to names without it, write to the exact path
+        with open(path, 'wb') as filep:
+            np.savez(filep, count=self.count, mean=self.mean, m2=self.m2,
+                     files=np.array(self.files, dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Restores an accumulator state stored with save().
+        """
+        state = np.load(path)
+        stats = cls(state['mean'].size)
+        stats.count = int(state['count'])
+        stats.mean = state['mean']
+        stats.m2 = state['m2']
+        stats.files = state['files'].tolist()
+        return stats
+
+    @classmethod
+    def resume(cls, path, size, filenames):
+        """
+        Loads the saved state at 'path' if it only covers images among
+        'filenames', otherwise starts from an empty accumulator.
+        Args:
+            path: path of the saved state
+            size: number of voxels per image
+            filenames: all images the statistics should cover
+
+        Returns: (stats, new_files) where new_files are the images that still
+        have to be accumulated
+        """
+        stats = cls(size)
+        if os.path.exists(path):
+            saved = cls.load(path)
+            if set(saved.files) <= set(filenames) and saved.size == size:
+                stats = saved
+            else:
+                print("Statistics in", path, "contain removed images, "
+                      "recomputing", flush=True)
+        seen = set(stats.files)
+        new_files = [f for f in filenames if f not in seen]
+        return stats, new_files
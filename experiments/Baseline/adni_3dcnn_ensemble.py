@@ -12,6 +12,7 @@ from pathos.multiprocessing import ProcessPool
 from dementia_prediction.config_wrapper import Config
 from dementia_prediction.data_input import DataInput
 from dementia_prediction.cnn_baseline.ensemble_models import CNNEnsembleModels
+from dementia_prediction.manifest import load_patients
 
 # Parse the parameter file
 config = Config()
@@ -22,9 +23,9 @@ config.parse(path.abspath(args.paramfile))
 params = config.config.get('parameters')
 paths = config.config.get('data_paths')
 
-patients_dict = pickle.load(open(paths['class_labels'], 'rb'))
-train_patients = pickle.load(open(paths['train_data'], 'rb'))
-valid_patients = pickle.load(open(paths['valid_data'], 'rb'))
+patients_dict = load_patients(paths, 'class_labels')
+train_patients = load_patients(paths, 'train_data', 'train')
+valid_patients = load_patients(paths, 'valid_data', 'valid')
 print("Valid Patients:", len(valid_patients), "Train:", len(train_patients))
 cad_patients = pickle.load(open(paths['cad_dict'], 'rb'))
 print("CAD:", len(cad_patients))
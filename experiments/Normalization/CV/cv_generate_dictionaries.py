@@ -7,6 +7,7 @@ import sys
 import subprocess
 
 from dementia_prediction.config_wrapper import Config
+from dementia_prediction.manifest import Manifest, load_patients
 
 config = Config()
 parser = argparse.ArgumentParser(description="Generate Cross Validation dictionaries")
@@ -16,8 +17,11 @@ config.parse(path.abspath(args.paramfile))
 params = config.config.get('data_paths')
 
 
-patients_dict = pickle.load(open(params['class_labels'], 'rb'))
+patients_dict = load_patients(params, 'class_labels')
 print("Patients", len(patients_dict))
+# With a 'manifest', the folds are added to its 'dataset' instead of being
+# written as pickle files
+manifest = Manifest.from_params(params)
 
 s_codes = []
 p_codes = []
@@ -56,6 +60,10 @@ for i in range(0, 10):
     valid_patients = s_codes[s_start:s_end]+p_codes[p_start:p_end]
     print("Train: ", len(train_patients))
     print("Valid: ", len(valid_patients))
+    if manifest is not None:
+        manifest.add_split(params['dataset'], i+1, 'train', train_patients)
+        manifest.add_split(params['dataset'], i+1, 'valid', valid_patients)
+        continue
     with open(params['dictionary_path']+'OASIS_train_'+str(i+1)+'.pkl', 'wb') as filep:
         pickle.dump(train_patients, filep)    
     with open(params['dictionary_path']+'OASIS_valid_'+str(i+1)+'.pkl', 'wb') as filep:
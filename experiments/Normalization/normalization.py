@@ -1,11 +1,11 @@
 from os import path
-import pickle
 import argparse
 import re
 
 from pathos.multiprocessing import ProcessPool
 from dementia_prediction.config_wrapper import Config
 from dementia_prediction.normalize import Normalize
+from dementia_prediction.manifest import load_patients
 
 config = Config()
 parser = argparse.ArgumentParser(description="Normalize data")
@@ -15,10 +15,10 @@ config.parse(path.abspath(args.paramfile))
 params = config.config.get('parameters')
 print("Params:", params, flush=True)
 
-valid_dict = pickle.load(open(params['valid_path'], 'rb'))
+valid_dict = load_patients(params, 'valid_path', 'valid')
 print("Valid", len(valid_dict), "Patients")
 
-train_dict = pickle.load(open(params['train_path'], 'rb'))
+train_dict = load_patients(params, 'train_path', 'train')
 print("Train", len(train_dict), "Patients")
 
 norm_object = Normalize(params, train_dict, valid_dict)
@@ -50,12 +50,8 @@ train_patients, valid_patients = norm_object.get_files(params['per_image_out'],
 all_patients = train_patients + valid_patients
 print("All patients:", len(all_patients), "Train:", len(train_patients), "Valid:", len(valid_patients), flush=True)
 if params['only_test'] == 'True':
-    mean_path  = params['norm_mean_var'] + params['mode'] + '_data_mean.pkl'
-    with open(mean_path, 'rb') as filep:
-        norm_object.mean_norm = pickle.load(filep)
-    var_path = params['norm_mean_var'] + params['mode'] + '_data_var.pkl'
-    with open(var_path, 'rb') as filep:
-        norm_object.var_norm = pickle.load(filep)
+    norm_object.mean_norm, norm_object.var_norm = \
+        norm_object.load_statistics()
     print("mean:", len(norm_object.mean_norm), "Var:", len(norm_object.var_norm))
 else:
     print("Finding mean, var normalization of ", len(train_patients), "images", flush=True)
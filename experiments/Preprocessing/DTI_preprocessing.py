@@ -4,11 +4,17 @@ import sys
 
 from dementia_prediction.config_wrapper import Config
 from dementia_prediction.preprocessing.data_pipeline import DataPipeline
+from dementia_prediction.preprocessing.dag import PreprocessingGraph
 
 config = Config()
 
 parser = argparse.ArgumentParser(description="Preprocess the T1 data")
 parser.add_argument("paramfile", type=str, help='Path to the parameter file')
+parser.add_argument("--stages", nargs='+',
+                    help='Run only these stages and the stages they depend on')
+parser.add_argument("--start", nargs='+',
+                    help='Run only these stages and the stages depending on '
+                         'them')
 args = parser.parse_args()
 
 config.parse(path.abspath(args.paramfile))
@@ -21,131 +27,89 @@ ref_path = '/home/rams/4_Sem/Thesis/Data/NIFTI_1/CON018/DTI_avg_study_template.n
 pipeline = DataPipeline(in_folder=data_path,
                         params=config.config.get('parameters'))
 DTI = 'DTI_MD'
-
-if pipeline.eddy_correction():
-    print("Eddy corrected")
-if pipeline.brain_extraction(regex=r'-DTI_eddy_corrected\.nii\.gz$',
-                             split_on='.nii.gz', bias=False):
-    print("Extraction of brain from DTI is successful.")
-else:
-    print("Error extracting brain images from DTI.")
-
-if pipeline.calculate_tensor(
-        out_folder='/home/rams/4_Sem/Thesis/Data/DTI_data/'):
-    print("Successful")
+data = '/home/rams/4_Sem/Thesis/Data/'
+
+# The stages and their dependencies. With a 'record' in the 'scheduler'
+# parameters, a stage only writes the outputs whose inputs or tool
+# parameters changed.
+graph = PreprocessingGraph()
+graph.add('eddy_correction', pipeline.eddy_correction)
+graph.add('brain_extraction', pipeline.brain_extraction,
+          deps=['eddy_correction'], regex=r'-DTI_eddy_corrected\.nii\.gz$',
+          split_on='.nii.gz', bias=False)
+graph.add('tensor', pipeline.calculate_tensor, deps=['brain_extraction'],
+          out_folder=data + 'DTI_data/')
 
 # Align the MO images to the T1 images for a patient
-if pipeline.DTI_registration(regex=r"-DTI_MD\.nii\.gz$", ref_path='T1',
-                             suffix='_T1_aligned.nii.gz',
-                             in_folder='/home/rams/4_Sem/Thesis/Data/NIFTI/',
-                             out_folder='/home/rams/4_Sem/Thesis/Data/DTI_MD_T1'
-                                        '/'):
-    print("Successful")
+graph.add('md_t1', pipeline.DTI_registration, deps=['tensor'],
+          regex=r"-DTI_MD\.nii\.gz$", ref_path='T1',
+          suffix='_T1_aligned.nii.gz', in_folder=data + 'NIFTI/',
+          out_folder=data + 'DTI_MD_T1/')
 # Align the T1 aligned images to a specific subject
-if pipeline.DTI_registration(regex=r"-DTI_MD_T1_aligned\.nii\.gz$",
-                             ref_path='/home/rams/4_Sem/Thesis/Data/DTI_MD_T1/'
-                                      'CON018-DTI_MD_T1_aligned.nii.gz',
-                             suffix='_subject.nii.gz',
-                             in_folder='/home/rams/4_Sem/Thesis/Data/DTI_MD'
-                                       '_T1/',
-                             out_folder='/home/rams/4_Sem/Thesis/Data/DTI_MD_subject/'
-                             ):
-    print("Successful")
+graph.add('md_subject', pipeline.DTI_registration, deps=['md_t1'],
+          regex=r"-DTI_MD_T1_aligned\.nii\.gz$",
+          ref_path=data + 'DTI_MD_T1/CON018-DTI_MD_T1_aligned.nii.gz',
+          suffix='_subject.nii.gz', in_folder=data + 'DTI_MD_T1/',
+          out_folder=data + 'DTI_MD_subject/')
 # Find the average study specific template
-if pipeline.average_template(regex=r"-DTI_MD_T1_aligned_subject\.nii\.gz$",
-                             in_folder='/home/rams/4_Sem/Thesis/Data/DTI_MD'
-                                       '_subject/',
-                             out_folder='/home/rams/4_Sem/Thesis/Data/DTI_MD_avg'
-                                        '/',
-                             avg_filename='DTI_MD_avg_template.nii.gz'):
-    print("Successful")
+graph.add('md_template', pipeline.average_template, deps=['md_subject'],
+          regex=r"-DTI_MD_T1_aligned_subject\.nii\.gz$",
+          in_folder=data + 'DTI_MD_subject/', out_folder=data + 'DTI_MD_avg/',
+          avg_filename='DTI_MD_avg_template.nii.gz')
 # Align the images to the study specific template
-if pipeline.DTI_registration(regex=r"-DTI_MD_T1_aligned\.nii\.gz$",
-                             ref_path='/home/rams/4_Sem/Thesis/Data/DTI_MD_avg/'
-                                      'DTI_MD_avg_template.nii.gz',
-                             suffix='_average.nii.gz',
-                             in_folder='/home/rams/4_Sem/Thesis/Data/DTI_MD_T1/',
-                             out_folder='/home/rams/4_Sem/Thesis/Data/DTI_MD_avg/'
-                             ):
-    print("Successful")
-
+graph.add('md_average', pipeline.DTI_registration,
+          deps=['md_t1', 'md_template'],
+          regex=r"-DTI_MD_T1_aligned\.nii\.gz$",
+          ref_path=data + 'DTI_MD_avg/DTI_MD_avg_template.nii.gz',
+          suffix='_average.nii.gz', in_folder=data + 'DTI_MD_T1/',
+          out_folder=data + 'DTI_MD_avg/')
 
 # Align the MO images to the T1 images for a patient
-if pipeline.DTI_registration(regex=r"-CBF\.nii\.gz$", ref_path='T1',
-                             suffix='_T1_aligned.nii.gz',
-                             in_folder='/home/rams/4_Sem/Thesis/Data/NIFTI/',
-                             out_folder='/home/rams/4_Sem/Thesis/Data/CBF_T1'
-                                        '/'):
-    print("Successful")
-
+graph.add('cbf_t1', pipeline.DTI_registration,
+          regex=r"-CBF\.nii\.gz$", ref_path='T1',
+          suffix='_T1_aligned.nii.gz', in_folder=data + 'NIFTI/',
+          out_folder=data + 'CBF_T1/')
 # Align the T1 aligned images to a specific subject
-if pipeline.DTI_registration(regex=r"-CBF_T1_aligned\.nii\.gz$",
-                             ref_path='/home/rams/4_Sem/Thesis/Data/CBF_T1/'
-                                      'CON018-CBF_T1_aligned.nii.gz',
-                             suffix='_subject.nii.gz',
-                             in_folder='/home/rams/4_Sem/Thesis/Data/CBF'
-                                       '_T1/',
-                             out_folder='/home/rams/4_Sem/Thesis/Data/CBF_subject/'
-                             ):
-    print("Successful")
+graph.add('cbf_subject', pipeline.DTI_registration, deps=['cbf_t1'],
+          regex=r"-CBF_T1_aligned\.nii\.gz$",
+          ref_path=data + 'CBF_T1/CON018-CBF_T1_aligned.nii.gz',
+          suffix='_subject.nii.gz', in_folder=data + 'CBF_T1/',
+          out_folder=data + 'CBF_subject/')
 # Find the average study specific template
-if pipeline.average_template(regex=r"-CBF_T1_aligned_subject\.nii\.gz$",
-                             in_folder='/home/rams/4_Sem/Thesis/Data/CBF'
-                                       '_subject/',
-                             out_folder='/home/rams/4_Sem/Thesis/Data/CBF_avg'
-                                        '/',
-                             avg_filename='CBF_avg_template.nii.gz'):
-    print("Successful")
+graph.add('cbf_template', pipeline.average_template, deps=['cbf_subject'],
+          regex=r"-CBF_T1_aligned_subject\.nii\.gz$",
+          in_folder=data + 'CBF_subject/', out_folder=data + 'CBF_avg/',
+          avg_filename='CBF_avg_template.nii.gz')
 
 # Align the images to the study specific template
-if pipeline.DTI_registration(regex=r"-"+DTI+"_T1_aligned\.nii\.gz$",
-                             ref_path='/home/rams/4_Sem/Thesis/Data/'+DTI
-                                     +'_avg/'+DTI+'_avg_template.nii.gz',
-                             suffix='_average.nii.gz',
-                             in_folder='/home/rams/4_Sem/Thesis/Data/'+DTI\
-                                              +'_T1_5/',
-                             out_folder='/home/rams/4_Sem/Thesis/Data/'+DTI\
-                                              +'_avg/'
-                             ):
-    print("Successful")
-
-
-if pipeline.gaussian_smoothing(regex=
-                               r"-"+DTI+"_T1_aligned_average\.nii\.gz$",
-                            split_on= "_T1_aligned_average.nii.gz",
-                            in_folder='/home/rams/4_Sem/Thesis/Data/'+DTI\
-                                              +'_avg/',
-                            out_folder='/home/rams/4_Sem/Thesis/Data/'+DTI\
-                                              +'_smoothed/'
-                            ):
-    print("Successful")
-
-if pipeline.subsample(regex=r"-"+DTI+"_smoothed\.nii\.gz$", split_on=
-"_smoothed.nii.gz", in_folder='/home/rams/4_Sem/Thesis/Data/'+DTI\
-                                              +'_smoothed/',
-                      out_folder='/home/rams/4_Sem/Thesis/Data/'+DTI\
-                                              +'_subsampled/'):
-    print("Successful")
-if pipeline.move(regex=r"-DTI_FA_subsampled\.nii\.gz$"):
-    print("Successful")
-
-if pipeline.rotate(regex=r"-"+DTI+"_subsampled\.nii\.gz$",
-                   split_on="_subsampled.nii.gz",
-                   in_folder='/home/rams/4_Sem/Thesis/Data/'+DTI\
-                                              +'_subsampled/',
-                   out_folder='/home/rams/4_Sem/Thesis/Data/'+DTI\
-                                              +'_rot/',
-                   angle=5):
-    print("Successful")
-
-if pipeline.rot_trans(regex=r"-"+DTI+"_subsampled\.nii\.gz$",
-                      split_on="_subsampled.nii.gz",
-                      in_folder='/home/rams/4_Sem/Thesis/Data/'+DTI \
-                              + '_subsampled/',
-                      out_folder='/home/rams/4_Sem/Thesis/Data/' + DTI \
-                              + '_data_aug/'
-                      ):
-    print("Successful")
-if pipeline.move(regex=r"-DTI_MO\.nii\.gz$",
-                 out='/home/rams/4_Sem/Thesis/Data/DTI'):
-    print("Successful")
+graph.add('average', pipeline.DTI_registration, deps=['md_template'],
+          regex=r"-"+DTI+"_T1_aligned\.nii\.gz$",
+          ref_path=data + DTI + '_avg/' + DTI + '_avg_template.nii.gz',
+          suffix='_average.nii.gz', in_folder=data + DTI + '_T1_5/',
+          out_folder=data + DTI + '_avg/')
+graph.add('smoothing', pipeline.gaussian_smoothing,
+          deps=['md_average', 'average'],
+          regex=r"-"+DTI+"_T1_aligned_average\.nii\.gz$",
+          split_on="_T1_aligned_average.nii.gz",
+          in_folder=data + DTI + '_avg/', out_folder=data + DTI + '_smoothed/')
+graph.add('subsampling', pipeline.subsample, deps=['smoothing'],
+          regex=r"-"+DTI+"_smoothed\.nii\.gz$", split_on="_smoothed.nii.gz",
+          in_folder=data + DTI + '_smoothed/',
+          out_folder=data + DTI + '_subsampled/')
+graph.add('move_fa', pipeline.move, deps=['subsampling'],
+          regex=r"-DTI_FA_subsampled\.nii\.gz$")
+graph.add('rotation', pipeline.rotate, deps=['subsampling'],
+          regex=r"-"+DTI+"_subsampled\.nii\.gz$",
+          split_on="_subsampled.nii.gz", in_folder=data + DTI + '_subsampled/',
+          out_folder=data + DTI + '_rot/', angle=5)
+graph.add('rot_trans', pipeline.rot_trans, deps=['subsampling'],
+          regex=r"-"+DTI+"_subsampled\.nii\.gz$",
+          split_on="_subsampled.nii.gz", in_folder=data + DTI + '_subsampled/',
+          out_folder=data + DTI + '_data_aug/')
+graph.add('move_mo', pipeline.move, deps=['tensor'],
+          regex=r"-DTI_MO\.nii\.gz$", out=data + 'DTI')
+
+if graph.run(args.stages, args.start):
+    print("DTI preprocessing is successful.")
+else:
+    print("Error in DTI preprocessing.")
@@ -4,6 +4,7 @@ import sys
 
 from dementia_prediction.config_wrapper import Config
 from dementia_prediction.preprocessing.data_pipeline import DataPipeline
+from dementia_prediction.preprocessing.dag import PreprocessingGraph
 
 config = Config()
 
@@ -19,6 +20,9 @@ data_path = path.abspath(paths['data'])
 pipeline = DataPipeline(in_folder=data_path,
                         params=config.config.get('parameters'))
 
-if pipeline.ASL_preprocess():
+graph = PreprocessingGraph()
+graph.add('tag_control', pipeline.ASL_preprocess)
+
+if graph.run():
     print("ASL preprocessing.")
 
@@ -0,0 +1,133 @@
+"""
+Benchmarks the T1 preprocessing graph on a synthetic cohort with the
+simulated FSL executor: the throughput for a number of workers, and the
+commands run again after no change and after one changed image.
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import nibabel as nb
+import scipy.ndimage as snd
+
+from dementia_prediction.preprocessing.data_pipeline import DataPipeline
+from dementia_prediction.preprocessing.dag import PreprocessingGraph
+from dementia_prediction.preprocessing.instrumentation import \
+    ResourceProfile
+
+parser = argparse.ArgumentParser(description="Benchmark the preprocessing "
+                                             "with simulated FSL tools")
+parser.add_argument("--subjects", type=int, default=16,
+                    help='Number of synthetic subjects')
+parser.add_argument("--shape", type=int, nargs=3, default=[64, 64, 64],
+                    help='Image shape')
+parser.add_argument("--workers", type=int, nargs='+', default=[1, 2, 4, 8],
+                    help='Numbers of workers to compare')
+parser.add_argument("--scale", type=float, default=0.005,
+                    help='Factor of the simulated tool costs')
+parser.add_argument("--jitter", type=float, default=0.2,
+                    help='Log-normal noise of the simulated costs')
+args = parser.parse_args()
+
+
+def synthetic_t1(filename, rng):
+    """
+    Writes a noisy ellipsoid 'head' of random size in a 2 mm image
+    """
+    grid = np.indices(args.shape, dtype=np.float32)
+    center = (np.array(args.shape, dtype=np.float32) - 1) / 2
+    radii = center * rng.uniform(0.6, 0.8, 3)
+    distance = np.sqrt(sum(((grid[axis] - center[axis]) / radii[axis]) ** 2
+                           for axis in range(0, 3)))
+    image = 600 * (distance < 1) + 200 * (distance < 0.6) + \
+        30 * rng.rand(*args.shape)
+    image = snd.gaussian_filter(image, 1).astype(np.float32)
+    nb.save(nb.Nifti1Image(image, np.diag([2, 2, 2, 1])), filename)
+
+
+def run(folder, workers):
+    """
+    Runs the T1 graph on the cohort in 'folder'.
+
+    Returns: (seconds, number of commands run)
+    """
+    profile = os.path.join(folder, 'profile.json')
+    if os.path.exists(profile):
+        os.remove(profile)
+    params = {'bet': {'frac_intens_thres': 0.3},
+              'registration': {'cost': 'corratio', 'searchcost': 'corratio',
+                               'gauss_smooth_sigma': 2},
+              'catalog_dir': os.path.join(folder, 'catalog'),
+              'scheduler': {'workers': workers, 'profile': profile,
+                            'record': os.path.join(folder, 'record.json'),
+                            'executor': {'type': 'simulated',
+                                         'scale': args.scale,
+                                         'jitter': args.jitter, 'seed': 0}}}
+    data = os.path.join(folder, 'T1') + '/'
+    pipeline = DataPipeline(in_folder=data, params=params)
+    graph = PreprocessingGraph()
+    graph.add('brain_extraction', pipeline.brain_extraction,
+              regex=r'-T1\.nii\.gz$', split_on='.nii.gz', bias=True)
+    graph.add('registration', pipeline.linear_registration,
+              deps=['brain_extraction'],
+              ref_path=data + 'REF001-T1.nii.gz', iteration=0)
+    graph.add('smoothing', pipeline.gaussian_smoothing,
+              deps=['registration'],
+              regex=r"-T1_brain_avg_template_aligned\.nii\.gz$",
+              split_on="_avg_template_aligned.nii.gz", in_folder=data,
+              out_folder=folder + '/T1_smoothed/')
+    graph.add('subsampling', pipeline.subsample, deps=['smoothing'],
+              regex=r"-T1_brain_smoothed\.nii\.gz$",
+              split_on="_smoothed.nii.gz",
+              in_folder=folder + '/T1_smoothed/',
+              out_folder=folder + '/T1_subsampled/')
+    start = time.time()
+    if not graph.run():
+        raise RuntimeError("Preprocessing failed in " + folder)
+    elapsed = time.time() - start
+    commands = 0
+    if os.path.exists(profile):
+        commands = len(ResourceProfile(profile).commands)
+    return elapsed, commands
+
+
+tmp = tempfile.mkdtemp()
+rng = np.random.RandomState(0)
+cohort = os.path.join(tmp, 'cohort')
+os.makedirs(cohort)
+for subject in range(0, args.subjects):
+    synthetic_t1(os.path.join(cohort, 'SUB{0:03d}-T1.nii.gz'.format(subject)),
+                 rng)
+shutil.copy(os.path.join(cohort, 'SUB000-T1.nii.gz'),
+            os.path.join(cohort, 'REF001-T1.nii.gz'))
+
+results = []
+for workers in args.workers:
+    folder = os.path.join(tmp, 'workers_' + str(workers))
+    os.makedirs(folder + '/T1_smoothed')
+    os.makedirs(folder + '/T1_subsampled')
+    shutil.copytree(cohort, folder + '/T1')
+    elapsed, commands = run(folder, workers)
+    results.append((workers, elapsed, commands))
+
+# Incremental rebuilds, on the cohort of the last run
+unchanged = run(folder, args.workers[-1])
+synthetic_t1(os.path.join(folder, 'T1', 'SUB001-T1.nii.gz'),
+             np.random.RandomState(1))
+changed = run(folder, args.workers[-1])
+
+print("\nSubjects:", args.subjects, "Shape:", args.shape, "Scale:",
+      args.scale)
+print("{0:>8}{1:>10}{2:>10}{3:>16}{4:>10}".format(
+    'Workers', 'Seconds', 'Commands', 'Subjects/hour', 'Speedup'))
+for workers, elapsed, commands in results:
+    print("{0:>8}{1:>10.1f}{2:>10}{3:>16.0f}{4:>10.2f}".format(
+        workers, elapsed, commands, (args.subjects + 1) * 3600 / elapsed,
+        results[0][1] / elapsed))
+print("Rerun without changes: {0} commands in {1:.1f} s".format(
+    unchanged[1], unchanged[0]))
+print("Rerun after changing one image: {0} commands in {1:.1f} s".format(
+    changed[1], changed[0]))
+shutil.rmtree(tmp)
@@ -4,11 +4,17 @@ import sys
 
 from dementia_prediction.config_wrapper import Config
 from dementia_prediction.preprocessing.data_pipeline import DataPipeline
+from dementia_prediction.preprocessing.dag import PreprocessingGraph
 
 config = Config()
 
 parser = argparse.ArgumentParser(description="Preprocess the T1 data")
 parser.add_argument("paramfile", type=str, help='Path to the parameter file')
+parser.add_argument("--stages", nargs='+',
+                    help='Run only these stages and the stages they depend on')
+parser.add_argument("--start", nargs='+',
+                    help='Run only these stages and the stages depending on '
+                         'them')
 args = parser.parse_args()
 
 config.parse(path.abspath(args.paramfile))
@@ -21,47 +27,37 @@ ref_path = path.abspath(paths['ref'])
 pipeline = DataPipeline(in_folder=data_path,
                         params=config.config.get('parameters'))
 
-if pipeline.brain_extraction(regex=r'-T1\.nii\.gz$',
-                             split_on='.nii.gz', bias=True):
-    print("Extraction of brain from T1_weighted MRI is successful.")
+# The stages and their dependencies. With a 'record' in the 'scheduler'
+# parameters, a stage only writes the outputs whose inputs or tool
+# parameters changed.
+graph = PreprocessingGraph()
+graph.add('brain_extraction', pipeline.brain_extraction,
+          regex=r'-T1\.nii\.gz$', split_on='.nii.gz', bias=True)
+graph.add('registration', pipeline.linear_registration,
+          deps=['brain_extraction'], ref_path=ref_path, iteration=0)
+graph.add('smoothing', pipeline.gaussian_smoothing, deps=['registration'],
+          regex=r"-T1_brain_avg_template_aligned\.nii\.gz$",
+          split_on="_avg_template_aligned.nii.gz",
+          in_folder='/home/rams/4_Sem/Thesis/Data/T1_brain_avg/',
+          out_folder='/home/rams/4_Sem/Thesis/Data/T1_brain_smoothed/')
+graph.add('subsampling', pipeline.subsample, deps=['smoothing'],
+          regex=r"-T1_brain_smoothed\.nii\.gz$",
+          split_on="_smoothed.nii.gz",
+          in_folder='/home/rams/4_Sem/Thesis/Data/T1_brain_smoothed/',
+          out_folder='/home/rams/4_Sem/Thesis/Data/T1_brain_subsampled/')
+graph.add('rotation', pipeline.rotate, deps=['subsampling'],
+          regex=r"-T1_brain_subsampled\.nii\.gz$",
+          split_on="_subsampled.nii.gz",
+          in_folder='/home/rams/4_Sem/Thesis/Data/T1_brain_subsampled/',
+          out_folder='/home/rams/4_Sem/Thesis/Data/T1_brain_subsampled/',
+          angle=5)
+graph.add('rot_trans', pipeline.rot_trans, deps=['subsampling'],
+          regex=r"-T1_brain_subsampled\.nii\.gz$",
+          split_on="_subsampled.nii.gz",
+          in_folder='/home/rams/4_Sem/Thesis/Data/T1_brain_subsampled/',
+          out_folder='/home/rams/4_Sem/Thesis/Data/T1_brain_subsampled/')
+
+if graph.run(args.stages, args.start):
+    print("T1 preprocessing is successful.")
 else:
-    print("Error extracting brain images from T1_weighted MRI.")
-
-
-if pipeline.linear_registration(ref_path, 0):
-    print("Registered the brain images to a study specific template "
-          "successfully.")
-else:
-    print("Error in registering extracted brain images to a study specific "
-          "template")
-
-if pipeline.gaussian_smoothing(regex= r"-T1_brain_avg_template_aligned\.nii\.gz$",
-                                split_on="_avg_template_aligned.nii.gz",
-                               in_folder='/home/rams/4_Sem/Thesis/Data/T1_brain_avg/',
-                               out_folder='/home/rams/4_Sem/Thesis/Data/T1_brain_smoothed/'
-                               ):
-    print("Successful smoothing of the brain images with given gaussian "
-          "parameters.")
-else:
-    print("Error in gaussian smoothing of brain images.")
-
-
-pipeline.subsample(regex=r"-T1_brain_smoothed\.nii\.gz$",
-                   split_on="_smoothed.nii.gz",
-                   in_folder='/home/rams/4_Sem/Thesis/Data/T1_brain_smoothed/',
-                   out_folder='/home/rams/4_Sem/Thesis/Data'
-                              '/T1_brain_subsampled/'
-                   )
-pipeline.rotate(regex=r"-T1_brain_subsampled\.nii\.gz$",
-                split_on="_subsampled.nii.gz",
-                in_folder='/home/rams/4_Sem/Thesis/Data/T1_brain_subsampled/',
-                out_folder='/home/rams/4_Sem/Thesis/Data/T1_brain_subsampled/',
-                angle=5
-                )
-pipeline.rot_trans(regex=r"-T1_brain_subsampled\.nii\.gz$",
-                   split_on="_subsampled.nii.gz",
-                   in_folder='/home/rams/4_Sem/Thesis/Data'
-                             '/T1_brain_subsampled/',
-                   out_folder='/home/rams/4_Sem/Thesis/Data'
-                             '/T1_brain_subsampled/'
-                   )
+    print("Error in T1 preprocessing.")
@@ -0,0 +1,72 @@
+"""
+Benchmarks the native tensor fitting on synthetic DWI data with known
+tensors, against a fit of one voxel at a time.
+"""
+import time
+import argparse
+import numpy as np
+
+from dementia_prediction.preprocessing import native
+
+parser = argparse.ArgumentParser(description="Benchmark the tensor fitting")
+parser.add_argument("--shape", type=int, nargs=3, default=[96, 96, 60],
+                    help='Image shape')
+parser.add_argument("--directions", type=int, default=30,
+                    help='Number of diffusion directions, plus one b0')
+parser.add_argument("--bval", type=float, default=1000, help='b-value')
+parser.add_argument("--noise", type=float, default=0.01,
+                    help='Standard deviation of the noise relative to S0')
+parser.add_argument("--chunk", type=int, default=100000,
+                    help='Voxels per chunk')
+parser.add_argument("--loop_voxels", type=int, default=2000,
+                    help='Voxels fitted one at a time for the comparison')
+args = parser.parse_args()
+
+rng = np.random.RandomState(0)
+voxels = int(np.prod(args.shape))
+
+# Gradient directions on the sphere and one b0 volume
+bvecs = rng.randn(3, args.directions)
+bvecs /= np.linalg.norm(bvecs, axis=0)
+bvecs = np.concatenate([np.zeros((3, 1)), bvecs], axis=1)
+bvals = np.concatenate([[0], np.full(args.directions, args.bval)])
+design = native.tensor_design(bvals, bvecs)
+
+# Random tensors with white matter like eigenvalues
+eigenvalues = np.stack([rng.uniform(1.2e-3, 1.8e-3, voxels),
+                        rng.uniform(0.2e-3, 0.6e-3, voxels),
+                        rng.uniform(0.2e-3, 0.6e-3, voxels)], axis=1)
+rotations = np.linalg.qr(rng.randn(voxels, 3, 3))[0]
+tensors = np.einsum('vij,vj,vkj->vik', rotations, eigenvalues, rotations)
+coefficients = np.stack([np.log(np.full(voxels, 1000.0)),
+                         tensors[:, 0, 0], tensors[:, 1, 1], tensors[:, 2, 2],
+                         tensors[:, 0, 1], tensors[:, 0, 2],
+                         tensors[:, 1, 2]], axis=1)
+signals = np.exp(coefficients.dot(design.T))
+signals += rng.randn(*signals.shape) * args.noise * 1000
+signals = signals.astype(np.float32)
+mean = eigenvalues.mean(axis=1, keepdims=True)
+true_fa = np.sqrt(1.5) * np.linalg.norm(eigenvalues - mean, axis=1) / \
+    np.linalg.norm(eigenvalues, axis=1)
+print("Voxels:", voxels, "Volumes:", len(bvals))
+
+start = time.time()
+fa = np.empty(voxels)
+for chunk in range(0, voxels, args.chunk):
+    fa[chunk:chunk + args.chunk] = native.fit_tensors(
+        signals[chunk:chunk + args.chunk], design)['FA']
+batched = time.time() - start
+print("Batched fit: {0:.2f} s, {1:.0f} voxels/s".format(
+    batched, voxels / batched))
+print("FA error: mean {0:.4f}, max {1:.4f}".format(
+    np.mean(np.abs(fa - true_fa)), np.max(np.abs(fa - true_fa))))
+
+start = time.time()
+for voxel in range(0, args.loop_voxels):
+    fit = np.linalg.lstsq(design, np.log(signals[voxel]), rcond=None)[0]
+    tensor = np.array([[fit[1], fit[4], fit[5]], [fit[4], fit[2], fit[6]],
+                       [fit[5], fit[6], fit[3]]])
+    np.linalg.eigh(tensor)
+loop = (time.time() - start) / args.loop_voxels * voxels
+print("Voxel by voxel fit (extrapolated): {0:.2f} s, speedup {1:.0f}x".format(
+    loop, loop / batched))
@@ -0,0 +1,111 @@
+"""
+Microbenchmark of the batch assembly in the input classes.
+
+Compares building a batch with repeated np.append (the previous
+implementation) against filling a preallocated array and a reused
+BatchBuffer. Images are generated in memory, so only the assembly is timed.
+Peak memory is measured with tracemalloc.
+
+Usage: python experiments/benchmarks/batch_assembly.py [--repeat 5]
+
+Output of 'python experiments/benchmarks/batch_assembly.py --repeat 5' on one
+core of an Intel Xeon with Python 3.11 and NumPy 2.4, the preallocated batch
+takes 3-11x less time and half the peak memory of np.append:
+
+    method      batch  channels     ms/batch     peak MiB
+    np.append       6         1         18.5         37.9
+    prealloc        6         1          4.5         20.7
+    reused          6         1          4.3         20.7
+    np.append       6         3        152.8        124.0
+    prealloc        6         3         45.2         62.0
+    reused          6         3         39.4         62.0
+    np.append      12         1        101.3         79.2
+    prealloc       12         1         20.6         41.3
+    reused         12         1         12.5         41.3
+    np.append      12         3        550.2        247.9
+    prealloc       12         3         88.1        124.0
+    reused         12         3         69.3        124.0
+    np.append      24         1        381.2        161.8
+    prealloc       24         1         35.6         82.6
+    reused         24         1         20.0         82.6
+    np.append      24         3       1443.0        495.8
+    prealloc       24         3        162.7        247.9
+    reused         24         3        127.9        247.9
+"""
+
+import argparse
+import time
+import tracemalloc
+import numpy as np
+
+from dementia_prediction.batch_buffer import BatchBuffer
+
+IMAGE_SHAPE = [91, 109, 91]
+
+
+def append_batch(images, channels):
+    batch_images = np.array([], np.float32)
+    for mri_image in images:
+        channel_images = np.array([], np.float32)
+        for index in range(0, channels):
+            image = np.reshape(mri_image, [1] + IMAGE_SHAPE + [1])
+            if len(channel_images) == 0:
+                channel_images = image
+            else:
+                channel_images = np.append(channel_images, image, axis=4)
+        if len(batch_images) == 0:
+            batch_images = channel_images
+        else:
+            batch_images = np.append(batch_images, channel_images, axis=0)
+    return batch_images
+
+
+def buffer_batch(images, channels, buffer):
+    batch_images = buffer.get([len(images)] + IMAGE_SHAPE + [channels])
+    for iterate, mri_image in enumerate(images):
+        for index in range(0, channels):
+            batch_images[iterate, :, :, :, index] = mri_image
+    return batch_images
+
+
+def measure(function, repeat):
+    tracemalloc.start()
+    start = time.time()
+    for i in range(0, repeat):
+        function()
+    duration = (time.time() - start) / repeat
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, peak / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batch assembly")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--batch_sizes", type=int, nargs='+',
+                        default=[6, 12, 24])
+    args = parser.parse_args()
+
+    format_str = '%-10s %6s %9s %12s %12s'
+    print(format_str % ('method', 'batch', 'channels', 'ms/batch',
+                        'peak MiB'))
+    for batch_size in args.batch_sizes:
+        images = [np.random.rand(*IMAGE_SHAPE).astype(np.float32)
+                  for i in range(0, batch_size)]
+        for channels in [1, 3]:
+            reused = BatchBuffer(num_buffers=1)
+            methods = [
+                ('np.append', lambda: append_batch(images, channels)),
+                ('prealloc', lambda: buffer_batch(images, channels,
+                                                  BatchBuffer())),
+                ('reused', lambda: buffer_batch(images, channels, reused)),
+            ]
+            for name, function in methods:
+                duration, peak = measure(function, args.repeat)
+                print('%-10s %6d %9d %12.1f %12.1f' % (name, batch_size,
+                                                       channels,
+                                                       duration * 1000, peak))
+
+
+if __name__ == '__main__':
+    main()
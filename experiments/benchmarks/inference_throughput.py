@@ -0,0 +1,108 @@
+"""
+Benchmark of the inference throughput against the batch size.
+
+Builds the inference graph of each model family with an open batch
+dimension: the baseline 3D CNN, and the fusion models on the concatenated
+conv1 feature maps and on the concatenated conv7 features. The variables are
+initialized randomly, or restored from '--checkpoint' for a family whose
+variables it contains, since the throughput does not depend on their values.
+Each batch size is scored on random inputs after a warm-up run.
+
+Usage: python experiments/benchmarks/inference_throughput.py
+       [--families baseline fusion_conv1] [--batch_sizes 1 4 16] [--repeat 5]
+"""
+
+import argparse
+import time
+import numpy as np
+import tensorflow as tf
+
+from dementia_prediction.cnn_baseline.cnn_model import CNN
+from dementia_prediction.cnn_utils import CNNUtils
+
+IMAGE_SHAPE = [91, 109, 91, 1]
+# Input shape of each family without the batch dimension
+INPUT_SHAPES = {'baseline': IMAGE_SHAPE,
+                'fusion_conv1': [46, 55, 46, 135],
+                'fusion_conv7': [1, 1, 1, 1536]}
+
+
+def build(family, params, inputs, keep_prob):
+    """
+    Returns: the logits of the family for the input placeholder
+    """
+    if family == 'baseline':
+        model = CNN(params)
+        return model.cnnutils.inference_conv2(model.inference(inputs),
+                                              keep_prob)
+    cnnutils = CNNUtils(params)
+    if family == 'fusion_conv1':
+        return cnnutils.fusion_conv1(inputs, keep_prob)
+    return cnnutils.fusion_conv7(inputs, keep_prob)
+
+
+def measure(family, params, batch_sizes, repeat, checkpoint=None):
+    """
+    Returns: the seconds per batch of each batch size
+    """
+    durations = []
+    with tf.Graph().as_default():
+        inputs = tf.placeholder(dtype=tf.float32,
+                                shape=[None] + INPUT_SHAPES[family],
+                                name='inputs')
+        keep_prob = tf.placeholder(tf.float32, name='keep_prob')
+        logits = build(family, params, inputs, keep_prob)
+        config = tf.ConfigProto()
+        config.gpu_options.allow_growth = True
+        config.allow_soft_placement = True
+        with tf.Session(config=config) as sess:
+            sess.run(tf.global_variables_initializer())
+            if checkpoint:
+                tf.train.Saver().restore(sess, checkpoint)
+            for batch_size in batch_sizes:
+                data = np.random.rand(*([batch_size] +
+                                        INPUT_SHAPES[family])).astype(
+                    np.float32)
+                feed_dict = {inputs: data, keep_prob: 1.0}
+                sess.run(logits, feed_dict=feed_dict)
+                start = time.time()
+                for i in range(0, repeat):
+                    sess.run(logits, feed_dict=feed_dict)
+                durations.append((time.time() - start) / repeat)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the inference "
+                                                 "throughput")
+    parser.add_argument("--families", type=str, nargs='+',
+                        default=sorted(INPUT_SHAPES),
+                        choices=sorted(INPUT_SHAPES))
+    parser.add_argument("--batch_sizes", type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--mode", type=str, default='T1',
+                        help='Modality prefix of the baseline variables')
+    parser.add_argument("--checkpoint", type=str,
+                        help='Checkpoint to restore, for a single family')
+    args = parser.parse_args()
+
+    params = {'cnn': {'mode': args.mode, 'classes': 2, 'decay_const': 0,
+                      'channels': IMAGE_SHAPE[3], 'depth': IMAGE_SHAPE[0],
+                      'height': IMAGE_SHAPE[1], 'width': IMAGE_SHAPE[2],
+                      'batch_size': args.batch_sizes[0],
+                      'feature_sessions': 0},
+              'mlp': 'False'}
+    format_str = '%-14s %6s %12s %14s'
+    print(format_str % ('family', 'batch', 'ms/batch', 'volumes/sec'))
+    for family in args.families:
+        durations = measure(family, params, args.batch_sizes, args.repeat,
+                            args.checkpoint)
+        for batch_size, duration in zip(args.batch_sizes, durations):
+            print('%-14s %6d %12.1f %14.1f' % (family, batch_size,
+                                               duration * 1000,
+                                               batch_size / duration))
+
+
+if __name__ == '__main__':
+    main()
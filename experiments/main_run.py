@@ -1,7 +1,4 @@
 from os import path
-import os
-import pickle
-import re
 import argparse
 import sys
 import nibabel as nb
@@ -10,17 +7,20 @@ import math
 
 from pathos.multiprocessing import ProcessPool
 from dementia_prediction.config_wrapper import Config
+from dementia_prediction.catalog import Catalog
 
 from dementia_prediction.data_input import DataInput
 from dementia_prediction.fusion_input import FusionDataInput
 from dementia_prediction.multichannel_input import MultichannelDataInput
 
 from dementia_prediction.data_input_perceptron import DataInputPerceptron
+from dementia_prediction.prefetch import PrefetchDataInput
 from dementia_prediction.cnn_baseline.cnn_model import CNN
 from dementia_prediction.multimodal.multimodal_fusion import CNNMultimodal
 from dementia_prediction.cnn_baseline.ensemble_models import CNNEnsembleModels
 from dementia_prediction.transfer_learning.adni_toptuning import TransferToptune
 from dementia_prediction.multimodal.multimodal_toptuning import FusionToptune
+from dementia_prediction.manifest import load_patients
 # Parse the parameter file
 config = Config()
 parser = argparse.ArgumentParser(description="Run the Baseline model")
@@ -31,9 +31,9 @@ params = config.config.get('parameters')
 paths = config.config.get('data_paths')
 
 # All patients class labels dictionary and list of validation patient codes
-patients_dict = pickle.load(open(paths['class_labels'], 'rb'))
-valid_patients = pickle.load(open(paths['valid_data'], 'rb'))
-train_patients = pickle.load(open(paths['train_data'], 'rb'))
+patients_dict = load_patients(paths, 'class_labels')
+valid_patients = load_patients(paths, 'valid_data', 'valid')
+train_patients = load_patients(paths, 'train_data', 'train')
 print("Validation patients count in Dict: ", len(valid_patients),
       "Train patients count in Dict:", len(train_patients))
 
@@ -45,42 +45,27 @@ multitask = ['']
 # If True, multitask takes all the modalities as input to the same network
 if params['multitask'] == 'True':
     multitask = range(0, 3)
+regex = r""+params['regex']+"$"
 for modality in multitask:
-    for directory in os.walk(paths['datadir'+str(modality)]):
-        # Walk inside the directory
-        for file in directory[2]:
-            # Match all files ending with 'regex'
-            input_file = os.path.join(directory[0], file)
-            regex = r""+params['regex']+"$"
-            if re.search(regex, input_file):
-                pat_code = input_file.rsplit(params['split_on'])
-                patient_code = pat_code[0].rsplit('/', 1)[1]
-                if patient_code in train_patients:
-                    train_filenames[patients_dict[patient_code]].append(
-                        input_file)
-                if patient_code in valid_patients:
-                    valid_filenames[patients_dict[patient_code]].append(
-                        input_file)
+    # The file lists come from the catalog index of the data folder, which
+    # only lists the folders changed since the last run
+    catalog = Catalog.from_params(params, paths['datadir'+str(modality)])
+    modality_train = catalog.files_per_class(regex, params['split_on'],
+                                             patients_dict, train_patients,
+                                             classes)
+    modality_valid = catalog.files_per_class(regex, params['split_on'],
+                                             patients_dict, valid_patients,
+                                             classes)
+    for i in range(0, classes):
+        train_filenames[i] += modality_train[i]
+        valid_filenames[i] += modality_valid[i]
 
 for i in range(0, classes):
     print("Train Class ", i, len(train_filenames[i]))
     print("Valid Class ", i, len(valid_filenames[i]))
 
-'''
-# For augmentation of data on the fly
-aug_train = [[] for i in range(0, classes)]
-for i in range(0, classes):
-    for filename in train_filenames[i]:
-        aug_train[i].append(filename)
-        for direction in ['x','y','z']:
-            aug_train[i].append(filename+'rot'+direction)
-            aug_train[i].append(filename+'trans'+direction)
-train_filenames = aug_train
-print("After augmentation:")
-for i in range(0, classes):
-    print("Train Class ", i, len(train_filenames[i]))
-    print("Valid Class ", i, len(valid_filenames[i]))
-'''
+# Training images are augmented on the fly with the 'augmentation' section
+# of the cnn parameters, see dementia_prediction/augmentation.py
 
 train_data = DataInput(params=config.config.get('parameters'),
                        data=train_filenames,
@@ -134,5 +119,13 @@ if params['multimodal'] == 'ensemble':
     cnn_model = CNNEnsembleModels(params=config.config.get('parameters'))
 if params['tl'] == 'toptune':
     cnn_model = TransferToptune(params=config.config.get('parameters'))
-cnn_model.train(train_data, validation_data, True)
+# Read the batches in the background if 'prefetch' is set
+train_data = PrefetchDataInput.from_params(params['cnn'], train_data)
+validation_data = PrefetchDataInput.from_params(params['cnn'], validation_data)
+try:
+    cnn_model.train(train_data, validation_data, True)
+finally:
+    for data in [train_data, validation_data]:
+        if isinstance(data, PrefetchDataInput):
+            data.close()
 